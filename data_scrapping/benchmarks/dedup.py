@@ -0,0 +1,63 @@
+"""
+************************************************
+TIMING OF THE CROSS-SOURCE DUPLICATE DETECTION
+************************************************
+Runs utils.dedup.assign_property_ids over every snapshot in data_output, then
+over copies of them made to look like distinct listings (their districts,
+addresses and urls suffixed with the copy number) to show how it scales to
+tens of thousands of rows.
+
+Usage: python data_scrapping/benchmarks/dedup.py [copies]
+"""
+import glob
+import time
+import os.path
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+import pandas as pd
+
+from utils.dedup import assign_property_ids
+from utils.schema import read_listings
+
+SNAPSHOTS = os.path.join(os.path.dirname(__file__), '..', '..', 'data_output', '*.csv')
+
+
+def scale(listings:pd.DataFrame, copies:int):
+    """
+    Concatenates copies of listings that block and match only within their own copy.
+    """
+    parts = []
+    for copy in range(copies):
+        part = listings.copy()
+        # 'SW18' becomes 'SW180', no longer a district of another copy
+        part['location'] = part['location'].astype('string') + str(copy)
+        for column in ('address', 'listing_url'):
+            part[column] = part[column].astype('string') + f' x{copy}'
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def benchmark(listings:pd.DataFrame, repeats:int=3):
+    """
+    Returns the best time of repeats runs in seconds, and the number of properties found.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = assign_property_ids(listings)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result['property_id'].nunique()
+
+
+if __name__ == "__main__":
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    paths = sorted(glob.glob(SNAPSHOTS))
+    listings = pd.concat([read_listings(path) for path in paths], ignore_index=True)
+    print(f'snapshots: {", ".join(os.path.basename(path) for path in paths)}')
+
+    for data in (listings, scale(listings, copies)):
+        seconds, properties = benchmark(data)
+        print(f'{len(data):>7} listings -> {properties:>7} properties in {seconds:.3f}s')
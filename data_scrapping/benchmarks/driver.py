@@ -0,0 +1,64 @@
+"""
+************************************************
+PAGE BANDWIDTH AND LOAD TIME OF THE DRIVER CONFIGURATIONS
+************************************************
+Loads the same search pages with the driver configuration the scrapers used to
+start (full page load, nothing blocked) and with the fast defaults of
+utils.driver.get_driver (eager page load, images, fonts, media and trackers
+blocked), and reports the mean transfer size and load time per page.
+
+Usage: python data_scrapping/benchmarks/driver.py [pages] [--windowed]
+"""
+import os.path
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+from utils.driver import PageMetrics, get_driver, load_page
+
+URLS = [
+    'https://www.rightmove.co.uk/property-to-rent/find.html?locationIdentifier=REGION%5E87490&index={}',
+    'https://www.onthemarket.com/to-rent/property/london/?page={}&view=grid',
+]
+
+CONFIGURATIONS = {
+    'before': dict(page_load_strategy='normal', block_resources=False, block_trackers=False),
+    'after': dict(),
+}
+
+
+def benchmark(urls, headless=None):
+    """
+    Loads urls once per configuration, each with a fresh driver.
+
+    Parameters:
+        - urls (list): The pages to load.
+        - headless (bool, optional): Passed on to get_driver, so the old windowed start up
+          can be compared on a desktop.
+
+    Returns:
+        dict of configuration name -> PageMetrics.
+    """
+    results = {}
+    for name, config in CONFIGURATIONS.items():
+        metrics = PageMetrics()
+        driver = get_driver(headless=headless, **config)
+        try:
+            for url in urls:
+                load_page(driver, url, metrics)
+        finally:
+            driver.quit()
+        results[name] = metrics
+    return results
+
+
+if __name__ == "__main__":
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 3
+    headless = False if '--windowed' in sys.argv else None
+
+    urls = [url.format(page if 'page=' in url else page * 24) for url in URLS for page in range(1, pages + 1)]
+    results = benchmark(urls, headless)
+
+    for name, metrics in results.items():
+        print(f'{name:>6}: {metrics.bytes / 1024 / metrics.pages:8.0f} kB  '
+              f'{metrics.requests / metrics.pages:5.0f} requests  {metrics.seconds / metrics.pages:6.2f}s per page')
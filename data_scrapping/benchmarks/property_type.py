@@ -0,0 +1,116 @@
+"""
+************************************************
+MICRO-BENCHMARK OF THE PROPERTY TYPE CLASSIFIER
+************************************************
+Compares the ten re.search if/elif chain the OnTheMarket and Zoopla scrapers
+used with the single pass classifier in utils.property_type, on the titles of
+a saved OnTheMarket snapshot, and checks that both give the same types.
+
+Usage: python data_scrapping/benchmarks/property_type.py [snapshot.csv] [repeats]
+"""
+import re
+import timeit
+import os.path
+import sys
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+import pandas as pd
+
+from utils.property_type import get_property_type, classify_property_types
+
+SNAPSHOT = os.path.join(os.path.dirname(__file__), '..', '..', 'data_output', 'omt_2024-08-24.csv')
+
+
+def regex_chain(property_desc:str):
+    """
+    The original per type re.search chain, kept as the baseline.
+
+    Parameters:
+        - property_desc (str): The first line of the listing title.
+
+    Returns:
+        The capitalized property type, or None when no known type is mentioned.
+    """
+    match_semi = re.search(r'\bsemi-detached\b', property_desc)
+    match_flat = re.search(r'\bflat\b', property_desc)
+    match_apartment = re.search(r'\bapartment\b', property_desc)
+    match_studio = re.search(r'\bStudio\b', property_desc)
+    match_terraced = re.search(r'\bterraced\b', property_desc)
+    match_penthouse = re.search(r'\bpenthouse\b', property_desc)
+    match_duplex = re.search(r'\bduplex\b', property_desc)
+    match_house = re.search(r'\bhouse\b', property_desc)
+    match_detached = re.search(r'\bdetached\b', property_desc)
+    match_maisonette = re.search(r'\bmaisonette\b', property_desc)
+
+    if match_semi is not None:
+        return match_semi.group(0).capitalize()
+
+    elif match_flat is not None:
+        return match_flat.group(0).capitalize()
+
+    elif match_apartment is not None:
+        return match_apartment.group(0).capitalize()
+
+    elif match_studio is not None:
+        return match_studio.group(0).capitalize()
+
+    elif match_terraced is not None:
+        return match_terraced.group(0).capitalize()
+
+    elif match_penthouse is not None:
+        return match_penthouse.group(0).capitalize()
+
+    elif match_duplex is not None:
+        return match_duplex.group(0).capitalize()
+    
+    elif match_detached is not None:
+        return match_detached.group(0).capitalize()
+
+    elif match_house is not None:
+        return match_house.group(0).capitalize()
+
+    elif match_maisonette is not None:
+        return match_maisonette.group(0).capitalize()
+
+    else:
+        return None
+
+
+def benchmark(titles:pd.Series, repeats:int=20):
+    """
+    Times the chain, the single pass classifier and the batch classifier over titles.
+
+    Parameters:
+        - titles (Series): Listing titles.
+        - repeats (int): Number of runs; the best one is reported.
+
+    Returns:
+        dict of seconds per run for each classifier.
+    """
+    values = titles.tolist()
+
+    chain = [regex_chain(title) for title in values]
+    single = [get_property_type(title) for title in values]
+    batch = classify_property_types(titles).tolist()
+    assert chain == single == batch, 'the classifiers disagree'
+
+    runs = {
+        'regex chain': lambda: [regex_chain(title) for title in values],
+        'single pass': lambda: [get_property_type(title) for title in values],
+        'batch': lambda: classify_property_types(titles),
+    }
+    return {name: min(timeit.repeat(run, number=1, repeat=repeats)) for name, run in runs.items()}
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else SNAPSHOT
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    titles = pd.read_csv(path, usecols=['description'], dtype=str)['description'].dropna().reset_index(drop=True)
+    timings = benchmark(titles, repeats)
+
+    baseline = timings['regex chain']
+    print(f'{len(titles)} titles from {os.path.basename(path)}, best of {repeats} runs')
+    for name, seconds in timings.items():
+        print(f'{name:>12}: {seconds * 1000:8.2f} ms  ({baseline / seconds:5.1f}x)')
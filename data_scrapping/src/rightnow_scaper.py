@@ -7,259 +7,115 @@ Date: May-20-2023
 
 """
 
-import datetime
-from datetime import timedelta
 import os.path
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-import pandas as pd
-from selenium.webdriver.common.by import By
+from utils import engine
+from utils.engine import SiteSpec
 
-from utils.utils import get_driver, merge_save
-rm_salesurl = "https://www.rightmove.co.uk/property-for-sale/find.html?locationIdentifier=REGION%5E87490&index={}&propertyTypes=&includeSSTC=false&mustHave=&dontShow=&furnishTypes=&keywords="
-rm_renturl = "https://www.rightmove.co.uk/property-to-rent/find.html?locationIdentifier=REGION%5E87490&index={}&propertyTypes=&includeLetAgreed=false&mustHave=&dontShow=&furnishTypes=&keywords="
+rm_salesurl = "https://www.rightmove.co.uk/property-for-sale/find.html?locationIdentifier=REGION%5E87490&index={}&propertyTypes=&includeSSTC=false&mustHave=&dontShow=&furnishTypes=&keywords=&sortType=6"
+rm_renturl = "https://www.rightmove.co.uk/property-to-rent/find.html?locationIdentifier=REGION%5E87490&index={}&propertyTypes=&includeLetAgreed=false&mustHave=&dontShow=&furnishTypes=&keywords=&sortType=6"
 
-def get_pages(driver,page,url):
+
+def parse_card(card):
     """
-    Retrieves the content of a web page using the provided Selenium WebDriver.
+    Reads the Rightmove specific columns out of the raw fields of one property card.
 
     Parameters:
-        - driver (WebDriver): The Selenium WebDriver instance used to access the web page.
-        - page (str): The name or identifier of the page being retrieved.
-        - url (str): The URL of the web page to be retrieved.
+        - card (dict): Raw field values keyed as in SPEC.card_fields.
 
     Returns:
-        The HTML content of the web page.
-    
+        dict of bedroom, bathroom, description, propertyType and agent.
     """
-
-    driver.get(url.format(page))
-    print(driver)
-    OM_DIV_TAG = 'propertyCard-wrapper'
-    page_html = driver.find_elements(By.CLASS_NAME, OM_DIV_TAG)
-    print(page_html)
-    return page_html
-    
-
-
-def extract_data(page_html:'page_html', transaction_type:str, source:str):
+    # Bedroom
+    try:
+        bedroom = card['bedroom'][0:1]
+    except:
+        bedroom = None
+
+    # Bathroom
+    try:
+        bathroom = card['bathroom'][0:1]
+    except:
+        bathroom = None
+
+    # property Type
+    try:
+        property_type = card['property_type'].split("\n")[0].strip()
+    except:
+        property_type = None
+
+    # Agent
+    try:
+        agent = card['agent'].split("by")[-1].strip()
+    except:
+        agent = None
+
+    return {
+        'bedroom': bedroom,
+        'bathroom': bathroom,
+        'description': card['description'],
+        'propertyType': property_type,
+        'agent': agent,
+        }
+
+
+SPEC = SiteSpec(
+    source='rightmove',
+    urls={'rent': rm_renturl, 'sales': rm_salesurl},
+    card_selector='.propertyCard-wrapper',
+    card_fields={
+        'address': ('.propertyCard-address', 'text'),
+        'bedroom': ('.propertyCard-content .bed-icon title', 'textContent'),
+        'bathroom': ('.propertyCard-content .bathroom-icon title', 'textContent'),
+        'description': ('.propertyCard-description', 'text'),
+        'property_type': ('.property-information', 'text'),
+        'price': ('.propertyCard-priceValue', 'text'),
+        'secondary_price': ('.propertyCard-secondaryPriceValue', 'text'),
+        'agent': ('.propertyCard-branchSummary', 'text'),
+        'listing_url': ('.propertyCard-link', 'href'),
+        'added_reduced': ('.propertyCard-branchSummary-addedOrReduced', 'text'),
+    },
+    parse_card=parse_card,
+    # '£3,683 pcm' and '£850 pw' for rents
+    price_text=('price', 'secondary_price'),
+    # 'Added today', 'Reduced on 15/08/2024', ...
+    listed_text='added_reduced',
+    # the url takes the offset of the first result, 24 results a page
+    pagination='index',
+    page_size=24,
+    first_page=0,
+    # searches stop at 42 pages (about 1,000 results), bigger ones are split into price bands
+    max_pages=42,
+    result_count=('.searchHeader-resultCount', r'([\d,]+)'),
+    price_params=('minPrice', 'maxPrice'),
+    bedroom_params=('minBedrooms', 'maxBedrooms'),
+    # the listing cards are in the server rendered html, so no browser is needed to fetch them
+    fetch_backend='http',
+    base_url='https://www.rightmove.co.uk',
+    # the results list, present once the search has rendered even when it has few cards
+    ready_selector='#l-searchResults',
+    # sortType=6 lists the newest first, so an incremental crawl can stop at known listings
+    newest_first=True,
+)
+
+
+def parse_page_source(html:str, transaction_type:str, source:str, base_url=None):
     """
-    Parses the given HTML content of a web page and extracts relevant information based on the provided transaction type and source.
-
-    Parameters:
-        - page_html (html elements): The HTML content of the web page to be parsed.
-        - transaction_type (str): The type of transaction for which information needs to be extracted.
-        - source (str): The source of the web page content.
-
-    Returns:
-        dataframe containing the data sccrapped from the website
-        
+    Extracts the raw listing rows from a captured or archived page source, see engine.parse_page_source.
     """
-    
-    page_data = []
-
-    for page in page_html:
-        # Transaction
-
-        try:
-            if transaction_type == 'rent':
-                transaction = transaction_type
-
-            elif transaction_type == 'sales':
-                transaction = transaction_type
-
-            else:
-                print('transaction_type can either be sales or rent')
-                break
-
-        except:
-                print('transaction_type can either be sales or rent')
-                break
-
-
-        
-        # Address
-        try:
-            address_tag = page.find_element(By.CLASS_NAME, "propertyCard-address")
-            address = address_tag.text
-        except:
-            address = None
-
-        # Bedroom
-        try:         
-            bedroom_element = page.find_element(By.CLASS_NAME,"propertyCard-content")
-            bedroom_span = bedroom_element.find_element(By.CLASS_NAME, "bed-icon")
-            inner_html = bedroom_span.get_attribute('innerHTML')
-
-            # use string formatting
-            title_start = "<title>"
-            title_end = "</title>"
-            title_index_start = inner_html.index(title_start) + len(title_start)
-            title_index_end = inner_html.index(title_end)
-            bedroom = inner_html[title_index_start:title_index_end][0:1]    
-
-            #.text.split("\n")[-1].strip()
-            # bedroom = bedroom_span.get_attribute('innerHTML')
-            # print(bedroom)
-            # # print(bedroom_span.get_attribute('title')        
-        
-        except:
-            bedroom = None
-     
-       
-        
-        # Bathroom
-        try:
-            
-            bathroom_tag =page.find_element(By.CLASS_NAME,"propertyCard-content")
-            bathroom_span = bathroom_tag.find_element(By.CLASS_NAME, "bathroom-icon")
-            inner_html2 = bathroom_span.get_attribute('innerHTML')
-
-            # use string formatting
-            title_start = "<title>"
-            title_end = "</title>"
-            title_index_start = inner_html2.index(title_start) + len(title_start)
-            title_index_end = inner_html2.index(title_end)
-            bathroom = inner_html2[title_index_start:title_index_end][0:1]    
-
-        except:
-            bathroom =None
-
-
-        # Description
-        try:
-            description_tag = page.find_element(By.CLASS_NAME, 'propertyCard-description')
-            description = description_tag.text
-
-        except:
-            description = None
-
-
-        # property Type
-        try:
-            property_type_tag =page.find_element(By.CLASS_NAME, 'property-information')
-            property_type =property_type_tag.text.split("\n")[0].strip()
+    return engine.parse_page_source(SPEC, html, transaction_type, source, base_url)
 
-        except:
-            property_type = None
-
-  
-        # rent payment
-        if transaction_type == 'rent':
-
-            sales_price = None
-            
-            # rent price per month
-            try:
-                pcm = page.find_element(By.CLASS_NAME, 'propertyCard-priceValue')
-                per_month = int(pcm.text.split(" ")[0].strip().split("£")[1].split(" ")[0].replace(',', ''))
-                
-            except:
-                per_month = None
-                
-            # rent price per week
-            try:
-                pw = page.find_element(By.CLASS_NAME, 'propertyCard-secondaryPriceValue')
-                per_week = int(pw.text.split(" ")[0].strip().split("£")[1].split(" ")[0].replace(",", ""))
-
-            except:
-                per_week = None               
-
-        else:
-            # sales Price
-            try:
-                per_week = None  
-                per_month = None
-                
-                price_tag = page.find_element(By.CLASS_NAME, 'propertyCard-priceValue')
-                sales_price = int(price_tag.text.split(" ")[0].strip().split("£")[1].split(" ")[0].replace(',', ''))
-                
-            except:
-                sales_price = None     
-
-        # Location
-        try:
-            location_tag = page.find_element(By.CLASS_NAME, 'propertyCard-address')
-            location = location_tag.text.split(" ")[-1].strip()
-            
-        
-        except:
-            location =None
-    
-
-        # Agent
-        try: 
-            agent_tag =page.find_element(By.CLASS_NAME, 'propertyCard-branchSummary')
-            # print(agent_tag.get_attribute('innerHTML'))
-            agent = agent_tag.text.split("by")[-1].strip()
-
-        except:
-            agent = None
-
-        #Listing Source
-        listing_source = source
-
-        # Listing URL
-        try:
-            listing_url_tag =page.find_element(By.CLASS_NAME, 'propertyCard-link')
-            listing_url = listing_url_tag.get_attribute('href')
-
-        except:
-            listing_url = None
-        
-
-        
-        # Date Added
-        try:
-            date_tag = page.find_element(By.CLASS_NAME, 'propertyCard-branchSummary-addedOrReduced')
-            # print(date_tag.get_attribute('innerHTML'))
-            added_reduced = date_tag.text
-            date_type = date_tag.text.split(" ")[0].strip()
-
-            # date
-            if added_reduced == 'Added today':
-                date = datetime.date.today()
-                
-            elif added_reduced== 'Added yesterday':
-                date = datetime.date.today() - timedelta(days=1)
-
-            elif added_reduced== 'Reduced today':
-                date = datetime.date.today()
-
-            elif added_reduced== 'Reduced yesterday':
-                date = datetime.date.today() - timedelta(days=1)
-
-            else:
-                date = date_tag.text.split()[-1].strip()
-        except:
-            date = None
-            date_type = None      
-
-
-        page_data.append({
-            'transaction': transaction,
-            'address': address,
-            'bedroom': bedroom,
-            'bathroom': bathroom,
-            'sales_price': sales_price,
-            'rent_perMonth': per_month,
-            'rent_perWeek': per_week,
-            'description': description,
-            'propertyType': property_type,
-            'location':location,
-            'agent':agent,
-            'listing_source':listing_source,
-            'listing_url':listing_url,
-            # 'date_type':date_type,
-            'listed_date':date,
-            })
-
-    return page_data
 
+def scrape_pages(url,transaction_type,source,pages, **kwargs):
+    """
+    Scrapes the given pages with the Rightmove spec, see engine.scrape_pages for the keyword arguments.
+    """
+    return engine.scrape_pages(SPEC, url, transaction_type, source, pages, **kwargs)
 
-def get_data(url,transaction_type,source,start_index, stop_index,increment):
 
+def get_data(url,transaction_type,source,start_index, stop_index,increment, **kwargs):
     """
     Retrieves data from a specific range of pages on a website based on the provided parameters.
 
@@ -268,43 +124,25 @@ def get_data(url,transaction_type,source,start_index, stop_index,increment):
         - transaction_type (str): The type of transaction for which data needs to be retrieved.
         - source (str): The source of the data.
         - start_index (int): The starting index of the pages to retrieve.
-        - stop_index (int): The ending index of the pages to retrieve (inclusive).
+        - stop_index (int): The ending index of the pages to retrieve (exclusive).
         - increment (int): The increment between page indices.
+        - kwargs: extraction, archive_dir, cache, seen, incremental, writer; see engine.scrape_pages.
 
     Returns:
         dataframe: Data retrieved from the specified pages.
 
     """
-
-    browser = get_driver()
-    all_pages_data = []
     print('runing.....................................')
 
-    for page in range(start_index, stop_index,increment):
-        
-        page_html = get_pages(browser,page,url)
-        pages_data = extract_data(page_html,transaction_type,source)
-        all_pages_data.extend(pages_data)
-
-    browser.quit()
-
-    data = pd.DataFrame(all_pages_data)
-    return data
+    pages = range(start_index, stop_index, increment)
+    return scrape_pages(url, transaction_type, source, pages, **kwargs)
 
 
 if __name__ == "__main__":
-    # Specify the start and end page numbers for scraping
-    start_index = 0
-    stop_index = 1100
-    increment = 24  
-    
-    # Call the get_data function to scrape the data
-    rent_data = get_data(rm_renturl,'rent','rightmove',start_index, stop_index,increment)
-    sales_data = get_data(rm_salesurl,'sales','rightmove',start_index, stop_index,increment)
-
-    #merge and save data as csv
-    merge_save(rent_data,sales_data)
+    # Crawl every page of the rent and sales searches, split into price bands past the page cap,
+    # on 4 processes into the day's snapshot csv; --incremental stops at the first page made
+    # mostly of listings already seen and --cache-only replays the cached pages without fetching
+    engine.run(SPEC, workers=4, incremental='--incremental' in sys.argv, cache_only='--cache-only' in sys.argv)
 
     # save scrapped data to csv
-    print('data scraped successfully')    
-
+    print('data scraped successfully')
@@ -0,0 +1,177 @@
+"""
+On-disk cache of fetched search pages.
+
+Pages are stored gzip compressed under the sha256 of their formatted url, with
+a small sqlite index recording size, fetch time and last access. Entries older
+than the TTL are refetched, and once the cache passes its size cap the least
+recently used pages are evicted. In cache-only mode nothing is fetched, which
+replays a crawl from disk, e.g. after extraction crashed.
+"""
+import gzip
+import hashlib
+import os
+import sqlite3
+import time
+
+
+class CacheMiss(KeyError):
+    """Raised in cache-only mode when a page is not cached."""
+
+
+class PageCache:
+    """
+    Compressed, size-bounded page cache keyed by url.
+
+    Parameters:
+        - directory (str): Folder holding the pages and the index.
+        - ttl (float): Seconds a page stays fresh, None to never expire.
+        - max_bytes (int): Size cap of the compressed pages.
+        - cache_only (bool): Serve from the cache only and raise CacheMiss instead of fetching.
+    """
+
+    def __init__(self, directory='data_output/page_cache', ttl=24 * 3600, max_bytes=500 * 1024 ** 2,
+                 cache_only=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.cache_only = cache_only
+        self._connection = None
+
+    # the sqlite connection is opened lazily so the cache can be sent to pool workers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(self.directory, 'index.sqlite'), timeout=30)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages '
+                '(key TEXT PRIMARY KEY, url TEXT, size INTEGER, fetched REAL, accessed REAL)'
+            )
+        return self._connection
+
+    @staticmethod
+    def key(url:str):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.html.gz')
+
+    def get(self, url:str):
+        """
+        Returns the cached html of url, or None when it is missing or expired.
+        """
+        key = self.key(url)
+        row = self.connection.execute('SELECT fetched FROM pages WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if self.ttl is not None and time.time() - row[0] > self.ttl and not self.cache_only:
+            return None
+
+        try:
+            with gzip.open(self._path(key), 'rt', encoding='utf-8') as file:
+                html = file.read()
+        except FileNotFoundError:
+            self.connection.execute('DELETE FROM pages WHERE key = ?', (key,))
+            self.connection.commit()
+            return None
+
+        self.connection.execute('UPDATE pages SET accessed = ? WHERE key = ?', (time.time(), key))
+        self.connection.commit()
+        return html
+
+    def put(self, url:str, html:str):
+        """
+        Stores the html of url and evicts old pages if the cache is over its cap.
+        """
+        key = self.key(url)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write then rename, so a crash never leaves a truncated page behind
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as file:
+            file.write(html)
+        os.replace(temp_path, path)
+
+        now = time.time()
+        self.connection.execute(
+            'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+            (key, url, os.path.getsize(path), now, now),
+        )
+        self.connection.commit()
+        self.evict()
+
+    def size(self):
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+
+    def evict(self):
+        """
+        Removes the least recently used pages until the cache fits its size cap.
+        """
+        excess = self.size() - self.max_bytes
+        if excess <= 0:
+            return
+
+        rows = self.connection.execute('SELECT key, size FROM pages ORDER BY accessed').fetchall()
+        for key, size in rows:
+            if excess <= 0:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self.connection.execute('DELETE FROM pages WHERE key = ?', (key,))
+            excess -= size
+        self.connection.commit()
+
+
+class CachedFetcher:
+    """
+    Wraps a fetcher so pages are served from a PageCache when possible.
+
+    Parameters:
+        - fetcher (HttpFetcher or SeleniumFetcher): The fetcher used on a miss, None in cache-only mode.
+        - cache (PageCache): The page cache.
+    """
+
+    def __init__(self, fetcher, cache:PageCache):
+        self.fetcher = fetcher
+        self.cache = cache
+
+    def get(self, url:str, refresh=False):
+        """
+        Returns the html of url from the cache, fetching and caching it on a miss.
+
+        Parameters:
+            - url (str): The page url.
+            - refresh (bool): Fetch the page even when it is cached, e.g. because the cached
+              copy came back empty. Ignored in cache-only mode.
+        """
+        html = self.cache.get(url) if not refresh or self.cache.cache_only or self.fetcher is None else None
+        if html is not None:
+            return html
+        if self.cache.cache_only or self.fetcher is None:
+            raise CacheMiss(url)
+
+        html = self.fetcher.get(url)
+        self.cache.put(url, html)
+        return html
+
+    @property
+    def driver(self):
+        return self.fetcher.driver
+
+    def close(self):
+        if self.fetcher is not None:
+            self.fetcher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,202 @@
+"""
+Cross-source duplicate detection.
+
+The same property is often listed on Rightmove, OnTheMarket and Zoopla. Rather
+than comparing every pair of listings, candidates are blocked on transaction,
+postcode district, bedrooms and a log-scale price bucket, and only listings
+sharing a block (or sitting in neighbouring price buckets) are scored, by the
+Jaccard similarity of their address tokens. Matched pairs are merged with
+union-find into properties, each given a canonical property_id.
+"""
+import hashlib
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# outward code of a UK postcode, e.g. SW18, N1, EC1A
+DISTRICT_PATTERN = re.compile(r'\b([A-Z]{1,2}\d[A-Z\d]?)\b')
+# address words carrying no information about which property it is
+ADDRESS_STOPWORDS = {'london', 'greater', 'uk', 'united', 'kingdom', 'the', 'of', 'and', 'flat', 'apartment'}
+ABBREVIATIONS = {'rd': 'road', 'st': 'street', 'ave': 'avenue', 'ln': 'lane', 'gdns': 'gardens', 'sq': 'square',
+                 'ct': 'court', 'pl': 'place', 'cres': 'crescent', 'terr': 'terrace', 'dr': 'drive', 'hse': 'house'}
+
+
+def postcode_district(location, address=None):
+    """
+    Normalizes a listing's location to its postcode district, e.g. ' sw18 ' -> 'SW18'.
+
+    Parameters:
+        - location (str): The location column, the last word of the address.
+        - address (str, optional): Searched for a district when location holds none.
+
+    Returns:
+        str: The district, the lowercased location when it is a town name, or None.
+    """
+    for text in (location, address):
+        if isinstance(text, str):
+            match = DISTRICT_PATTERN.search(text.upper())
+            if match:
+                return match.group(1)
+    if isinstance(location, str) and location.strip():
+        return location.strip().lower()
+    return None
+
+
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+# word -> normalized word, None for words dropped; the vocabulary of addresses is small
+_WORDS = {}
+
+
+def _normalize_word(word):
+    if word not in _WORDS:
+        normalized = ABBREVIATIONS.get(word, word)
+        dropped = normalized in ADDRESS_STOPWORDS or DISTRICT_PATTERN.fullmatch(normalized.upper())
+        _WORDS[word] = None if dropped else normalized
+    return _WORDS[word]
+
+
+def address_tokens(address):
+    """
+    Splits an address into a set of normalized words, without postcodes and stopwords.
+    """
+    if not isinstance(address, str):
+        return frozenset()
+    tokens = {_normalize_word(word) for word in WORD_PATTERN.findall(address.lower())}
+    tokens.discard(None)
+    return frozenset(tokens)
+
+
+def jaccard(first:frozenset, second:frozenset):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def price_buckets(price:pd.Series, tolerance:float):
+    """
+    Buckets prices on a log scale, so prices within tolerance of each other fall in the same
+    or neighbouring buckets.
+
+    Returns:
+        Series of bucket numbers, -1 where the price is missing.
+    """
+    values = pd.to_numeric(price, errors='coerce').astype('float64')
+    buckets = np.floor(np.log(values.where(values > 0)) / math.log1p(tolerance))
+    return buckets.fillna(-1).astype('int64')
+
+
+def find_duplicate_pairs(listings:pd.DataFrame, threshold=0.5, price_tolerance=0.1, cross_source_only=True):
+    """
+    Scores candidate pairs inside each block and keeps the likely duplicates.
+
+    Parameters:
+        - listings (DataFrame): Listings of any sources with the shared schema.
+        - threshold (float): Lowest address token Jaccard similarity of a duplicate pair.
+        - price_tolerance (float): Relative width of a price bucket.
+        - cross_source_only (bool): Only pair listings of different sources.
+
+    Returns:
+        dataframe of (left, right, score) with positional row numbers of listings.
+    """
+    data = listings.reset_index(drop=True)
+    price = data['sales_price'].astype('Float64').fillna(data['rent_perMonth'].astype('Float64'))
+    # plain lists, iterating arrow backed columns row by row is slow
+    locations = data['location'].astype(object).where(data['location'].notna(), None).tolist()
+    addresses = data['address'].astype(object).where(data['address'].notna(), None).tolist()
+    # a location naming a district is resolved once, the address is only needed without one
+    by_location = {}
+    districts = []
+    for location, address in zip(locations, addresses):
+        if location not in by_location:
+            by_location[location] = postcode_district(location)
+        district = by_location[location]
+        if district is None or not DISTRICT_PATTERN.fullmatch(district):
+            district = postcode_district(location, address)
+        districts.append(district)
+    bedrooms = pd.to_numeric(data['bedroom'], errors='coerce').astype('Int64').astype(object).where(
+        data['bedroom'].notna(), None)
+    buckets = price_buckets(price, price_tolerance).tolist()
+    transactions = data['transaction'].astype('string').fillna('').tolist()
+
+    # block key -> rows; listings without a district or price cannot be blocked, so they are never matched
+    members = {}
+    for row, key in enumerate(zip(transactions, districts, bedrooms, buckets)):
+        if key[1] is not None and key[3] >= 0:
+            members.setdefault(key, []).append(row)
+
+    # only blocked listings are ever scored, and repeated addresses are tokenized once
+    tokens, by_address = {}, {}
+    for rows in members.values():
+        for row in rows:
+            address = addresses[row]
+            if address not in by_address:
+                by_address[address] = address_tokens(address)
+            tokens[row] = by_address[address]
+    sources = data['listing_source'].astype('string').fillna('').tolist()
+
+    pairs = []
+    for (*key, bucket), rows in members.items():
+        # the same bucket, and the next one up for prices straddling a bucket boundary
+        neighbours = members.get((*key, bucket + 1), [])
+        for position, left in enumerate(rows):
+            candidates = rows[position + 1:] + neighbours
+            for right in candidates:
+                if cross_source_only and sources[left] == sources[right]:
+                    continue
+                score = jaccard(tokens[left], tokens[right])
+                if score >= threshold:
+                    pairs.append((left, right, score))
+
+    return pd.DataFrame(pairs, columns=['left', 'right', 'score'])
+
+
+def _find(parent, node):
+    root = node
+    while parent[root] != root:
+        root = parent[root]
+    # path compression
+    while parent[node] != root:
+        parent[node], node = root, parent[node]
+    return root
+
+
+def assign_property_ids(listings:pd.DataFrame, threshold=0.5, price_tolerance=0.1, cross_source_only=True):
+    """
+    Gives every listing the canonical id of the property it advertises.
+
+    Parameters:
+        - listings (DataFrame): Listings of any sources with the shared schema, e.g. the
+          concat of every source's snapshot.
+        - threshold (float): See find_duplicate_pairs.
+        - price_tolerance (float): See find_duplicate_pairs.
+        - cross_source_only (bool): See find_duplicate_pairs.
+
+    Returns:
+        dataframe: listings with a property_id column. Listings of one property share the id,
+        derived from the smallest listing_url among them so it is stable across runs.
+    """
+    data = listings.reset_index(drop=True)
+    pairs = find_duplicate_pairs(data, threshold, price_tolerance, cross_source_only)
+
+    parent = list(range(len(data)))
+    for left, right in zip(pairs['left'], pairs['right']):
+        left_root, right_root = _find(parent, left), _find(parent, right)
+        if left_root != right_root:
+            parent[max(left_root, right_root)] = min(left_root, right_root)
+    roots = [_find(parent, node) for node in range(len(data))]
+
+    canonical = {}
+    for root, url in zip(roots, data['listing_url'].astype('string').fillna('').tolist()):
+        if root not in canonical or url < canonical[root]:
+            canonical[root] = url
+    ids = {
+        root: hashlib.sha1((url or f'row-{root}').encode('utf-8')).hexdigest()[:12]
+        for root, url in canonical.items()
+    }
+
+    result = listings.copy()
+    result['property_id'] = [ids[root] for root in roots]
+    return result
@@ -0,0 +1,259 @@
+"""
+The Chrome driver factory shared by every source.
+
+Drivers start headless on Linux with the eager page load strategy, so get()
+returns once the DOM is parsed instead of after every image and script has
+loaded. Images, fonts, media and the usual third party trackers are blocked at
+the network layer through the DevTools protocol, since no listing field needs
+them. Drivers are kept warm in DRIVER_POOL between crawls of the same process
+instead of paying Chrome's start up for every get_data call, and are quit when
+the process or pool worker exits. PAGE_METRICS records the bandwidth and load
+time of every page loaded.
+"""
+import atexit
+import os
+import sys
+import threading
+import time
+from multiprocessing.util import Finalize
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+
+
+# url patterns blocked through Network.setBlockedURLs, '*' is a wildcard
+BLOCKED_RESOURCES = [
+    # images
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico', '*.bmp',
+    # fonts
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    # media
+    '*.mp4', '*.webm', '*.mp3', '*.m4a', '*.ogg', '*.m3u8',
+]
+BLOCKED_TRACKERS = [
+    '*google-analytics.com*', '*googletagmanager.com*', '*googlesyndication.com*', '*doubleclick.net*',
+    '*googleadservices.com*', '*facebook.net*', '*connect.facebook.com*', '*hotjar.com*', '*clarity.ms*',
+    '*scorecardresearch.com*', '*quantserve.com*', '*criteo.com*', '*taboola.com*', '*outbrain.com*',
+    '*adsrvr.org*', '*amazon-adsystem.com*', '*bing.com/bat*', '*tiktok.com*', '*snapchat.com*',
+    '*newrelic.com*', '*nr-data.net*', '*optimizely.com*', '*segment.io*', '*cookielaw.org*',
+]
+
+# transfer size and timings of the page just loaded, from the Performance API; cross origin
+# resources without a Timing-Allow-Origin header report a size of 0
+PAGE_METRICS_JS = """
+var navigation = performance.getEntriesByType('navigation')[0];
+var resources = performance.getEntriesByType('resource');
+var bytes = navigation ? navigation.transferSize : 0;
+resources.forEach(function (entry) { bytes += entry.transferSize || 0; });
+return {
+    bytes: bytes,
+    requests: resources.length + 1,
+    dom_loaded: navigation ? navigation.domContentLoadedEventEnd / 1000 : null
+};
+"""
+
+
+def get_driver(headless=None, page_load_strategy='eager', block_resources=True, block_trackers=True,
+               undetected=False, driver_path=None, window_size=(1366, 900)):
+    """
+    Starts a Chrome driver configured for scraping.
+
+    Parameters:
+        - headless (bool, optional): Run without a window, by default on Linux only.
+        - page_load_strategy (str): 'eager' returns from get() once the DOM is ready,
+          'normal' waits for every resource, 'none' returns straight away.
+        - block_resources (bool): Block images, fonts and media.
+        - block_trackers (bool): Block the third party trackers in BLOCKED_TRACKERS.
+        - undetected (bool): Start undetected_chromedriver instead of plain Selenium, for
+          sources behind bot detection such as Zoopla.
+        - driver_path (str, optional): chromedriver executable, $CHROMEDRIVER_PATH by default;
+          when neither is set Selenium Manager resolves one.
+        - window_size (tuple): Width and height of the (virtual) window.
+
+    Returns:
+        WebDriver
+
+    Raises:
+        RuntimeError: When Chrome cannot be started.
+    """
+    if headless is None:
+        headless = sys.platform.startswith('linux')
+    driver_path = driver_path or os.environ.get('CHROMEDRIVER_PATH')
+
+    if undetected:
+        import undetected_chromedriver as uc
+        options = uc.ChromeOptions()
+    else:
+        options = webdriver.ChromeOptions()
+
+    options.page_load_strategy = page_load_strategy
+    options.add_argument(f'--window-size={window_size[0]},{window_size[1]}')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-extensions')
+    options.add_argument('--mute-audio')
+    if block_resources:
+        options.add_argument('--blink-settings=imagesEnabled=false')
+    if headless and not undetected:
+        options.add_argument('--headless=new')
+        options.add_argument('--no-sandbox')
+
+    try:
+        if undetected:
+            driver = uc.Chrome(options=options, driver_executable_path=driver_path, headless=headless)
+        else:
+            service = Service(executable_path=driver_path) if driver_path else Service()
+            driver = webdriver.Chrome(service=service, options=options)
+    except Exception as e:
+        raise RuntimeError(f'could not start Chrome (chromedriver: {driver_path or "selenium manager"}): {e}') from e
+
+    blocked = (BLOCKED_RESOURCES if block_resources else []) + (BLOCKED_TRACKERS if block_trackers else [])
+    if blocked:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked})
+    return driver
+
+
+class PageMetrics:
+    """
+    Bandwidth and load time of the pages loaded by the drivers of this process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = 0
+        self.bytes = 0
+        self.requests = 0
+        self.seconds = 0.0
+
+    def record(self, url:str, seconds:float, bytes:int, requests:int):
+        with self.lock:
+            self.pages += 1
+            self.bytes += bytes
+            self.requests += requests
+            self.seconds += seconds
+        print(f'{url}: {bytes / 1024:.0f} kB over {requests} requests, loaded in {seconds:.2f}s')
+
+    def report(self):
+        """
+        Prints the mean bandwidth and load time per page.
+        """
+        with self.lock:
+            if not self.pages:
+                return
+            print(f'{self.pages} pages loaded: {self.bytes / 1024 / self.pages:.0f} kB, '
+                  f'{self.requests / self.pages:.0f} requests and {self.seconds / self.pages:.2f}s per page')
+
+
+PAGE_METRICS = PageMetrics()
+
+
+def load_page(driver, url:str, metrics=None):
+    """
+    Loads url in driver, timing it and recording its transfer size.
+
+    Parameters:
+        - driver (WebDriver): The driver.
+        - url (str): The page to load.
+        - metrics (PageMetrics, optional): Where the page is recorded, PAGE_METRICS by default.
+
+    Returns:
+        dict with the bytes, requests and seconds of the page.
+    """
+    start = time.perf_counter()
+    driver.get(url)
+    seconds = time.perf_counter() - start
+
+    try:
+        performance = driver.execute_script(PAGE_METRICS_JS) or {}
+    except Exception:
+        performance = {}
+    page = {
+        'bytes': int(performance.get('bytes') or 0),
+        'requests': int(performance.get('requests') or 0),
+        'seconds': seconds,
+    }
+    (metrics or PAGE_METRICS).record(url, seconds, page['bytes'], page['requests'])
+    return page
+
+
+class DriverPool:
+    """
+    Idle drivers kept warm per factory, so consecutive crawls in one process reuse a browser.
+
+    Parameters:
+        - max_idle (int): Idle drivers kept per factory; extra ones are quit on release.
+    """
+
+    def __init__(self, max_idle=1):
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.pid = os.getpid()
+        atexit.register(self.close)
+
+    def acquire(self, get_driver):
+        """
+        Returns a warm driver made by get_driver, or a new one.
+        """
+        while True:
+            with self.lock:
+                # a forked pool worker must not share the parent's browser sessions
+                if os.getpid() != self.pid:
+                    self.idle = {}
+                    self.pid = os.getpid()
+                drivers = self.idle.get(get_driver)
+                driver = drivers.pop() if drivers else None
+            if driver is None:
+                return get_driver()
+            if self.alive(driver):
+                return driver
+            self.quit(driver)
+
+    def release(self, get_driver, driver):
+        """
+        Keeps driver warm for the next acquire, or quits it when enough are idle.
+        """
+        if self.alive(driver):
+            with self.lock:
+                drivers = self.idle.setdefault(get_driver, [])
+                if len(drivers) < self.max_idle:
+                    drivers.append(driver)
+                    return
+        self.quit(driver)
+
+    @staticmethod
+    def alive(driver):
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Quits every idle driver of this process.
+        """
+        with self.lock:
+            # a forked pool worker must not quit the parent's browsers
+            drivers = [driver for idle in self.idle.values() for driver in idle] if os.getpid() == self.pid else []
+            self.idle = {}
+        for driver in drivers:
+            self.quit(driver)
+
+    def close_at_exit(self):
+        """
+        Quits the idle drivers when a multiprocessing worker exits. Pool workers leave through
+        os._exit, which skips atexit, but still run the finalizers registered here; call it
+        from the executor's initializer.
+        """
+        Finalize(self, self.close, exitpriority=10)
+
+
+DRIVER_POOL = DriverPool()
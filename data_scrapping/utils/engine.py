@@ -0,0 +1,494 @@
+"""
+The scraping engine shared by every portal.
+
+A portal is described by a SiteSpec: its search urls and pagination, the css
+selectors of a property card and its fields, how the price and listed date
+texts are read from a card, and the few site specific field parsers. The
+engine owns everything else: fetching, rate limiting, caching, extraction,
+incremental crawls, the process pool and the partitioned output. Adding a
+portal means writing a spec, not another scraper module.
+"""
+import time
+from datetime import datetime
+from functools import partial
+
+from selenium.webdriver.common.by import By
+
+from utils.utils import read_cards, time_extraction
+from utils.driver import PAGE_METRICS, get_driver, load_page
+from utils.wait import wait_until_ready
+from utils.html_parser import read_cards_html, save_page_source
+from utils.cache import CachedFetcher, PageCache
+from utils.fetch import get_fetcher
+from utils.rate_limit import RATE_LIMITER
+from utils.pool import get_data_parallel
+from utils.pagination import PRICE_STEPS, plan_search
+from utils.seen_index import SeenIndex
+from utils.store import PartitionWriter
+from utils.schema import ListingBuffer, RAW_LISTING_COLUMNS
+from utils.normalize import normalize_listings
+
+
+TRANSACTION_TYPES = ('rent', 'sales')
+
+
+class SiteSpec:
+    """
+    Declarative description of a listing portal.
+
+    Parameters:
+        - source (str): Name of the portal, written to listing_source, e.g. 'rightmove'.
+        - urls (dict): Transaction type -> search url with a {} placeholder for the page.
+        - card_selector (str): Css selector of a property card.
+        - card_fields (dict): Field name -> (css selector, attribute) read from every card,
+          see utils.read_card_fields.
+        - parse_card (function): Takes the raw card dict and returns the site specific columns
+          (bedroom, bathroom, description, propertyType, ...); anything it returns overrides
+          the engine's defaults.
+        - price_text (str, tuple or function): Card field(s) joined into the raw price text,
+          or a function of the card returning it. Parsed later by normalize_listings.
+        - listed_text (str, tuple or function): The same for the listed date text.
+        - pagination (str): 'index' when the url takes a result offset stepping by page_size
+          (Rightmove's index=0, 24, ...), 'page' when it takes the page number.
+        - page_size (int): Listings per search page.
+        - first_page (int): First page number, or first offset for 'index' pagination.
+        - max_pages (int): Number of pages the portal lets a search reach.
+        - fetch_backend (str): 'http' or 'selenium', see utils.fetch.get_fetcher.
+        - base_url (str): Links in archived pages are resolved against it.
+        - get_driver (function): Opens the browser for 'selenium' fetches and live extraction.
+        - ready_selector (str, optional): Css selector of the results container; once it is
+          present and the card count is stable, a page with fewer than min_cards is ready.
+        - min_cards (int, optional): Cards on a full page, page_size by default. Browser loads
+          wait for it, and pages with fewer cards are loaded again.
+        - retries (int): Times an empty or partial page is loaded again.
+        - result_count (tuple): (simple css selector or None, regex) locating the number of
+          results on a search page, see pagination.read_result_count.
+        - price_params (tuple, optional): Names of the url's minimum and maximum price parameters;
+          searches over the page cap are split into price bands when given.
+        - price_steps (dict, optional): Transaction type -> price band boundaries, pagination.PRICE_STEPS
+          by default.
+        - bedroom_params (tuple, optional): Names of the url's minimum and maximum bedrooms parameters;
+          a single price step still over the page cap is split by bedrooms when given.
+        - newest_first (bool): Whether the urls sort the results newest first. Incremental crawls
+          stop at the first page of known listings, so they are refused for specs without it.
+    """
+
+    def __init__(self, source:str, urls:dict, card_selector:str, card_fields:dict, parse_card,
+                 price_text=('price',), listed_text=None, pagination='page', page_size=24, first_page=1,
+                 max_pages=40, fetch_backend='http', base_url=None, get_driver=get_driver, ready_selector=None,
+                 min_cards=None, retries=2, result_count=(None, r'([\d,]+)\s+results'), price_params=None,
+                 price_steps=None, bedroom_params=None, newest_first=False):
+        if pagination not in ('index', 'page'):
+            raise ValueError(f'pagination must be index or page, not {pagination!r}')
+
+        self.source = source
+        self.urls = dict(urls)
+        self.card_selector = card_selector
+        self.card_fields = dict(card_fields)
+        self.parse_card = parse_card
+        self.price_text = price_text
+        self.listed_text = listed_text
+        self.pagination = pagination
+        self.page_size = page_size
+        self.first_page = first_page
+        self.max_pages = max_pages
+        self.fetch_backend = fetch_backend
+        self.base_url = base_url
+        self.get_driver = get_driver
+        self.ready_selector = ready_selector
+        self.min_cards = page_size if min_cards is None else min_cards
+        self.retries = retries
+        self.result_count = result_count
+        self.price_params = price_params
+        self.price_steps = PRICE_STEPS if price_steps is None else price_steps
+        self.bedroom_params = bedroom_params
+        self.newest_first = newest_first
+
+    def __repr__(self):
+        return f'SiteSpec({self.source!r})'
+
+    def pages(self, count=None):
+        """
+        Returns the page parameters of the first count search pages, max_pages by default.
+        """
+        count = self.max_pages if count is None else min(count, self.max_pages)
+        if self.pagination == 'index':
+            return range(self.first_page, self.first_page + count * self.page_size, self.page_size)
+        return range(self.first_page, self.first_page + count)
+
+    def page_ordinal(self, page):
+        """
+        Returns the position of a page parameter in the search, 0 for the first page.
+        """
+        if self.pagination == 'index':
+            return (page - self.first_page) // self.page_size
+        return page - self.first_page
+
+    def expected_cards(self, page, results=None):
+        """
+        Returns the cards a complete copy of page holds: min_cards, or fewer on the last page
+        when the number of results of the search is known.
+        """
+        if results is None:
+            return self.min_cards
+        return max(0, min(self.min_cards, results - self.page_ordinal(page) * self.page_size))
+
+
+def card_text(card:dict, fields):
+    """
+    Reads a raw text out of a card as the spec declares it.
+
+    Parameters:
+        - card (dict): Raw field values of one card.
+        - fields (str, tuple, function or None): A field name, field names whose non empty
+          values are joined by newlines, or a function of the card.
+
+    Returns:
+        str or None.
+    """
+    if fields is None:
+        return None
+    if callable(fields):
+        return fields(card)
+    if isinstance(fields, str):
+        fields = (fields,)
+    return '\n'.join(card[name] for name in fields if card.get(name)) or None
+
+
+def parse_card(spec:SiteSpec, card:dict, transaction:str, source:str):
+    """
+    Turns the raw fields of one property card into a raw listing row.
+
+    Parameters:
+        - spec (SiteSpec): The portal.
+        - card (dict): Raw field values keyed as in spec.card_fields.
+        - transaction (str): rent or sales.
+        - source (str): The source of the web page content.
+
+    Returns:
+        dict holding one raw listing; price_text and listed_text are parsed by normalize_listings
+    """
+    address = card.get('address')
+
+    # Location, the postcode district or town closing the address
+    try:
+        location = address.split(" ")[-1].strip()
+    except:
+        location = None
+
+    row = {
+        'transaction': transaction,
+        'address': address,
+        'location': location,
+        'agent': card.get('agent'),
+        'listing_source': source,
+        'listing_url': card.get('listing_url'),
+        'price_text': card_text(card, spec.price_text),
+        'listed_text': card_text(card, spec.listed_text),
+    }
+    row.update(spec.parse_card(card))
+    return row
+
+
+def get_pages(spec:SiteSpec, driver, page, url):
+    """
+    Loads a search page in the browser and returns its card elements.
+
+    Parameters:
+        - spec (SiteSpec): The portal.
+        - driver (WebDriver): The Selenium WebDriver instance used to access the web page.
+        - page (str): The name or identifier of the page being retrieved.
+        - url (str): The URL of the web page to be retrieved.
+
+    Returns:
+        list of the card WebElements.
+    """
+    with RATE_LIMITER.request(url.format(page)):
+        started = time.perf_counter()
+        load_page(driver, url.format(page))
+        wait_for_page(spec, driver, url.format(page), started)
+    return driver.find_elements(By.CSS_SELECTOR, spec.card_selector)
+
+
+def get_page_source(fetcher, page, url, refresh=False):
+    """
+    Loads a search page and captures its HTML once, so it can be parsed without the browser.
+
+    Parameters:
+        - fetcher (HttpFetcher, SeleniumFetcher or CachedFetcher): The fetch backend of this source.
+        - page (str): The name or identifier of the page being retrieved.
+        - url (str): The URL of the web page to be retrieved.
+        - refresh (bool): Fetch the page again even if it is cached, e.g. when the cached copy was empty.
+
+    Returns:
+        str: The page source.
+    """
+    if refresh and isinstance(fetcher, CachedFetcher):
+        return fetcher.get(url.format(page), refresh=True)
+    return fetcher.get(url.format(page))
+
+
+def wait_for_page(spec:SiteSpec, driver, url:str, started=None):
+    """
+    Waits until the page loaded in driver meets the spec's readiness condition, see utils.wait.
+
+    Returns:
+        int: The number of cards on the page.
+    """
+    return wait_until_ready(driver, url, spec.card_selector, spec.min_cards, spec.ready_selector, started=started)
+
+
+def page_complete(spec:SiteSpec, found:int, previous=None, expected=None):
+    """
+    Tells whether a loaded page can be kept: it has the cards expected, or it came back with
+    the same non zero count as the previous attempt (a partial last page). Empty pages are
+    always loaded again, up to spec.retries times.
+
+    Parameters:
+        - spec (SiteSpec): The portal.
+        - found (int): Cards found on this attempt.
+        - previous (int, optional): Cards found on the previous attempt.
+        - expected (int, optional): Cards of a complete copy of the page, spec.min_cards by default.
+
+    Returns:
+        bool
+    """
+    expected = spec.min_cards if expected is None else expected
+    return found >= expected or (found > 0 and found == previous)
+
+
+def extract_data(spec:SiteSpec, page_html, transaction_type:str, source:str, driver=None):
+    """
+    Extracts the listings from the live card elements of a page.
+
+    Parameters:
+        - spec (SiteSpec): The portal.
+        - page_html (list): The card elements returned by get_pages.
+        - transaction_type (str): rent or sales.
+        - source (str): The source of the web page content.
+        - driver (WebDriver, optional): When given, all the cards are read in one injected
+          script call instead of one find_element request per field.
+
+    Returns:
+        list of raw listing rows, see normalize_listings
+    """
+    if transaction_type not in TRANSACTION_TYPES:
+        print('transaction_type can either be sales or rent')
+        return []
+
+    cards = read_cards(page_html, spec.card_fields, driver)
+    return [parse_card(spec, card, transaction_type, source) for card in cards]
+
+
+def parse_page_source(spec:SiteSpec, html:str, transaction_type:str, source:str, base_url=None):
+    """
+    Extracts the listings from a captured page source using the same selectors as extract_data.
+
+    Parameters:
+        - spec (SiteSpec): The portal.
+        - html (str): The page source returned by get_page_source or read from an archive.
+        - transaction_type (str): rent or sales.
+        - source (str): The source of the web page content.
+        - base_url (str, optional): Url of the page, used to make listing links absolute.
+
+    Returns:
+        list of raw listing rows, see normalize_listings
+    """
+    if transaction_type not in TRANSACTION_TYPES:
+        print('transaction_type can either be sales or rent')
+        return []
+
+    cards = read_cards_html(html, spec.card_selector, spec.card_fields, base_url or spec.base_url)
+    return [parse_card(spec, card, transaction_type, source) for card in cards]
+
+
+def scrape_pages(spec:SiteSpec, url, transaction_type, source, pages, extraction='html', archive_dir=None,
+                 backend=None, cache=None, seen=None, incremental=False, stop_ratio=0.8, writer=None, partition=None,
+                 results=None):
+    """
+    Scrapes the given pages one after the other with a fetcher (session or browser) of its own.
+
+    Parameters:
+        - spec (SiteSpec): The portal.
+        - url (str): The search url, with a {} placeholder for the page.
+        - transaction_type (str): rent or sales, ValueError otherwise.
+        - source (str): The source of the data.
+        - pages (iterable): The page numbers (or indices) to retrieve, in order.
+        - extraction (str): 'html' captures the page source once and parses it offline,
+          'batch' reads the live cards in one injected script call, 'element' uses one
+          find_element per field and 'compare' times 'batch' against 'element'.
+        - archive_dir (str, optional): Folder where each captured page source is saved
+          for later re-parsing (html extraction only).
+        - backend (str, optional): 'http' or 'selenium', overrides spec.fetch_backend.
+        - cache (PageCache, optional): Page cache under get_page_source; with cache_only=True
+          the pages are replayed from disk without fetching (html extraction only).
+        - seen (SeenIndex, optional): Index the scraped listing urls are recorded in.
+        - incremental (bool): Skip cards already in seen and stop paging at the first page
+          where at least stop_ratio of the cards are known (html extraction and a seen index only,
+          ValueError otherwise).
+        - stop_ratio (float): Share of known cards on a page that ends an incremental crawl.
+        - writer (PartitionWriter, optional): Stream each page's rows to a chunk file as soon as
+          it is parsed and checkpoint it, instead of holding every row in memory. Pages already
+          checkpointed for the writer's run date are skipped, so a failed crawl resumes; pages
+          still empty or short after the retries are not checkpointed and are crawled again.
+        - partition (str, optional): Name of the price band url covers, so its pages are
+          checkpointed and archived apart from the other bands' pages of the same numbers.
+        - results (int, optional): Number of results of the search, so a short last page is
+          not mistaken for a partially loaded one.
+
+    Returns:
+        dataframe of the listings in page order with the shared schema (empty when streamed to a writer).
+    """
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError(f'transaction_type can either be sales or rent, not {transaction_type!r}')
+    if incremental and extraction != 'html':
+        raise ValueError(f'incremental crawls need html extraction, not {extraction!r}')
+    if incremental and seen is None:
+        raise ValueError('incremental crawls need the seen index of the source')
+
+    # the writer's partition: the transaction, or a price band of it
+    key = transaction_type if partition is None else f'{transaction_type}/{partition}'
+    if writer is not None:
+        # resume: pages already written by an earlier run of the day are not crawled again
+        completed = writer.completed_pages(source, key)
+        pages = [page for page in pages if page not in completed]
+
+    # the live element extractions need the browser whatever the source's backend
+    backend = (backend or spec.fetch_backend) if extraction == 'html' else 'selenium'
+    fetcher = get_fetcher(backend, spec.get_driver, cache if extraction == 'html' else None,
+                          ready=partial(wait_for_page, spec))
+    # raw rows are kept column wise while the crawl runs and normalized in one batch at the end
+    all_pages_data = ListingBuffer(RAW_LISTING_COLUMNS)
+
+    try:
+        for page in pages:
+            known_share = 0.0
+
+            # empty and partial pages are loaded again, see page_complete
+            expected = spec.expected_cards(page, results)
+            previous = None
+            complete = False
+            for attempt in range(spec.retries + 1):
+                if extraction == 'html':
+                    html = get_page_source(fetcher, page, url, refresh=attempt > 0)
+                    start = time.perf_counter()
+                    cards = read_cards_html(html, spec.card_selector, spec.card_fields, url.format(page))
+                    found = len(cards)
+                else:
+                    page_html = get_pages(spec, fetcher.driver, page, url)
+                    start = time.perf_counter()
+                    found = len(page_html)
+
+                complete = page_complete(spec, found, previous, expected)
+                if complete:
+                    break
+                previous = found
+                if attempt < spec.retries:
+                    print(f'page {page}: {found} of {expected} cards, loading it again')
+
+            if extraction == 'html':
+                if archive_dir:
+                    save_page_source(html, archive_dir, f"{source}_{key.replace('/', '_')}_{page}")
+                if incremental:
+                    cards, known_share = seen.filter_new(source, transaction_type, cards)
+                pages_data = [parse_card(spec, card, transaction_type, source) for card in cards]
+            else:
+                if extraction == 'compare':
+                    pages_data = time_extraction(partial(extract_data, spec), page_html, transaction_type, source,
+                                                 fetcher.driver)
+                else:
+                    pages_data = extract_data(spec, page_html, transaction_type, source,
+                                              driver=fetcher.driver if extraction == 'batch' else None)
+            print(f'page {page}: {len(pages_data)} listings extracted in {time.perf_counter() - start:.2f}s')
+
+            crawled_at = datetime.now().isoformat(timespec='seconds')
+            for row in pages_data:
+                row['crawled_at'] = crawled_at
+
+            if writer is not None:
+                # an empty or short page is not checkpointed, so a resumed crawl loads it again
+                writer.write(source, key, page, pages_data, complete=complete)
+                if not complete:
+                    print(f'page {page}: still {found} of {expected} cards after {spec.retries} retries, '
+                          f'left for the next run')
+                # the page is on disk, so its listings can be marked seen straight away
+                elif seen is not None:
+                    seen.add(source, transaction_type, [row['listing_url'] for row in pages_data])
+            else:
+                all_pages_data.extend(pages_data)
+
+            if incremental and known_share >= stop_ratio:
+                print(f'page {page}: {known_share:.0%} of the listings already seen, stopping')
+                break
+
+        if seen is not None and writer is None:
+            seen.add(source, transaction_type, all_pages_data.column('listing_url'))
+
+    finally:
+        fetcher.close()
+        RATE_LIMITER.report()
+        PAGE_METRICS.report()
+
+    return normalize_listings(all_pages_data.to_frame())
+
+
+def run(spec:SiteSpec, pages=None, workers=4, incremental=False, cache_only=False, output='data_output'):
+    """
+    Crawls the rent and sales searches of a portal into the day's snapshot csv.
+
+    Parameters:
+        - spec (SiteSpec): The portal.
+        - pages (iterable, optional): The page parameters to crawl. By default the page range is
+          read off the first page of each search, which is split into price bands when it has
+          more results than the portal serves, see pagination.plan_search.
+        - workers (int): Number of processes crawling at the same time.
+        - incremental (bool): Walk the pages in order and stop at the first page made mostly
+          of listings already seen, instead of crawling the full range on the pool. Only for
+          specs whose searches are sorted newest_first.
+        - cache_only (bool): Replay the cached pages without fetching anything.
+        - output (str): Folder holding the page cache, partitions, seen index and snapshot.
+
+    Returns:
+        dataframe: The compacted snapshot of the run.
+    """
+    if incremental and not spec.newest_first:
+        raise ValueError(f'{spec.source} searches are not sorted newest first, so they cannot be crawled incrementally')
+
+    print('runing.....................................')
+
+    # The pool workers draw from one token bucket per domain, so together they keep to its rate
+    RATE_LIMITER.share(f'{output}/rate_limits.sqlite')
+
+    # Pages fetched in the last day are reused, e.g. when re-running after a failed parse
+    cache = PageCache(f'{output}/page_cache', ttl=24 * 3600, cache_only=cache_only)
+
+    # Rows are streamed to per page chunks; re-running on the same day resumes after the
+    # last checkpointed page
+    writer = PartitionWriter(f'{output}/partitions')
+
+    # Every scraped listing url is recorded
+    seen = SeenIndex(f'{output}/seen_listings.sqlite')
+
+    jobs = []
+    if pages is None:
+        # the first pages probed here are cached, so the crawl does not fetch them again
+        with get_fetcher(spec.fetch_backend, spec.get_driver, cache, ready=partial(wait_for_page, spec)) as fetcher:
+            for transaction_type, url in spec.urls.items():
+                for search_url, search_pages, partition, results in plan_search(spec, fetcher.get, url,
+                                                                                transaction_type):
+                    jobs.append((search_url, transaction_type, spec.source, search_pages,
+                                 {'partition': partition, 'results': results}))
+    else:
+        jobs = [(url, transaction_type, spec.source, pages) for transaction_type, url in spec.urls.items()]
+
+    if incremental:
+        # pages have to be walked in order to know where to stop, so this runs without the pool
+        for url, transaction_type, source, job_pages, *job_kwargs in jobs:
+            scrape_pages(spec, url, transaction_type, source, job_pages, cache=cache, seen=seen, incremental=True,
+                         writer=writer, **(job_kwargs[0] if job_kwargs else {}))
+    else:
+        # Crawl rent and sales and their price bands concurrently, each split into shards across the workers
+        get_data_parallel(partial(scrape_pages, spec), jobs, workers, cache=cache, seen=seen, writer=writer)
+
+    # join the rent and sales chunks into the day's snapshot csv
+    return writer.compact(spec.source, output)
@@ -0,0 +1,235 @@
+"""
+Fetch backends for the search pages.
+
+Rightmove and OnTheMarket render their listing cards on the server, so a plain
+HTTP request returns everything extract needs. Those sources use HttpFetcher,
+which keeps a pooled keep-alive session. Sources that need JavaScript (Zoopla)
+use SeleniumFetcher. Both return the page HTML from get(url).
+"""
+import hashlib
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, unquote_plus, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.cache import CachedFetcher
+from utils.driver import DRIVER_POOL, load_page
+from utils.rate_limit import RATE_LIMITER, is_block_page
+
+
+HEADERS = {
+    'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                   '(KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36'),
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-GB,en;q=0.9',
+}
+
+
+class HttpFetcher:
+    """
+    Fetches pages over one pooled, keep-alive requests session.
+
+    Parameters:
+        - pool_size (int): Connections kept open per host.
+        - retries (int): Retries on connection errors and 429/5xx responses, with backoff.
+        - timeout (float): Seconds to wait for a response.
+        - headers (dict, optional): Extra request headers.
+        - limiter (DomainRateLimiter, optional): Gate for the requests, the shared RATE_LIMITER by default.
+    """
+
+    def __init__(self, pool_size=10, retries=3, timeout=30, headers=None, limiter=None):
+        self.timeout = timeout
+        self.limiter = limiter or RATE_LIMITER
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.headers.update(headers or {})
+
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url):
+        with self.limiter.request(url) as outcome:
+            response = self.session.get(url, timeout=self.timeout)
+            outcome.blocked = is_block_page(response.text, response.status_code)
+        response.raise_for_status()
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SeleniumFetcher:
+    """
+    Fetches fully rendered pages with a WebDriver.
+
+    Parameters:
+        - get_driver (function): Returns a new driver, e.g. utils.driver.get_driver.
+        - limiter (DomainRateLimiter, optional): Gate for the requests, the shared RATE_LIMITER by default.
+        - pool (DriverPool, optional): Where the driver is taken from and handed back to on close,
+          so the next crawl of the process starts warm; the shared DRIVER_POOL by default.
+        - ready (function, optional): Called as ready(driver, url, started) after each load to wait
+          until the page has rendered, e.g. engine.wait_for_page for the source's spec.
+    """
+
+    def __init__(self, get_driver, limiter=None, pool=None, ready=None):
+        self.get_driver = get_driver
+        self.pool = pool or DRIVER_POOL
+        self.driver = self.pool.acquire(get_driver)
+        self.limiter = limiter or RATE_LIMITER
+        self.ready = ready
+
+    def get(self, url):
+        with self.limiter.request(url) as outcome:
+            started = time.perf_counter()
+            load_page(self.driver, url)
+            if self.ready is not None:
+                self.ready(self.driver, url, started)
+            html = self.driver.page_source
+            outcome.blocked = is_block_page(html)
+        return html
+
+    def close(self):
+        self.pool.release(self.get_driver, self.driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_fetcher(backend:str, get_driver=None, cache=None, ready=None, **kwargs):
+    """
+    Creates the fetch backend configured for a source.
+
+    Parameters:
+        - backend (str): 'http' or 'selenium'.
+        - get_driver (function, optional): Driver factory, required for 'selenium'.
+        - cache (PageCache, optional): Serve pages from this cache when possible. In
+          cache-only mode no session or browser is started at all.
+        - ready (function, optional): Readiness wait of a 'selenium' fetcher, see SeleniumFetcher.
+        - kwargs: Passed on to HttpFetcher.
+
+    Returns:
+        HttpFetcher, SeleniumFetcher or a CachedFetcher wrapping one
+    """
+    if cache is not None and cache.cache_only:
+        return CachedFetcher(None, cache)
+
+    if backend == 'http':
+        fetcher = HttpFetcher(**kwargs)
+    elif backend == 'selenium':
+        fetcher = SeleniumFetcher(get_driver, ready=ready)
+    else:
+        raise ValueError(f"backend can either be http or selenium, got {backend!r}")
+
+    return CachedFetcher(fetcher, cache) if cache is not None else fetcher
+
+
+def recorded_page_name(url:str):
+    """
+    File name a recorded page is stored under, derived from the url's path and query. The
+    scraped url and the request line the server sees are normalised the same way: an empty
+    path is '/', escapes are decoded and there is no '?' without a query.
+    """
+    parts = urlsplit(url)
+    path, query = unquote(parts.path) or '/', unquote_plus(parts.query)
+    key = f'{path}?{query}' if query else path
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.html'
+
+
+def record_page(directory:str, url:str, html:str):
+    """
+    Saves a page so RecordedPageServer can serve it for the same url.
+
+    Parameters:
+        - directory (str): Folder of recorded pages.
+        - url (str): The url the page was fetched from.
+        - html (str): The page source.
+
+    Returns:
+        str: Path of the recorded file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, recorded_page_name(url))
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(html)
+    return path
+
+
+class RecordedPageServer:
+    """
+    Local stand-in for a portal that serves pages saved with record_page.
+
+    Use it as a context manager and point the scraper at server.rebase(url):
+
+        with RecordedPageServer('recorded/rightmove') as server:
+            rows = scrape_pages(server.rebase(rm_renturl), 'rent', 'rightmove', range(0, 48, 24))
+
+    Parameters:
+        - directory (str): Folder of recorded pages.
+        - port (int): Port to listen on, 0 picks a free one.
+    """
+
+    def __init__(self, directory:str, port=0):
+        directory = os.path.abspath(directory)
+
+        class Handler(SimpleHTTPRequestHandler):
+            def do_GET(self):
+                path = os.path.join(directory, recorded_page_name(self.path))
+                if not os.path.exists(path):
+                    self.send_error(404)
+                    return
+                with open(path, 'rb') as file:
+                    body = file.read()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def rebase(self, url:str):
+        """
+        Points a url (or url template) at this server, keeping its path and query.
+        """
+        parts = urlsplit(url)
+        base = urlsplit(self.base_url)
+        return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, parts.fragment))
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,187 @@
+"""
+Offline parsing of saved search pages.
+
+The scrapers describe their cards with simple css selectors (".class", "tag",
+"tag.class" joined by spaces). The same selectors are used here against the
+page_source captured from the browser, so extraction does not need a live
+WebDriver and can be re-run over archived HTML.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from urllib.parse import urljoin
+
+import lxml.html
+
+
+# tags whose boundaries break lines in the rendered text, like innerText does
+BLOCK_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li',
+    'main', 'nav', 'ol', 'p', 'section', 'table', 'tr', 'ul',
+}
+# tags whose content is never rendered as text
+HIDDEN_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'head'}
+# attributes Selenium reports as absolute urls
+URL_ATTRIBUTES = {'href', 'src'}
+
+
+@lru_cache(maxsize=None)
+def selector_to_xpath(selector:str):
+    """
+    Converts a simple css selector into the equivalent relative XPath.
+
+    Parameters:
+        - selector (str): Space separated steps such as ".agent-logo img" or "div.title".
+
+    Returns:
+        str: XPath selecting the matching descendants of the context node.
+    """
+    steps = []
+    for step in selector.split():
+        tag, *classes = step.split('.')
+        conditions = ''.join(
+            f"[contains(concat(' ', normalize-space(@class), ' '), ' {name} ')]"
+            for name in classes
+        )
+        # svg children live in their own namespace, so match on local-name
+        node = f"*[local-name()='{tag}']" if tag else '*'
+        steps.append(f'.//{node}{conditions}' if not steps else f'//{node}{conditions}')
+    return ''.join(steps)
+
+
+def element_text(element):
+    """
+    Approximates the rendered text of an element (Selenium's .text / innerText).
+
+    Parameters:
+        - element (HtmlElement): The element to read.
+
+    Returns:
+        str: Text with one line per block and whitespace collapsed inside lines.
+    """
+    parts = []
+
+    def walk(node):
+        # comments and processing instructions have a non string tag
+        if not isinstance(node.tag, str):
+            return
+        tag = node.tag.rsplit('}', 1)[-1].lower()
+        if tag in HIDDEN_TAGS:
+            return
+        block = tag in BLOCK_TAGS
+        if block:
+            parts.append('\n')
+        if node.text:
+            parts.append(node.text)
+        for child in node:
+            walk(child)
+            if child.tail:
+                parts.append(child.tail)
+        if block:
+            parts.append('\n')
+
+    walk(element)
+    lines = (' '.join(line.split()) for line in ''.join(parts).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def read_field(card, selector, attr, base_url=None):
+    """
+    Reads one raw field from a card, mirroring read_card_fields for live elements.
+
+    Parameters:
+        - card (HtmlElement): The card element.
+        - selector (str): Css selector of the field inside the card, empty for the card itself.
+        - attr (str): 'text', 'textContent' or an attribute name.
+        - base_url (str, optional): Url of the page, used to make links absolute.
+
+    Returns:
+        The raw value, or None when the element is missing.
+    """
+    if selector:
+        found = card.xpath(selector_to_xpath(selector))
+        if not found:
+            return None
+        element = found[0]
+    else:
+        element = card
+
+    if attr == 'text':
+        return element_text(element)
+    if attr == 'textContent':
+        return element.text_content()
+
+    value = element.get(attr)
+    if value is not None and attr in URL_ATTRIBUTES and base_url:
+        value = urljoin(base_url, value)
+    return value
+
+
+def read_cards_html(html:str, card_selector:str, fields:dict, base_url=None):
+    """
+    Finds all the cards in a page source and reads their raw fields.
+
+    Parameters:
+        - html (str): The page source.
+        - card_selector (str): Css selector of a listing card.
+        - fields (dict): Field name -> (css selector, attribute) pairs.
+        - base_url (str, optional): Url of the page, used to make links absolute.
+
+    Returns:
+        list of dicts with the raw field values of each card.
+    """
+    if not html:
+        return []
+    tree = lxml.html.document_fromstring(html)
+    cards = tree.xpath(selector_to_xpath(card_selector))
+    return [
+        {name: read_field(card, selector, attr, base_url) for name, (selector, attr) in fields.items()}
+        for card in cards
+    ]
+
+
+def save_page_source(html:str, directory:str, name:str):
+    """
+    Archives a page source so it can be parsed again later.
+
+    Parameters:
+        - html (str): The page source.
+        - directory (str): Folder the page is written to.
+        - name (str): File name without extension.
+
+    Returns:
+        str: Path of the saved file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{name}.html')
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(html)
+    return path
+
+
+def _parse_file(parse_page, path):
+    with open(path, encoding='utf-8') as file:
+        return parse_page(file.read())
+
+
+def parse_saved_pages(paths, parse_page, workers=None):
+    """
+    Parses archived page sources on all CPU cores without a browser.
+
+    Parameters:
+        - paths (list): Paths of saved .html pages, in the order the rows should come back.
+        - parse_page (function): Picklable callable taking the html and returning a list of
+          rows, e.g. functools.partial(parse_page_source, transaction_type='rent', source='omt').
+        - workers (int, optional): Number of processes, defaults to the number of CPUs.
+
+    Returns:
+        list of rows from all the pages; raw scraper rows go through normalize_listings,
+        with crawled_at set to the archive date.
+    """
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_parse_file, parse_page, path) for path in paths]
+        for future in futures:
+            rows.extend(future.result())
+    return rows
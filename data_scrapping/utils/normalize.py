@@ -0,0 +1,135 @@
+"""
+Post-extraction normalization of prices and listing dates.
+
+Extraction keeps the price and date text of each card as scraped (price_text,
+listed_text) plus the time the page was crawled (crawled_at). This stage turns
+a whole batch of those raw rows into the shared listing schema with vectorized
+string operations, so the parsing runs off the crawl loop and historical raw
+chunks can be re-normalized in bulk.
+"""
+from datetime import datetime
+
+import pandas as pd
+
+from utils.schema import coerce_listings
+
+
+# raw columns that only exist between extraction and normalization
+RAW_TEXT_COLUMNS = ['price_text', 'listed_text']
+
+PCM_PATTERN = r'£\s*([\d,]+)\s*pcm'
+PW_PATTERN = r'£\s*([\d,]+)\s*pw'
+# first amount not quoted per week, for rents shown without a unit
+NOT_WEEKLY_PATTERN = r'£\s*([\d,]+)(?![\d,]|\s*pw)'
+AMOUNT_PATTERN = r'£\s*([\d,]+)'
+
+SLASH_DATE_PATTERN = r'(\d{1,2}/\d{1,2}/\d{4})'
+DASH_DATE_PATTERN = r'(\d{1,2}-\d{1,2}-\d{4})'
+ISO_DATE_PATTERN = r'(\d{4}-\d{2}-\d{2})'
+LONG_DATE_PATTERN = r'(\d{1,2})(?:st|nd|rd|th)?\s+([A-Za-z]+)\s+(\d{4})'
+DAYS_AGO_PATTERN = r'(\d+)\s+days?\s+ago'
+
+
+def parse_amounts(text:pd.Series, pattern:str):
+    """
+    Extracts the first amount matching pattern from every price text.
+
+    Returns:
+        Series of floats, NaN where there is no match.
+    """
+    amounts = text.str.extract(pattern, expand=False).str.replace(',', '', regex=False)
+    return pd.to_numeric(amounts, errors='coerce')
+
+
+def normalize_prices(text:pd.Series, transaction:pd.Series):
+    """
+    Parses sales price, monthly and weekly rent out of the raw price texts.
+
+    Parameters:
+        - text (Series): price_text, e.g. '£500,000', '£3,683 pcm\\n£850 pw' or '£4,750 pcm (£1,096 pw)'.
+        - transaction (Series): 'rent' or 'sales' for every row.
+
+    Returns:
+        dataframe with sales_price, rent_perMonth and rent_perWeek columns.
+    """
+    text = text.astype('string')
+    rent = transaction.astype('string').eq('rent').fillna(False).to_numpy()
+
+    per_month = parse_amounts(text, PCM_PATTERN).fillna(parse_amounts(text, NOT_WEEKLY_PATTERN))
+    return pd.DataFrame({
+        'sales_price': parse_amounts(text, AMOUNT_PATTERN).where(~rent),
+        'rent_perMonth': per_month.where(rent),
+        'rent_perWeek': parse_amounts(text, PW_PATTERN).where(rent),
+    }, index=text.index)
+
+
+def normalize_dates(text:pd.Series, crawled_at:pd.Series):
+    """
+    Parses the raw listed texts into dates, resolving relative ones against the crawl time.
+
+    Handles 'Added today', 'Reduced yesterday', 'Added 3 days ago', 'Added on 15/08/2024',
+    'Listed on 5th August 2024' and plain dd/mm/yyyy, dd-mm-yyyy or iso dates.
+
+    Parameters:
+        - text (Series): listed_text.
+        - crawled_at (Series): datetime64 crawl time of every row.
+
+    Returns:
+        Series of datetime64[ns], NaT where the text holds no date (e.g. 'Added > 14 days').
+    """
+    text = text.astype('string').str.lower()
+    anchor = pd.to_datetime(crawled_at).dt.normalize().astype('datetime64[ns]')
+
+    def from_pattern(pattern, date_format):
+        found = text.str.extract(pattern, expand=False)
+        return pd.to_datetime(found, format=date_format, errors='coerce').astype('datetime64[ns]')
+
+    long_parts = text.str.extract(LONG_DATE_PATTERN)
+    long_dates = pd.to_datetime(
+        long_parts[0] + ' ' + long_parts[1] + ' ' + long_parts[2], format='%d %B %Y', errors='coerce'
+    ).astype('datetime64[ns]')
+
+    days_ago = pd.to_numeric(text.str.extract(DAYS_AGO_PATTERN, expand=False), errors='coerce')
+    days_ago = days_ago.mask(text.str.contains(r'\btoday\b', na=False), 0)
+    days_ago = days_ago.mask(text.str.contains(r'\byesterday\b', na=False), 1)
+    relative = anchor - pd.to_timedelta(days_ago, unit='D')
+
+    return (
+        from_pattern(SLASH_DATE_PATTERN, '%d/%m/%Y')
+        .fillna(from_pattern(DASH_DATE_PATTERN, '%d-%m-%Y'))
+        .fillna(from_pattern(ISO_DATE_PATTERN, '%Y-%m-%d'))
+        .fillna(long_dates)
+        .fillna(relative)
+    )
+
+
+def normalize_listings(raw:pd.DataFrame, crawled_at=None):
+    """
+    Turns a batch of raw extracted rows into listings with the shared schema.
+
+    Parameters:
+        - raw (DataFrame): Rows from parse_card, a raw chunk file or several of them.
+        - crawled_at (datetime, optional): Crawl time for rows without a crawled_at value,
+          e.g. archived pages; now by default.
+
+    Returns:
+        dataframe with the shared listing schema and the crawled_at column.
+    """
+    data = raw.copy()
+    for column in RAW_TEXT_COLUMNS + ['transaction']:
+        if column not in data:
+            data[column] = None
+
+    fallback = pd.Timestamp(crawled_at or datetime.now())
+    if 'crawled_at' in data:
+        data['crawled_at'] = pd.to_datetime(data['crawled_at'], errors='coerce').fillna(fallback)
+    else:
+        data['crawled_at'] = fallback
+    data['crawled_at'] = data['crawled_at'].astype('datetime64[ns]')
+
+    prices = normalize_prices(data['price_text'], data['transaction'])
+    for column in prices:
+        data[column] = prices[column]
+    data['listed_date'] = normalize_dates(data['listed_text'], data['crawled_at'])
+
+    return coerce_listings(data.drop(columns=RAW_TEXT_COLUMNS))
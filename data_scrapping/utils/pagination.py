@@ -0,0 +1,151 @@
+"""
+Discovery of the pages a search really has.
+
+The first page of a search states how many listings match, which gives the
+exact page range instead of a hardcoded one. A portal only serves a limited
+number of pages per search, so a search with more results than that is split
+into price bands, halving the band's range of price steps until each band
+fits under the cap, and a single price step still over the cap into bedroom
+bands. Every band then runs as its own shard. The first page of
+every probed search goes through the crawl's fetcher, so with a page cache it
+is not fetched again when the band is crawled.
+"""
+import math
+import re
+from urllib.parse import quote
+
+import lxml.html
+
+from utils.html_parser import element_text, selector_to_xpath
+
+
+# price steps searches are banded on, as offered by the portals' price filters (pcm for rents)
+PRICE_STEPS = {
+    'rent': [0, 500, 750, 1000, 1250, 1500, 1750, 2000, 2250, 2500, 2750, 3000, 3500, 4000, 4500, 5000,
+             6000, 7000, 8000, 10000, 12500, 15000, 20000, 30000, None],
+    'sales': [0, 100000, 150000, 200000, 250000, 300000, 350000, 400000, 450000, 500000, 550000, 600000,
+              650000, 700000, 800000, 900000, 1000000, 1250000, 1500000, 1750000, 2000000, 2500000, 3000000,
+              4000000, 5000000, 7500000, 10000000, 15000000, None],
+}
+# bedroom bands a price band that cannot be narrowed further is split into
+BEDROOM_BANDS = [(0, 0), (1, 1), (2, 2), (3, 3), (4, 4), (5, None)]
+
+
+def read_result_count(html:str, selector=None, pattern=r'([\d,]+)\s+results'):
+    """
+    Reads the number of matching listings off a search page.
+
+    Parameters:
+        - html (str): The page source.
+        - selector (str, optional): Simple css selector of the element holding the count;
+          the whole page text is searched when None.
+        - pattern (str): Regex whose first group is the count, thousands separators allowed.
+
+    Returns:
+        int or None when the count cannot be found.
+    """
+    if not html:
+        return None
+    document = lxml.html.document_fromstring(html)
+    if selector:
+        elements = document.xpath(selector_to_xpath(selector))
+        text = element_text(elements[0]) if elements else ''
+    else:
+        text = element_text(document)
+
+    match = re.search(pattern, text, flags=re.IGNORECASE)
+    return int(match.group(1).replace(',', '')) if match else None
+
+
+def band_url(url:str, params:tuple, low=None, high=None):
+    """
+    Restricts a search url to a price band.
+
+    Parameters:
+        - url (str): The search url, with its {} page placeholder.
+        - params (tuple): Names of the minimum and maximum price query parameters.
+        - low (int, optional): Minimum price, no minimum when None.
+        - high (int, optional): Maximum price, no maximum when None.
+
+    Returns:
+        str: The url with the band's price parameters replacing any it had.
+    """
+    base, _, query = url.partition('?')
+    kept = [part for part in query.split('&') if part and part.split('=')[0] not in params]
+    for name, value in zip(params, (low, high)):
+        if value is not None:
+            kept.append(f'{quote(name)}={value}')
+    return f"{base}?{'&'.join(kept)}"
+
+
+def band_name(low=None, high=None, prefix='price'):
+    return f"{prefix}-{low if low is not None else 0}-{high if high is not None else 'max'}"
+
+
+def plan_search(spec, fetch, url:str, transaction_type:str):
+    """
+    Works out the searches and pages needed to cover every listing of url.
+
+    Parameters:
+        - spec (SiteSpec): The portal; uses result_count, price_params, price_steps, bedroom_params,
+          page_size and max_pages.
+        - fetch (function): Returns the html of a page url, e.g. a fetcher's get.
+        - url (str): The search url, with its {} page placeholder.
+        - transaction_type (str): rent or sales, picks the price steps.
+
+    Returns:
+        list of (url, pages, partition, results) tuples: one per search to crawl, with the exact
+        page parameters it needs, a partition name (None for the unbanded search) and its number
+        of results (None when unknown).
+    """
+    first = spec.first_page
+
+    def probe(search_url):
+        count = read_result_count(fetch(search_url.format(first)), *spec.result_count)
+        pages = None if count is None else max(1, math.ceil(count / spec.page_size))
+        return count, pages
+
+    count, pages = probe(url)
+    if count is None:
+        print(f'{spec.source} {transaction_type}: result count not found, crawling all {spec.max_pages} pages')
+        return [(url, spec.pages(), None, None)]
+    if pages <= spec.max_pages or not spec.price_params:
+        if pages > spec.max_pages:
+            print(f'{spec.source} {transaction_type}: {count} results, only {spec.max_pages} pages reachable')
+        print(f'{spec.source} {transaction_type}: {count} results on {min(pages, spec.max_pages)} pages')
+        return [(url, spec.pages(pages), None, count)]
+
+    steps = spec.price_steps[transaction_type]
+    plan = []
+
+    def split(low_index, high_index, search_url, count, pages):
+        low, high = steps[low_index], steps[high_index]
+        if count is None:
+            pages = spec.max_pages
+        elif pages > spec.max_pages and high_index - low_index > 1:
+            middle = (low_index + high_index) // 2
+            for band in ((low_index, middle), (middle, high_index)):
+                band_search = band_url(url, spec.price_params, steps[band[0]] or None, steps[band[1]])
+                split(*band, band_search, *probe(band_search))
+            return
+        elif pages > spec.max_pages and spec.bedroom_params:
+            # a single price step is still too big: split it by number of bedrooms
+            for bedrooms in BEDROOM_BANDS:
+                bedroom_search = band_url(search_url, spec.bedroom_params, *bedrooms)
+                bedroom_count, bedroom_pages = probe(bedroom_search)
+                name = f'{band_name(low, high)}/{band_name(*bedrooms, prefix="beds")}'
+                if bedroom_count is None or bedroom_pages > spec.max_pages:
+                    print(f'{spec.source} {transaction_type} {name}: {bedroom_count} results, '
+                          f'only {spec.max_pages} pages reachable')
+                    bedroom_pages = spec.max_pages
+                plan.append((bedroom_search, spec.pages(bedroom_pages), name, bedroom_count))
+            return
+        elif pages > spec.max_pages:
+            print(f'{spec.source} {transaction_type} {band_name(low, high)}: {count} results, '
+                  f'only {spec.max_pages} pages reachable')
+        plan.append((search_url, spec.pages(pages), band_name(low, high), count))
+
+    split(0, len(steps) - 1, url, count, pages)
+    print(f'{spec.source} {transaction_type}: {count} results, split into {len(plan)} bands '
+          f'of {sum(len(pages) for _, pages, _, _ in plan)} pages')
+    return plan
@@ -0,0 +1,90 @@
+"""
+Runs page ranges on a pool of browser workers.
+
+Every worker is a separate process that opens its own driver, so rent and
+sales crawls and the shards of a single crawl proceed side by side. Results
+are merged back in page order.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from utils.driver import DRIVER_POOL
+from utils.rate_limit import RATE_LIMITER
+from utils.schema import coerce_listings
+
+
+def shard_pages(pages, shards:int):
+    """
+    Splits pages into contiguous, near equal shards.
+
+    Parameters:
+        - pages (iterable): The page numbers (or indices) to split.
+        - shards (int): The number of shards wanted.
+
+    Returns:
+        list of lists of pages, in order, with no empty shard.
+    """
+    pages = list(pages)
+    shards = max(1, min(shards, len(pages)))
+    size, extra = divmod(len(pages), shards)
+
+    result = []
+    start = 0
+    for shard in range(shards):
+        stop = start + size + (1 if shard < extra else 0)
+        result.append(pages[start:stop])
+        start = stop
+    return [shard for shard in result if shard]
+
+
+def _init_worker(rate_limits=None):
+    """
+    Pool initializer: the worker draws from the parent's shared rate limit buckets, and its
+    warm browsers are quit when it exits.
+    """
+    if rate_limits is not None:
+        RATE_LIMITER.share(rate_limits)
+    DRIVER_POOL.close_at_exit()
+
+
+def get_data_parallel(scrape_pages, jobs, workers=None, **kwargs):
+    """
+    Scrapes several page ranges on a pool of processes, each with its own driver.
+
+    Parameters:
+        - scrape_pages (function): The scraper's module level scrape_pages function, returning a dataframe.
+        - jobs (list): (url, transaction_type, source, pages) tuples, e.g. one for rent and one for sales,
+          optionally followed by a dict of keyword arguments for that job only.
+        - workers (int, optional): Number of browser processes, defaults to the number of CPUs.
+        - kwargs: Passed on to scrape_pages (extraction, archive_dir, ...).
+
+    Returns:
+        list of dataframes, one per job, with the rows in page order.
+    """
+    if not jobs:
+        return []
+    workers = workers or os.cpu_count()
+    # a few shards per worker so a slow shard does not hold up the whole pool
+    shards_per_job = max(1, -(-workers * 2 // len(jobs)))
+
+    # workers share the limiter's buckets, keep their browser warm between shards and quit it
+    # when the pool shuts down
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(RATE_LIMITER.path,)) as executor:
+        futures = [
+            [executor.submit(scrape_pages, url, transaction_type, source, shard,
+                             **kwargs, **(job_kwargs[0] if job_kwargs else {}))
+             for shard in shard_pages(pages, shards_per_job)]
+            for url, transaction_type, source, pages, *job_kwargs in jobs
+        ]
+
+        results = []
+        for job_futures in futures:
+            frames = [future.result() for future in job_futures]
+            # shards encode their categoricals independently, so restore the schema after concat
+            # a job without pages gives an empty frame with the schema
+            results.append(coerce_listings(pd.concat(frames or [pd.DataFrame()], ignore_index=True)))
+
+    return results
@@ -0,0 +1,267 @@
+"""
+Adaptive per-domain rate limiting for the scrapers' network requests.
+
+Each domain gets a token bucket refilled at its current rate. Only network
+requests take tokens, so parsing and bookkeeping never wait. The rate adapts
+AIMD style: it is cut when a response is slow or a block page comes back,
+and creeps back up while the site answers quickly.
+
+RATE_LIMITER is shared by every fetcher and get_pages in a process. Once
+share() points it at a sqlite file, as engine.run does before starting its
+pool, the buckets live in that file and every process using it draws from the
+same bucket per domain, so the workers together keep to the domain's rate.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+# starting requests per second for domains that need a gentler pace
+DEFAULT_RATES = {
+    'www.onthemarket.com': 1.0,
+}
+# titles of bot protection interstitials (Cloudflare, Imperva, Akamai) served instead of results
+BLOCK_TITLES = ('just a moment', 'attention required', 'access denied', 'pardon our interruption',
+                'are you a robot', 'security check')
+# text and elements only found on block and challenge pages; a bare 'captcha' also matches
+# ordinary pages that load reCAPTCHA for their contact forms
+BLOCK_MARKERS = ('are you a robot', 'unusual traffic', 'request blocked', 'verify you are a human',
+                 'checking your browser', 'id="px-captcha"', 'id="challenge-form"', 'cf-chl-')
+TITLE_PATTERN = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+
+def is_block_page(html, status=200):
+    """
+    Tells whether a response is a block page rather than search results.
+
+    Parameters:
+        - html (str): The response body.
+        - status (int): The http status code.
+
+    Returns:
+        bool
+    """
+    if status in (403, 429):
+        return True
+    text = (html or '')[:20000].lower()
+    title = TITLE_PATTERN.search(text)
+    if title and any(marker in title.group(1) for marker in BLOCK_TITLES):
+        return True
+    return any(marker in text for marker in BLOCK_MARKERS)
+
+
+class _Request:
+    """Outcome of one gated request; callers set blocked when they see a block page."""
+
+    def __init__(self):
+        self.blocked = False
+
+
+class DomainRateLimiter:
+    """
+    Token bucket rate limiter keyed by domain, adapting to how the site responds.
+
+    Parameters:
+        - rate (float): Starting requests per second for domains not in rates.
+        - rates (dict, optional): Starting rate per domain.
+        - min_rate (float): Lowest rate the limiter backs off to.
+        - max_rate (float): Highest rate the limiter speeds up to.
+        - burst (float): Bucket capacity, i.e. requests allowed back to back.
+        - slow_after (float): Response time in seconds above which the rate is cut.
+        - increase (float): Requests per second added after each fast response.
+        - decrease (float): Factor applied to the rate after a slow or blocked response.
+    """
+
+    def __init__(self, rate=2.0, rates=None, min_rate=0.1, max_rate=5.0, burst=1.0,
+                 slow_after=5.0, increase=0.1, decrease=0.5):
+        self.rate = rate
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.slow_after = slow_after
+        self.increase = increase
+        self.decrease = decrease
+        self.domains = {}
+        self.lock = threading.Lock()
+        self.path = None
+        self._connection = None
+        self._pid = None
+
+    # the connection is opened lazily, once per process, so the limiter survives a fork or a pickle
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def share(self, path:str):
+        """
+        Keeps the token buckets in a sqlite file, so every process sharing it keeps to the
+        domains' rates together. The adapted rates carry over to later runs using the file.
+
+        Parameters:
+            - path (str): The sqlite file.
+        """
+        with self.lock:
+            self.path = path
+            self._connection = None
+        return self
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (domain TEXT PRIMARY KEY, rate REAL, tokens REAL, updated REAL)'
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    @contextmanager
+    def _bucket(self, domain:str, state:dict):
+        """
+        Holds the domain's bucket for an update: with a shared file its rate and tokens are
+        read from it under a write lock and written back at the end.
+        """
+        if self.path is None:
+            yield
+            return
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT rate, tokens, updated FROM buckets WHERE domain = ?', (domain,)).fetchone()
+            if row:
+                state['rate'], state['tokens'], state['updated'] = row
+            yield
+            connection.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)',
+                               (domain, state['rate'], state['tokens'], state['updated']))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _domain(self, url):
+        domain = urlsplit(url).netloc
+        if domain not in self.domains:
+            self.domains[domain] = {
+                'rate': self.rates.get(domain, self.rate),
+                'tokens': self.burst,
+                'updated': time.time(),
+                'requests': 0,
+                'first_request': None,
+                'last_request': None,
+                'wait_time': 0.0,
+                'slowdowns': 0,
+                'blocked': 0,
+            }
+        return self.domains[domain]
+
+    def acquire(self, url):
+        """
+        Blocks until the url's domain has a token available.
+
+        Parameters:
+            - url (str): The url about to be requested.
+
+        Returns:
+            float: Seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                state = self._domain(url)
+                # time.time rather than monotonic, as the bucket's timestamp may come from another process
+                with self._bucket(urlsplit(url).netloc, state):
+                    now = time.time()
+                    state['tokens'] = min(self.burst, state['tokens'] + max(0.0, now - state['updated']) * state['rate'])
+                    state['updated'] = now
+
+                    if state['tokens'] >= 1:
+                        state['tokens'] -= 1
+                        state['requests'] += 1
+                        state['wait_time'] += waited
+                        state['first_request'] = state['first_request'] or now
+                        state['last_request'] = now
+                        return waited
+
+                    delay = (1 - state['tokens']) / state['rate']
+
+            time.sleep(delay)
+            waited += delay
+
+    def record(self, url, elapsed, blocked=False):
+        """
+        Adapts the domain's rate to the outcome of a request.
+
+        Parameters:
+            - url (str): The url that was requested.
+            - elapsed (float): Response time in seconds.
+            - blocked (bool): Whether a block page came back.
+        """
+        with self.lock:
+            state = self._domain(url)
+            with self._bucket(urlsplit(url).netloc, state):
+                if blocked or elapsed > self.slow_after:
+                    state['rate'] = max(self.min_rate, state['rate'] * self.decrease)
+                    state['slowdowns'] += 1
+                    state['blocked'] += int(blocked)
+                else:
+                    state['rate'] = min(self.max_rate, state['rate'] + self.increase)
+
+    @contextmanager
+    def request(self, url):
+        """
+        Gates one network request and records how it went.
+
+            with RATE_LIMITER.request(url) as outcome:
+                html = driver.page_source
+                outcome.blocked = is_block_page(html)
+        """
+        self.acquire(url)
+        outcome = _Request()
+        start = time.perf_counter()
+        try:
+            yield outcome
+        except Exception:
+            outcome.blocked = True
+            raise
+        finally:
+            self.record(url, time.perf_counter() - start, outcome.blocked)
+
+    def metrics(self):
+        """
+        Returns per domain: requests made, current rate, observed rate (requests per
+        second between the first and last request), total wait time, slowdowns and block pages.
+        """
+        with self.lock:
+            result = {}
+            for domain, state in self.domains.items():
+                span = (state['last_request'] or 0) - (state['first_request'] or 0)
+                result[domain] = {
+                    'requests': state['requests'],
+                    'rate': round(state['rate'], 3),
+                    'observed_rate': round((state['requests'] - 1) / span, 3) if span > 0 else None,
+                    'wait_time': round(state['wait_time'], 2),
+                    'slowdowns': state['slowdowns'],
+                    'blocked': state['blocked'],
+                }
+            return result
+
+    def report(self):
+        for domain, values in self.metrics().items():
+            print(f"{domain}: {values['requests']} requests, observed {values['observed_rate']} req/s, "
+                  f"current limit {values['rate']} req/s, waited {values['wait_time']}s, "
+                  f"{values['slowdowns']} slowdowns ({values['blocked']} block pages)")
+
+
+RATE_LIMITER = DomainRateLimiter()
@@ -0,0 +1,259 @@
+"""
+The listing schema shared by all the scrapers.
+
+Every source produces the same columns with the same dtypes: nullable fixed
+width integers for counts and prices, dictionary encoded categoricals for the
+low cardinality text columns and a real datetime for listed_date. While a
+crawl runs, rows are held column wise in a ListingBuffer instead of a list
+of dicts.
+"""
+from array import array
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+
+LISTING_COLUMNS = {
+    'transaction': 'category',
+    'address': 'string',
+    'bedroom': 'Int8',
+    'bathroom': 'Int8',
+    'living_room': 'Int8',
+    'sales_price': 'Int32',
+    'rent_perMonth': 'Int32',
+    'rent_perWeek': 'Int32',
+    'description': 'string',
+    'propertyType': 'category',
+    'location': 'category',
+    'agent': 'category',
+    'listing_source': 'category',
+    'listing_url': 'string',
+    'listed_date': 'datetime64[ns]',
+}
+# rows as extraction produces them: price and date still as text, see utils.normalize
+RAW_LISTING_COLUMNS = {
+    'transaction': 'category',
+    'address': 'string',
+    'bedroom': 'Int8',
+    'bathroom': 'Int8',
+    'living_room': 'Int8',
+    'description': 'string',
+    'propertyType': 'category',
+    'location': 'category',
+    'agent': 'category',
+    'listing_source': 'category',
+    'listing_url': 'string',
+    'price_text': 'string',
+    'listed_text': 'string',
+    'crawled_at': 'string',
+}
+INTEGER_TYPECODES = {'Int8': 'b', 'Int16': 'h', 'Int32': 'i', 'Int64': 'q'}
+# formats listed_date comes in: date objects saved as iso, Rightmove and Zoopla dates
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def out_of_range(values, dtype:str):
+    """
+    Tells which values a nullable integer dtype, e.g. 'Int8', cannot hold; works on a number or an array.
+    """
+    limits = np.iinfo(dtype.lower())
+    return (values < limits.min) | (values > limits.max)
+
+
+def to_int(value):
+    """
+    Converts '2', 2.0 or 2 to 2; None, NaN and anything unparsable to None.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return None
+        return None if number != number else int(number)
+
+
+def to_date(value):
+    """
+    Converts a date, datetime or a string in one of DATE_FORMATS to a date, else None.
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, str):
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_dates(values:pd.Series):
+    """
+    Vectorized to_date over a Series of dates and date strings.
+
+    Returns:
+        Series of datetime64[ns], NaT where no format matched.
+    """
+    text = values.map(lambda value: value.isoformat() if isinstance(value, (date, datetime)) else value)
+    text = text.where(text.map(lambda value: isinstance(value, str))).astype('string')
+    result = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    for date_format in DATE_FORMATS:
+        missing = result.isna()
+        if not missing.any():
+            break
+        parsed = pd.to_datetime(text[missing].str.strip().str[:10], format=date_format, errors='coerce')
+        result[missing] = parsed.astype('datetime64[ns]')
+    return result
+
+
+def coerce_listings(data:pd.DataFrame):
+    """
+    Casts a listings dataframe to the shared schema.
+
+    Parameters:
+        - data (DataFrame): Listings from any scraper, a snapshot csv or a concat of several.
+
+    Returns:
+        dataframe with every LISTING_COLUMNS column, in schema order and with schema dtypes,
+        followed by any extra columns.
+    """
+    data = data.copy()
+    for column, dtype in LISTING_COLUMNS.items():
+        if column not in data:
+            data[column] = None
+        values = data[column]
+
+        if dtype in INTEGER_TYPECODES:
+            numbers = pd.to_numeric(values, errors='coerce').astype('float64').round()
+            # values too large for the column are missing, as in ListingBuffer, rather than wrapped
+            data[column] = numbers.mask(out_of_range(numbers, dtype)).astype(dtype)
+        elif dtype == 'datetime64[ns]':
+            data[column] = values if values.dtype == dtype else parse_dates(values)
+        elif dtype == 'category':
+            data[column] = values.astype('string').astype('category')
+        else:
+            data[column] = values.astype(dtype)
+
+    extra = [column for column in data.columns if column not in LISTING_COLUMNS]
+    return data[list(LISTING_COLUMNS) + extra]
+
+
+def read_listings(path:str):
+    """
+    Loads a snapshot csv with the shared schema.
+    """
+    text_columns = {column: 'string' for column, dtype in LISTING_COLUMNS.items() if dtype != 'datetime64[ns]'}
+    return coerce_listings(pd.read_csv(path, dtype=text_columns))
+
+
+class ListingBuffer:
+    """
+    Column wise container for listing rows while a crawl runs.
+
+    Integers live in typed arrays with a missing mask, categoricals as integer
+    codes into a per column dictionary and dates as day numbers, so a row costs a
+    few bytes plus its free text instead of a dict of Python objects.
+
+    Parameters:
+        - columns (dict): Column name -> dtype, LISTING_COLUMNS by default.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = dict(columns or LISTING_COLUMNS)
+        self.length = 0
+        self.values = {}
+        self.masks = {}
+        self.categories = {}
+
+        for column, dtype in self.columns.items():
+            if dtype in INTEGER_TYPECODES:
+                self.values[column] = array(INTEGER_TYPECODES[dtype])
+                self.masks[column] = bytearray()
+            elif dtype == 'category':
+                self.values[column] = array('l')
+                self.categories[column] = {}
+            elif dtype == 'datetime64[ns]':
+                self.values[column] = array('l')
+                self.masks[column] = bytearray()
+            else:
+                self.values[column] = []
+
+    def __len__(self):
+        return self.length
+
+    def append(self, row:dict):
+        for column, dtype in self.columns.items():
+            value = row.get(column)
+
+            if dtype in INTEGER_TYPECODES or dtype == 'datetime64[ns]':
+                if dtype in INTEGER_TYPECODES:
+                    number = to_int(value)
+                else:
+                    day = to_date(value)
+                    number = None if day is None else day.toordinal() - EPOCH_ORDINAL
+                if number is not None and dtype in INTEGER_TYPECODES and out_of_range(number, dtype):
+                    number = None
+                try:
+                    self.values[column].append(0 if number is None else number)
+                except OverflowError:
+                    number = None
+                    self.values[column].append(0)
+                self.masks[column].append(number is None)
+
+            elif dtype == 'category':
+                if value is None or value != value:
+                    self.values[column].append(-1)
+                else:
+                    codes = self.categories[column]
+                    self.values[column].append(codes.setdefault(str(value), len(codes)))
+
+            else:
+                self.values[column].append(None if value is None else str(value))
+
+        self.length += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def column(self, name:str):
+        """
+        Returns the decoded values of one column as a list.
+        """
+        if self.columns[name] == 'string':
+            return list(self.values[name])
+        return self.to_frame()[name].tolist()
+
+    def to_frame(self):
+        """
+        Builds the typed dataframe of the buffered rows.
+        """
+        data = {}
+        for column, dtype in self.columns.items():
+            values = self.values[column]
+
+            if dtype in INTEGER_TYPECODES:
+                data[column] = pd.arrays.IntegerArray(
+                    np.array(values, dtype=dtype.lower()),
+                    np.frombuffer(bytes(self.masks[column]), dtype=bool).copy(),
+                )
+            elif dtype == 'category':
+                categories = list(self.categories[column])
+                data[column] = pd.Categorical.from_codes(np.asarray(values, dtype='int64'), categories=categories)
+            elif dtype == 'datetime64[ns]':
+                days = np.asarray(values, dtype='int64').astype('datetime64[D]').astype('datetime64[ns]')
+                days[np.frombuffer(bytes(self.masks[column]), dtype=bool)] = np.datetime64('NaT')
+                data[column] = days
+            else:
+                data[column] = pd.array(values, dtype=dtype)
+
+        return pd.DataFrame(data, columns=list(self.columns))
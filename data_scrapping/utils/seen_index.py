@@ -0,0 +1,92 @@
+"""
+Persistent index of the listings already scraped, per source and transaction.
+
+Incremental crawls use it to skip cards that are already stored and to stop
+paging once a page is mostly made of known listings, which works when the
+search is sorted newest first (SiteSpec.newest_first: Zoopla's
+results_sort=newest_listings, Rightmove's sortType=6).
+"""
+import os
+import sqlite3
+import time
+
+
+class SeenIndex:
+    """
+    Set of listing urls seen so far, stored in sqlite.
+
+    Parameters:
+        - path (str): The sqlite file.
+    """
+
+    def __init__(self, path='data_output/seen_listings.sqlite'):
+        self.path = path
+        self._connection = None
+
+    # the connection is opened lazily so the index can be sent to pool workers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS seen ('
+                'source TEXT, transaction_type TEXT, listing_url TEXT, first_seen REAL, last_seen REAL, '
+                'PRIMARY KEY (source, transaction_type, listing_url))'
+            )
+        return self._connection
+
+    def known(self, source:str, transaction_type:str, urls):
+        """
+        Returns the subset of urls already in the index.
+        """
+        urls = [url for url in set(urls) if url]
+        known = set()
+        # stay under sqlite's limit on bound parameters
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f'SELECT listing_url FROM seen WHERE source = ? AND transaction_type = ? '
+                f'AND listing_url IN ({placeholders})',
+                (source, transaction_type, *chunk),
+            ).fetchall()
+            known.update(row[0] for row in rows)
+        return known
+
+    def add(self, source:str, transaction_type:str, urls):
+        """
+        Records urls as seen, refreshing last_seen for the ones already known.
+        """
+        now = time.time()
+        self.connection.executemany(
+            'INSERT INTO seen VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (source, transaction_type, listing_url) DO UPDATE SET last_seen = excluded.last_seen',
+            [(source, transaction_type, url, now, now) for url in set(urls) if url],
+        )
+        self.connection.commit()
+
+    def filter_new(self, source:str, transaction_type:str, cards):
+        """
+        Drops the cards whose listing_url is already in the index.
+
+        Parameters:
+            - source (str): The source of the cards.
+            - transaction_type (str): rent or sales.
+            - cards (list): Raw card dicts with a listing_url field.
+
+        Returns:
+            (list of new cards, share of the page's cards that were already known)
+        """
+        if not cards:
+            return [], 0.0
+        known = self.known(source, transaction_type, (card['listing_url'] for card in cards))
+        new_cards = [card for card in cards if card['listing_url'] not in known]
+        return new_cards, 1 - len(new_cards) / len(cards)
@@ -0,0 +1,162 @@
+"""
+Streaming, checkpointed output for the crawls.
+
+Each page's raw rows are written to their own chunk file as soon as the page is
+parsed, under data_output/partitions/<source>/<run date>/<transaction>/. A
+sqlite checkpoint records every completed page, so a crawl that dies on page
+39 resumes from there. Pages still empty or short after the retries are
+recorded as failed instead, so a resume fetches them again. compact joins the
+chunks into the source's dated snapshot csv.
+"""
+import csv
+import glob
+import os
+import sqlite3
+import time
+from datetime import date
+
+import pandas as pd
+
+from utils.normalize import normalize_listings
+
+
+class PartitionWriter:
+    """
+    Appends the rows of each crawled page to a chunk file of its own.
+
+    Parameters:
+        - root (str): Folder the partitions are written under.
+        - run_date (str, optional): Partition of this run, today by default. Re-running on the
+          same date resumes from the checkpoint.
+    """
+
+    def __init__(self, root='data_output/partitions', run_date=None):
+        self.root = root
+        self.run_date = str(run_date or date.today())
+        self._connection = None
+
+    # the connection is opened lazily so the writer can be sent to pool workers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._connection = sqlite3.connect(os.path.join(self.root, 'checkpoint.sqlite'), timeout=30)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                'source TEXT, transaction_type TEXT, run_date TEXT, page INTEGER, rows INTEGER, completed REAL, '
+                'PRIMARY KEY (source, transaction_type, run_date, page))'
+            )
+            # pages still empty or short after the retries, crawled again on resume
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS failed_pages ('
+                'source TEXT, transaction_type TEXT, run_date TEXT, page INTEGER, rows INTEGER, failed REAL, '
+                'PRIMARY KEY (source, transaction_type, run_date, page))'
+            )
+        return self._connection
+
+    def partition_dir(self, source:str, transaction_type:str):
+        return os.path.join(self.root, source, self.run_date, transaction_type)
+
+    def write(self, source:str, transaction_type:str, page:int, rows:list, complete=True):
+        """
+        Writes one page's raw rows to its chunk file and checkpoints the page, or records it as
+        failed when it is not complete, so a resumed crawl fetches it again.
+
+        Parameters:
+            - source (str): The source of the rows.
+            - transaction_type (str): rent or sales.
+            - page (int): The page (or index) the rows came from.
+            - rows (list): The raw listing rows of the page.
+            - complete (bool): Whether the page loaded completely, see engine.page_complete.
+        """
+        if rows:
+            directory = self.partition_dir(source, transaction_type)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'part-{page:06d}.csv')
+
+            # write then rename, so a half written chunk never looks complete
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(temp_path, path)
+
+        record = (source, transaction_type, self.run_date, page, len(rows), time.time())
+        if complete:
+            self.connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)', record)
+            self.connection.execute(
+                'DELETE FROM failed_pages WHERE source = ? AND transaction_type = ? AND run_date = ? AND page = ?',
+                record[:4],
+            )
+        else:
+            self.connection.execute('INSERT OR REPLACE INTO failed_pages VALUES (?, ?, ?, ?, ?, ?)', record)
+        self.connection.commit()
+
+    def completed_pages(self, source:str, transaction_type:str):
+        """
+        Returns the set of pages of this run already written.
+        """
+        rows = self.connection.execute(
+            'SELECT page FROM pages WHERE source = ? AND transaction_type = ? AND run_date = ?',
+            (source, transaction_type, self.run_date),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def failed_pages(self, source:str, transaction_type:str):
+        """
+        Returns the set of pages of this run that were still empty or short after the retries.
+        """
+        rows = self.connection.execute(
+            'SELECT page FROM failed_pages WHERE source = ? AND transaction_type = ? AND run_date = ?',
+            (source, transaction_type, self.run_date),
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def last_completed_page(self, source:str, transaction_type:str):
+        """
+        Returns the highest page of this run already written, or None.
+        """
+        return self.connection.execute(
+            'SELECT MAX(page) FROM pages WHERE source = ? AND transaction_type = ? AND run_date = ?',
+            (source, transaction_type, self.run_date),
+        ).fetchone()[0]
+
+    def read(self, source:str, transaction_type:str):
+        """
+        Reads the raw chunks of one source and transaction back as text, in page order, followed
+        by the chunks of its price and bedroom bands.
+        """
+        directory = self.partition_dir(source, transaction_type)
+        paths = sorted(glob.glob(os.path.join(directory, '**', 'part-*.csv'), recursive=True))
+        if not paths:
+            return pd.DataFrame()
+        return pd.concat((pd.read_csv(path, dtype=str) for path in paths), ignore_index=True)
+
+    def compact(self, source:str, path='data_output'):
+        """
+        Joins and normalizes the raw rent and sales chunks of a source into the run's snapshot csv.
+        Running it again re-normalizes the run from its raw chunks.
+
+        Parameters:
+            - source (str): The source to compact, e.g. 'rightmove'.
+            - path (str): Folder the snapshot is saved to.
+
+        Returns:
+            dataframe: The merged snapshot, with the shared schema.
+        """
+        raw = pd.concat([self.read(source, 'rent'), self.read(source, 'sales')], ignore_index=True)
+        data = normalize_listings(raw)
+
+        # a listing priced on a band boundary is in both bands
+        duplicated = data.duplicated(['transaction', 'listing_url']) & data['listing_url'].notna()
+        data = data[~duplicated].reset_index(drop=True)
+
+        os.makedirs(path, exist_ok=True)
+        data.to_csv(f'{path}/{source}_{self.run_date}.csv', index=False)
+        return data
@@ -1,53 +1,104 @@
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
-import os
-import pandas as pd
-from datetime import datetime, date
-from selenium.webdriver.chrome.service import Service
-
-
-def get_driver():
-
-    try:
-        options = webdriver.ChromeOptions()
-        capabilities = DesiredCapabilities.CHROME.copy()
-        capabilities['acceptInsecureCerts'] = True
-
-        # options.add_argument('--ignore-ssl-errors=yes')
-        # options.add_argument('--ignore-certificate-errors')
-        
-        service = Service(executable_path=r'C:\Windows\chromedriver.exe')
-    
-        driver = webdriver.Chrome(service=service)
-
-        #set up chromedriver in this location or replace the location there
-        # driver = webdriver.Chrome(, options=options, desired_capabilities=capabilities)
-        
-        print(driver)
-        return driver
-    
-    except Exception as e:
-        print(e)
-
-def merge_save(rents_data,sales_data):
+import time
+
+
+# Reads every requested field of every card inside the browser and hands back
+# plain dicts, so a whole page costs one chromedriver round-trip.
+EXTRACT_CARDS_JS = """
+var cards = arguments[0], fields = arguments[1];
+return cards.map(function (card) {
+    var row = {};
+    Object.keys(fields).forEach(function (name) {
+        var selector = fields[name][0], attr = fields[name][1];
+        var el = selector ? card.querySelector(selector) : card;
+        var value = null;
+        if (el) {
+            if (attr === 'text') {
+                value = (el.innerText || '').trim();
+            } else if (attr === 'textContent') {
+                value = el.textContent;
+            } else {
+                value = el[attr];
+                if (value === undefined || value === null || typeof value === 'object') {
+                    value = el.getAttribute(attr);
+                }
+            }
+        }
+        row[name] = value;
+    });
+    return row;
+});
+"""
+
+
+def read_card_fields(card, fields):
+    """
+    Reads the raw fields of one card with a find_element call per field.
+
+    Parameters:
+        - card (WebElement): The card element returned by get_pages.
+        - fields (dict): Field name -> (css selector, attribute) pairs. The attribute is
+          'text', 'textContent' or any element attribute such as 'href' or 'alt'.
+
+    Returns:
+        dict of raw field values, None where the element is missing.
+    """
+    row = {}
+    for name, (selector, attr) in fields.items():
+        try:
+            element = card.find_element(By.CSS_SELECTOR, selector) if selector else card
+            if attr == 'text':
+                row[name] = element.text
+            else:
+                row[name] = element.get_attribute(attr)
+        except Exception:
+            row[name] = None
+    return row
+
+
+def read_cards(page_html, fields, driver=None):
+    """
+    Reads the raw fields of all the cards on a page.
+
+    Parameters:
+        - page_html (list): The card elements returned by get_pages.
+        - fields (dict): Field name -> (css selector, attribute) pairs, see read_card_fields.
+        - driver (WebDriver, optional): When given, every card is read in a single
+          injected script call instead of one find_element request per field.
+
+    Returns:
+        list of dicts with the raw field values of each card.
     """
-    Takes two DataFrame, merged the data and then save the daa to a folder as csv file
+    if not page_html:
+        return []
+    if driver is not None:
+        return driver.execute_script(EXTRACT_CARDS_JS, page_html, fields)
+    return [read_card_fields(card, fields) for card in page_html]
 
-    Args:
-        - rent_data (DataFrame): The dataframe of the rent daset
-        - sales_data (DataFrame): The type of transaction for which information needs to be extracted.
+
+def time_extraction(extract, page_html, transaction_type, source, driver):
+    """
+    Runs the batch and the per-element extraction on the same page and reports both timings.
+
+    Parameters:
+        - extract (function): The scraper's extract_data function.
+        - page_html (list): The card elements returned by get_pages.
+        - transaction_type (str): rent or sales.
+        - source (str): The source of the web page content.
+        - driver (WebDriver): The driver the page was loaded with.
 
     Returns:
-        dataframe containing the data sccrapped from the website   
+        list of rows from the batch extraction.
     """
-    # merged the two data
-    appended_data = pd.concat([rents_data, sales_data])
-
-    #save it as csv
-    path = 'data_output'
-    if not os.path.exists(path):
-        os.mkdir(path)
-    
-    # save the combined data to csv within the path
-    appended_data.to_csv(f'{path}/omt_{date.today()}.csv', index=False)
\ No newline at end of file
+    start = time.perf_counter()
+    batch_rows = extract(page_html, transaction_type, source, driver=driver)
+    batch_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    element_rows = extract(page_html, transaction_type, source)
+    element_time = time.perf_counter() - start
+
+    speed_up = element_time / batch_time if batch_time else float('inf')
+    print(f'{len(page_html)} cards: batch {batch_time:.2f}s, per element {element_time:.2f}s '
+          f'({speed_up:.1f}x), rows match: {batch_rows == element_rows}')
+    return batch_rows
@@ -0,0 +1,137 @@
+"""
+Condition based waits for pages rendered in the browser.
+
+Instead of reading the cards straight after driver.get (and getting an empty
+page when rendering is slow) or sleeping a fixed time, the page is polled until
+the site's readiness condition holds: the card count reaches the expected page
+size, or the results container is there and the count has stopped changing,
+as on the last, partial page. The timeout follows the latencies recently
+observed for the domain, so fast sites are not given a slow site's budget and
+a slowing site is not cut off early.
+"""
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+
+# card count and whether the results container is there, in one round-trip
+PAGE_STATE_JS = """
+var container = arguments[1] ? document.querySelector(arguments[1]) !== null : false;
+return [document.querySelectorAll(arguments[0]).length, container];
+"""
+
+
+class LatencyTracker:
+    """
+    Recent time-to-ready of the pages of each domain, turned into a wait timeout.
+
+    Parameters:
+        - window (int): Number of recent pages kept per domain.
+        - percentile (float): Percentile of the recent latencies the timeout is based on.
+        - factor (float): Multiplier giving the timeout headroom over that percentile.
+        - min_timeout (float): Lowest timeout in seconds.
+        - max_timeout (float): Highest timeout in seconds.
+        - default (float): Timeout until min_samples pages of the domain have been seen.
+        - min_samples (int): Pages needed before the timeout adapts.
+    """
+
+    def __init__(self, window=50, percentile=95, factor=2.0, min_timeout=2.0, max_timeout=30.0, default=10.0,
+                 min_samples=5):
+        self.window = window
+        self.percentile = percentile
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.default = default
+        self.min_samples = min_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, url:str, seconds:float):
+        with self.lock:
+            self.samples.setdefault(urlsplit(url).netloc, deque(maxlen=self.window)).append(seconds)
+
+    def timeout(self, url:str):
+        """
+        Returns the wait timeout in seconds for a page of url's domain.
+        """
+        with self.lock:
+            samples = sorted(self.samples.get(urlsplit(url).netloc, ()))
+        if len(samples) < self.min_samples:
+            return self.default
+        rank = min(len(samples) - 1, int(round(self.percentile / 100 * (len(samples) - 1))))
+        return min(self.max_timeout, max(self.min_timeout, samples[rank] * self.factor))
+
+
+PAGE_LATENCY = LatencyTracker()
+
+
+class PageReady:
+    """
+    Readiness condition polled by WebDriverWait.
+
+    The page is ready once min_cards cards are present, or once the count has not
+    changed for settle seconds while there is at least one card or the results
+    container is present (a partial last page, or a search with no results).
+
+    Parameters:
+        - card_selector (str): Css selector of a property card.
+        - min_cards (int): Cards of a full page.
+        - container_selector (str, optional): Css selector present once the results have rendered.
+        - settle (float): Seconds the card count has to stay unchanged on a partial page.
+    """
+
+    def __init__(self, card_selector:str, min_cards:int, container_selector=None, settle=1.0):
+        self.card_selector = card_selector
+        self.min_cards = min_cards
+        self.container_selector = container_selector
+        self.settle = settle
+        self.cards = 0
+        self.changed = time.monotonic()
+
+    def __call__(self, driver):
+        cards, container = driver.execute_script(PAGE_STATE_JS, self.card_selector, self.container_selector)
+        now = time.monotonic()
+        if cards != self.cards:
+            self.cards = cards
+            self.changed = now
+
+        if cards >= self.min_cards:
+            return True
+        return (cards > 0 or container) and now - self.changed >= self.settle
+
+
+def wait_until_ready(driver, url:str, card_selector:str, min_cards:int, container_selector=None,
+                     tracker=None, started=None, poll=0.2):
+    """
+    Polls the loaded page until it is ready or the adaptive timeout runs out.
+
+    Parameters:
+        - driver (WebDriver): The driver the page was loaded in.
+        - url (str): The page url, for the per domain timeout.
+        - card_selector (str): Css selector of a property card.
+        - min_cards (int): Cards of a full page.
+        - container_selector (str, optional): See PageReady.
+        - tracker (LatencyTracker, optional): Where the time to ready is recorded, PAGE_LATENCY by default.
+        - started (float, optional): time.perf_counter() when the page load started, so the
+          recorded latency covers the load as well as the wait.
+        - poll (float): Seconds between two checks.
+
+    Returns:
+        int: The number of cards on the page when the wait ended.
+    """
+    tracker = tracker or PAGE_LATENCY
+    started = time.perf_counter() if started is None else started
+    timeout = tracker.timeout(url)
+    condition = PageReady(card_selector, min_cards, container_selector)
+
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=poll).until(condition)
+    except TimeoutException:
+        print(f'{url}: not ready after {timeout:.1f}s, {condition.cards} cards')
+    tracker.record(url, time.perf_counter() - started)
+    return condition.cards
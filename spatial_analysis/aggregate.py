@@ -0,0 +1,226 @@
+"""
+************************************************
+POINT IN POLYGON AGGREGATION
+************************************************
+Area statistics of listings (or any points) per polygon, e.g. per London
+borough or postcode district, as the notebook's sjoin(..., predicate="within")
+followed by a groupby, but without materialising the joined frame.
+
+Points are processed in chunks on a pool of processes. Each worker gets the
+polygons once and prepares them. A chunk's points are bucketed into a grid,
+the box around each occupied cell goes into an STRtree, and every polygon is
+queried against it in one bulk call. Cells a polygon properly contains put
+all their points in it without any point test; only the points of cells
+crossing a boundary are tested, with shapely.contains_xy on the raw
+coordinates, so no point geometry is ever built. polygon.contains(point) is
+exactly point.within(polygon): a point on a boundary is left out as sjoin
+leaves it out, and a point in two overlapping polygons counts in both. Only
+(point, polygon) index pairs come back, and every statistic is then computed
+from them in one sort.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+
+# statistics added to the polygons
+AGGREGATE_COLUMNS = ('count', 'median_price', 'median_rent', 'rent_per_bedroom')
+# points per grid cell a chunk is bucketed into
+POINTS_PER_CELL = 32
+
+# polygons of this worker process, prepared once
+_POLYGONS = None
+
+
+def _init_worker(polygons):
+    global _POLYGONS
+    shapely.prepare(polygons)
+    _POLYGONS = polygons
+
+
+def _expand(starts, counts):
+    """
+    Concatenates the ranges start, start + 1, ..., start + count - 1.
+    """
+    total = int(counts.sum())
+    ends = np.cumsum(counts)
+    return np.arange(total) - np.repeat(ends - counts, counts) + np.repeat(starts, counts)
+
+
+def _join_chunk(x, y, offset=0, polygons=None):
+    """
+    Pairs the points of a chunk with the polygons containing them.
+
+    Returns:
+        (point, polygon) arrays of positions, points numbered from offset.
+    """
+    polygons = _POLYGONS if polygons is None else polygons
+    empty = np.empty(0, dtype=np.int64)
+    if not len(x):
+        return empty, empty
+
+    # bucket the points into a grid of about POINTS_PER_CELL points a cell
+    x0, y0, x1, y1 = x.min(), y.min(), x.max(), y.max()
+    width, height = max(x1 - x0, 1e-9), max(y1 - y0, 1e-9)
+    cells = max(1, len(x) // POINTS_PER_CELL)
+    columns = max(1, int(np.sqrt(cells * width / height)))
+    rows = max(1, cells // columns)
+    column = np.minimum(((x - x0) / width * columns).astype(np.int64), columns - 1)
+    row = np.minimum(((y - y0) / height * rows).astype(np.int64), rows - 1)
+    cell = row * columns + column
+    order = np.argsort(cell, kind='stable')
+    counts = np.bincount(cell, minlength=rows * columns)
+    starts = np.cumsum(counts) - counts
+
+    # boxes around the points of each occupied cell, queried in bulk by the prepared polygons
+    occupied = np.flatnonzero(counts)
+    first = starts[occupied]
+    cell_x, cell_y = x[order], y[order]
+    # padded so a cell of one point is not a degenerate box; a larger box only makes the tests stricter
+    pad = 1e-9 * max(width, height, 1.0)
+    boxes = shapely.box(np.minimum.reduceat(cell_x, first) - pad, np.minimum.reduceat(cell_y, first) - pad,
+                        np.maximum.reduceat(cell_x, first) + pad, np.maximum.reduceat(cell_y, first) + pad)
+    polygon, box = shapely.STRtree(boxes).query(polygons, predicate='intersects')
+
+    # a box inside the polygon's interior puts all its points within the polygon; the others are tested one by one
+    inside = shapely.contains_properly(polygons[polygon], boxes[box])
+    inner_counts = counts[occupied[box[inside]]]
+    inner_points = order[_expand(first[box[inside]], inner_counts)]
+    inner_polygons = np.repeat(polygon[inside], inner_counts)
+
+    edge_counts = counts[occupied[box[~inside]]]
+    candidates = order[_expand(first[box[~inside]], edge_counts)]
+    candidate_polygons = np.repeat(polygon[~inside], edge_counts)
+    within = shapely.contains_xy(polygons[candidate_polygons], x[candidates], y[candidates])
+
+    point = np.concatenate([inner_points, candidates[within]])
+    return point + offset, np.concatenate([inner_polygons, candidate_polygons[within]])
+
+
+def join_points(x, y, polygons, chunk_size=250000, workers=None):
+    """
+    Finds the polygons each point lies within.
+
+    Parameters:
+        - x (array): Point x coordinates, in the polygons' crs.
+        - y (array): Point y coordinates.
+        - polygons (array): Shapely polygons.
+        - chunk_size (int): Points per chunk.
+        - workers (int, optional): Processes, defaults to the number of CPUs; a single chunk
+          runs in this process.
+
+    Returns:
+        (point, polygon) arrays of positions, one entry per point and polygon containing it,
+        sorted by polygon.
+    """
+    x, y = np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64')
+    polygons = np.array(polygons, dtype=object)
+    chunks = [(x[start:start + chunk_size], y[start:start + chunk_size], start)
+              for start in range(0, len(x), chunk_size)]
+    workers = min(workers or os.cpu_count(), len(chunks))
+
+    if workers <= 1:
+        shapely.prepare(polygons)
+        pairs = [_join_chunk(*chunk, polygons=polygons) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(polygons,)) as executor:
+            pairs = list(executor.map(_join_chunk, *zip(*chunks)))
+
+    if not pairs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    point = np.concatenate([point for point, _ in pairs]).astype(np.int64)
+    polygon = np.concatenate([polygon for _, polygon in pairs]).astype(np.int64)
+    order = np.argsort(polygon, kind='stable')
+    return point[order], polygon[order]
+
+
+def grouped_median(groups, values, size:int):
+    """
+    Median of values per group, ignoring NaN, as pandas' groupby median.
+
+    Parameters:
+        - groups (array): Group number of every value, 0 to size - 1.
+        - values (array): The values.
+        - size (int): Number of groups.
+
+    Returns:
+        array of size medians, NaN for groups without values.
+    """
+    kept = ~np.isnan(values)
+    groups, values = groups[kept], values[kept]
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+
+    counts = np.bincount(groups, minlength=size)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    medians = np.full(size, np.nan)
+    has = counts > 0
+    low = starts[has] + (counts[has] - 1) // 2
+    high = starts[has] + counts[has] // 2
+    medians[has] = (values[low] + values[high]) / 2
+    return medians
+
+
+def listing_points(listings, crs):
+    """
+    Coordinates of listings in crs, from their point geometry or their lat and lon columns.
+
+    Parameters:
+        - listings (DataFrame or GeoDataFrame): Listings with lat and lon columns, or points.
+        - crs (str, optional): The crs to project to, None to keep the coordinates as they are.
+
+    Returns:
+        tuple of x and y arrays.
+    """
+    if isinstance(listings, gpd.GeoDataFrame):
+        points = listings.geometry if crs is None or listings.crs is None else listings.geometry.to_crs(crs)
+        return points.x.to_numpy(), points.y.to_numpy()
+
+    lon = pd.to_numeric(listings['lon'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    lat = pd.to_numeric(listings['lat'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    if crs is None:
+        return lon, lat
+    # straight from the coordinate arrays, building point geometries for millions of rows is slow
+    from pyproj import Transformer
+    return Transformer.from_crs('EPSG:4326', crs, always_xy=True).transform(lon, lat)
+
+
+def aggregate_within(listings, polygons:gpd.GeoDataFrame, chunk_size=250000, workers=None):
+    """
+    Listing statistics per polygon.
+
+    Parameters:
+        - listings (DataFrame or GeoDataFrame): Points with sales_price, rent_perMonth and bedroom
+          columns; either a GeoDataFrame of points or lat and lon columns in EPSG:4326.
+          Rows without coordinates are in no polygon.
+        - polygons (GeoDataFrame): The areas, e.g. boroughs or postcode districts.
+        - chunk_size (int): See join_points.
+        - workers (int, optional): See join_points.
+
+    Returns:
+        geodataframe: polygons with the AGGREGATE_COLUMNS: the number of listings within each
+        polygon, the median sales price, the median monthly rent and the median monthly rent
+        per bedroom, studios counting as one bedroom.
+    """
+    x, y = listing_points(listings, polygons.crs)
+    located = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    point, polygon = join_points(x[located], y[located], polygons.geometry.to_numpy(), chunk_size, workers)
+    point = located[point]
+
+    def column(name):
+        return pd.to_numeric(listings[name], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+
+    price, rent = column('sales_price'), column('rent_perMonth')
+    bedrooms = np.maximum(column('bedroom'), 1)
+
+    size = len(polygons)
+    result = polygons.copy()
+    result['count'] = np.bincount(polygon, minlength=size)
+    result['median_price'] = grouped_median(polygon, price[point], size)
+    result['median_rent'] = grouped_median(polygon, rent[point], size)
+    result['rent_per_bedroom'] = grouped_median(polygon, (rent / bedrooms)[point], size)
+    return result
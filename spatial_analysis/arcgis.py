@@ -0,0 +1,324 @@
+"""
+************************************************
+ARCGIS FEATURE SERVICE DOWNLOADER
+************************************************
+Downloads every feature of an ArcGIS REST feature layer, e.g. the Toronto
+Police major crime indicators the notebook reads, into a GeoDataFrame.
+
+The notebook's loop requests one page of 1,000 records after the other, a new
+connection each time, up to a hardcoded total. Here the number of records is
+asked first (returnCountOnly), the pages are requested concurrently over one
+pooled keep-alive session, failed requests (connection errors, 429/5xx, and
+the 200 responses with an error body ArcGIS sends when overloaded) are
+retried with exponential backoff, and every page is written to disk as it
+arrives. An interrupted download picks up where it stopped: pages already on
+disk are not requested again. The pages are turned into one GeoDataFrame
+straight from their GeoJSON, point coordinates into a geometry array and
+properties into columns, without json_normalize.
+
+MockFeatureServer stands in for a feature service, with latency and failures
+on demand, to try the downloader without the network.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import requests
+import shapely
+from requests.adapters import HTTPAdapter
+
+
+ARCGIS_CACHE = 'data_output/arcgis_cache'
+# statuses of an overloaded service, retried with backoff
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class FeatureServiceError(RuntimeError):
+    """
+    An error body returned by the feature service, or a page that could not be fetched.
+    """
+
+
+def query_url(url:str):
+    """
+    The query endpoint of a layer url, with or without /query at the end.
+    """
+    url = url.split('?')[0].rstrip('/')
+    return url if url.endswith('/query') else f'{url}/query'
+
+
+class FeatureDownloader:
+    """
+    Downloads the features of an ArcGIS feature layer page by page, concurrently.
+
+    Parameters:
+        - url (str): The layer, e.g. https://.../FeatureServer/0, or its /query endpoint.
+        - where (str): SQL filter of the features, e.g. "OFFENCE = 'Robbery - Mugging'".
+        - out_fields (str): Comma separated fields to download, * for all.
+        - batch_size (int): Records per request, at most the layer's maxRecordCount.
+        - workers (int): Requests in flight at once.
+        - retries (int): Attempts per page after the first one.
+        - backoff (float): Seconds before the first retry, doubled after each.
+        - timeout (float): Seconds to wait for a response.
+        - order_by (str, optional): Field to order the records by, e.g. OBJECTID, so the pages
+          never overlap; the service's own order otherwise.
+        - cache (str, optional): Directory the pages are written to, None to keep them in memory
+          only (and not be able to resume).
+    """
+
+    def __init__(self, url:str, where='1=1', out_fields='*', batch_size=1000, workers=8, retries=5, backoff=0.5,
+                 timeout=60, order_by=None, cache=ARCGIS_CACHE):
+        self.url = query_url(url)
+        self.where = where
+        self.out_fields = out_fields
+        self.batch_size = batch_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.order_by = order_by
+        self.cache = cache
+
+        self.session = requests.Session()
+        # no retries in the adapter: _get retries every failure, with a single backoff schedule
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _get(self, params:dict):
+        """
+        The service's answer to a query, retried with backoff on connection errors, 429/5xx
+        and error bodies; other http errors are raised straight away.
+        """
+        params = dict(params, where=self.where)
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(self.url, params=params, timeout=self.timeout)
+                if response.status_code >= 400 and response.status_code not in RETRY_STATUSES:
+                    raise FeatureServiceError(f'{self.url}: {response.status_code} {response.reason}')
+                response.raise_for_status()
+                data = response.json()
+                if 'error' not in data:
+                    return data
+                error = FeatureServiceError(f"{self.url}: {data['error'].get('message', data['error'])}")
+            except (requests.RequestException, ValueError) as e:
+                error = FeatureServiceError(f'{self.url}: {e}')
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    def count(self):
+        """
+        Number of features matching where.
+        """
+        data = self._get({'returnCountOnly': 'true', 'f': 'json'})
+        return int(data['count'])
+
+    def _directory(self, total:int):
+        """
+        Folder of the pages of this query; a different filter, field list, page size or
+        record count makes a new one, so pages of different queries are never mixed.
+        """
+        key = json.dumps([self.url, self.where, self.out_fields, self.batch_size, self.order_by, total])
+        return os.path.join(self.cache, hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+    def _page(self, offset:int, size:int):
+        """
+        The features from offset on; a service returning fewer records than asked
+        (its maxRecordCount is smaller) is asked again for the rest. A page that stops
+        short raises FeatureServiceError, so it is never cached incomplete.
+        """
+        features = []
+        first, wanted = offset, size
+        while size > 0:
+            params = {'outFields': self.out_fields, 'resultOffset': offset, 'resultRecordCount': size,
+                      'returnGeometry': 'true', 'outSR': 4326, 'f': 'geojson'}
+            if self.order_by:
+                params['orderByFields'] = self.order_by
+            data = self._get(params)
+            received = data.get('features', [])
+            if not received:
+                raise FeatureServiceError(f'{self.url}: {len(features)} of {wanted} features from offset {first}')
+            features.extend(received)
+            offset, size = offset + len(received), size - len(received)
+        return features
+
+    def _download_page(self, directory, offset:int, size:int):
+        """
+        Fetches a page, unless it is already on disk, and returns its features.
+        """
+        path = os.path.join(directory, f'{offset:010d}.geojson') if directory else None
+        if path and os.path.exists(path):
+            with open(path, 'rb') as file:
+                return json.loads(file.read())['features']
+
+        features = self._page(offset, size)
+        if path:
+            # write then rename, so an interrupted download never leaves a truncated page behind
+            temp_path = f'{path}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump({'type': 'FeatureCollection', 'features': features}, file)
+            os.replace(temp_path, path)
+        return features
+
+    def download(self):
+        """
+        Downloads every matching feature, skipping pages already on disk.
+
+        Returns:
+            geodataframe of the features' properties, with their geometry in EPSG:4326.
+        """
+        total = self.count()
+        directory = None
+        if self.cache is not None:
+            directory = self._directory(total)
+            os.makedirs(directory, exist_ok=True)
+
+        offsets = range(0, total, self.batch_size)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pages = list(executor.map(lambda offset: self._download_page(directory, offset, min(self.batch_size, total - offset)),
+                                      offsets))
+        features = [feature for page in pages for feature in page]
+        print(f'{len(features)} of {total} features from {len(offsets)} pages in {time.perf_counter() - start:.1f}s')
+        return features_to_geodataframe(features)
+
+
+def features_to_geodataframe(features:list):
+    """
+    Converts GeoJSON features to a GeoDataFrame: properties as columns, points straight from
+    their coordinates and other geometries through shapely.
+
+    Parameters:
+        - features (list): GeoJSON feature dicts.
+
+    Returns:
+        geodataframe in EPSG:4326.
+    """
+    properties = pd.DataFrame.from_records([feature.get('properties') or {} for feature in features])
+    geometries = [feature.get('geometry') for feature in features]
+    if geometries and all(geometry and geometry['type'] == 'Point' for geometry in geometries):
+        coordinates = np.array([geometry['coordinates'][:2] for geometry in geometries], dtype='float64')
+        geometry = gpd.points_from_xy(coordinates[:, 0], coordinates[:, 1])
+    else:
+        geometry = shapely.from_geojson([json.dumps(geometry) if geometry else None for geometry in geometries])
+    return gpd.GeoDataFrame(properties, geometry=geometry, crs='EPSG:4326')
+
+
+def download_features(url:str, where='1=1', **kwargs):
+    """
+    Downloads every feature of an ArcGIS feature layer, see FeatureDownloader.
+
+    Returns:
+        geodataframe
+    """
+    with FeatureDownloader(url, where, **kwargs) as downloader:
+        return downloader.download()
+
+
+class MockFeatureServer:
+    """
+    Local stand-in for an ArcGIS feature layer, answering count and paged GeoJSON queries.
+
+    Use it as a context manager and download from server.url:
+
+        with MockFeatureServer(features, latency=0.05, failure_rate=0.1) as server:
+            gdf = download_features(server.url, cache=None)
+
+    Parameters:
+        - features (list): GeoJSON feature dicts served, in this order.
+        - max_record_count (int): Most records returned by one query, as a layer's maxRecordCount.
+        - latency (float): Seconds every response is delayed.
+        - failure_rate (float): Share of queries answered with a 503 or an ArcGIS error body.
+        - seed (int): Seed of the failures.
+        - port (int): Port to listen on, 0 picks a free one.
+    """
+
+    def __init__(self, features:list, max_record_count=1000, latency=0.0, failure_rate=0.0, seed=0, port=0):
+        self.features = features
+        self.requests = 0
+        lock = threading.Lock()
+        random = np.random.default_rng(seed)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def reply(self, status:int, body:bytes):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with lock:
+                    server.requests += 1
+                    failure = random.random() < failure_rate
+                    error_body = random.random() < 0.5
+                time.sleep(latency)
+                parts = urlsplit(self.path)
+                if not parts.path.endswith('/query'):
+                    self.reply(404, b'{}')
+                    return
+                if failure:
+                    if error_body:
+                        self.reply(200, b'{"error": {"code": 500, "message": "Unable to complete operation."}}')
+                    else:
+                        self.reply(503, b'{}')
+                    return
+
+                query = {name: values[-1] for name, values in parse_qs(parts.query).items()}
+                if query.get('returnCountOnly') == 'true':
+                    self.reply(200, json.dumps({'count': len(server.features)}).encode('utf-8'))
+                    return
+                offset = int(query.get('resultOffset', 0))
+                size = min(int(query.get('resultRecordCount', max_record_count)), max_record_count)
+                page = server.features[offset:offset + size]
+                body = {'type': 'FeatureCollection', 'features': page}
+                if offset + size < len(server.features):
+                    body['properties'] = {'exceededTransferLimit': True}
+                self.reply(200, json.dumps(body).encode('utf-8'))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f'http://{host}:{port}/arcgis/rest/services/Mock/FeatureServer/0'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
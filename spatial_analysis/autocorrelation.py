@@ -0,0 +1,236 @@
+"""
+************************************************
+GLOBAL AND LOCAL MORAN'S I WITH PARALLEL PERMUTATION INFERENCE
+************************************************
+The statistics of esda.Moran and esda.moran.Moran_Local, with their
+permutation p-values computed in batches of matrix operations instead of one
+permutation at a time, on a pool of processes.
+
+Global Moran: a batch of permutations of z is drawn at once
+(Generator.permuted over a (batch, n) array) and all their spatial lags come
+from one sparse-dense product with the weights.
+
+Local Moran: conditional randomisation as esda does it. One table of random
+draws of the other observations is shared by every observation, so its
+values are gathered once per batch, and the simulated lags of a whole block of
+observations with the same number of neighbours are one where and one einsum.
+
+Every batch has its own seed, spawned from a single SeedSequence, and the
+batches are the same whatever the number of workers, so a seed gives the same
+p-values on any machine. Only the counts of simulated values above the
+observed ones come back from the workers.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+# names of the significant local Moran quadrants, by code (esda's q, 0 when not significant)
+SPOT_LABELS = {0: 'not significant', 1: 'hot spot', 2: 'doughnut', 3: 'cold spot', 4: 'diamond'}
+# array elements of a local batch block, about 32 MB of float64
+BLOCK_SIZE = 2 ** 22
+
+# state of a pool worker process, set once by _init_worker
+_STATE = {}
+
+
+def row_standardized(weights):
+    """
+    The row standardised CSR matrix of a SpatialWeights, a libpysal W or a sparse matrix.
+    """
+    if hasattr(weights, 'standardized'):
+        return weights.standardized
+    matrix = sparse.csr_matrix(weights.sparse if hasattr(weights, 'sparse') else weights, dtype='float64')
+    sums = np.asarray(matrix.sum(axis=1)).ravel()
+    scale = np.divide(1.0, sums, out=np.zeros_like(sums), where=sums != 0)
+    return sparse.csr_matrix(sparse.diags(scale) @ matrix)
+
+
+def fold(larger, permutations:int):
+    """
+    esda's pseudo p-value: the share of simulations at least as extreme as the observed
+    statistic, on the side of the distribution it falls.
+    """
+    larger = np.where(permutations - larger < larger, permutations - larger, larger)
+    return (larger + 1.0) / (permutations + 1.0)
+
+
+def _batches(permutations:int, batch_size:int, seed):
+    """
+    Splits permutations into batches, each with its own child seed.
+    """
+    sizes = [min(batch_size, permutations - start) for start in range(0, permutations, batch_size)]
+    return list(zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes))
+
+
+def _init_worker(state):
+    _STATE.clear()
+    _STATE.update(state)
+
+
+def _run(task, batches, workers, state):
+    """
+    Runs task on every batch, in this process or on a pool, and sums the results.
+    """
+    workers = min(workers or os.cpu_count(), len(batches))
+    if workers <= 1:
+        # state is passed rather than set globally, so statistics computed on threads do not mix
+        return sum(task(*batch, state) for batch in batches)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(state,)) as executor:
+        return sum(executor.map(task, *zip(*batches)))
+
+
+def _global_batch(seed, size, state=None):
+    """
+    Number of permutations of the batch whose I is at least the observed one, and the sum
+    and sum of squares of their I.
+    """
+    state = _STATE if state is None else state
+    z, matrix, scale, observed = state['z'], state['matrix'], state['scale'], state['I']
+    rng = np.random.default_rng(seed)
+    permuted = rng.permuted(np.broadcast_to(z, (size, len(z))), axis=1)
+    simulated = scale * np.einsum('bn,nb->b', permuted, matrix @ permuted.T)
+    return np.array([(simulated >= observed).sum(), simulated.sum(), (simulated ** 2).sum()])
+
+
+class Moran:
+    """
+    Global Moran's I of y, with esda.Moran's attribute names.
+
+    Parameters:
+        - y (array-like): The values, e.g. listing prices.
+        - weights (SpatialWeights, W or sparse matrix): The spatial weights, row standardised here.
+        - permutations (int): Permutations for p_sim, 0 for none.
+        - seed (int, optional): Seed of the permutations.
+        - workers (int, optional): Processes, defaults to the number of CPUs.
+        - batch_size (int, optional): Permutations per batch, by default as many as fit in about
+          64 MB; it changes the draws, so keep it fixed to reproduce a run.
+
+    Attributes: I, EI (its expectation under randomness), p_sim, EI_sim, seI_sim and z_sim.
+    """
+
+    def __init__(self, y, weights, permutations=999, seed=None, workers=None, batch_size=None):
+        y = np.asarray(y, dtype='float64').ravel()
+        matrix = row_standardized(weights)
+        n = len(y)
+        z = y - y.mean()
+        scale = n / matrix.sum() / (z @ z)
+
+        self.n = n
+        self.permutations = permutations
+        self.I = float(scale * (z @ (matrix @ z)))
+        self.EI = -1.0 / (n - 1)
+        self.p_sim = self.EI_sim = self.seI_sim = self.z_sim = None
+        if not permutations:
+            return
+
+        batch_size = batch_size or max(1, 2 ** 23 // n)
+        state = {'z': z, 'matrix': matrix, 'scale': scale, 'I': self.I}
+        larger, total, squares = _run(_global_batch, _batches(permutations, batch_size, seed), workers, state)
+        self.p_sim = float(fold(larger, permutations))
+        self.EI_sim = total / permutations
+        self.seI_sim = float(np.sqrt(max(squares / permutations - self.EI_sim ** 2, 0.0)))
+        self.z_sim = (self.I - self.EI_sim) / self.seI_sim if self.seI_sim else np.nan
+
+
+def _neighbour_blocks(matrix:sparse.csr_matrix):
+    """
+    Groups the observations by number of neighbours.
+
+    Returns:
+        list of (rows, weights) tuples: the observations with k neighbours and the (rows, k)
+        array of their neighbours' weights.
+    """
+    cardinalities = np.diff(matrix.indptr)
+    blocks = []
+    for k in np.unique(cardinalities):
+        rows = np.flatnonzero(cardinalities == k)
+        if k:
+            blocks.append((rows, matrix.data[matrix.indptr[rows][:, None] + np.arange(k)]))
+    return blocks
+
+
+def _local_batch(seed, size, state=None):
+    """
+    Per observation, the number of permutations of the batch whose local I is at least the observed one.
+    """
+    state = _STATE if state is None else state
+    z, blocks, observed, kmax, scale = state['z'], state['blocks'], state['Is'], state['kmax'], state['scale']
+    n = len(z)
+    rng = np.random.default_rng(seed)
+    # kmax distinct draws of the n - 1 other observations per permutation; for observation i
+    # a draw d >= i stands for observation d + 1, which skips i itself
+    draws = np.stack([rng.choice(n - 1, kmax, replace=False) for _ in range(size)])
+    below, above = z[draws], z[draws + 1]
+
+    larger = np.zeros(n, dtype=np.int64)
+    for rows, weights in blocks:
+        k = weights.shape[1]
+        step = max(1, BLOCK_SIZE // (size * k))
+        for start in range(0, len(rows), step):
+            chunk = rows[start:start + step]
+            values = np.where(draws[None, :, :k] >= chunk[:, None, None], above[None, :, :k], below[None, :, :k])
+            lag = np.einsum('mbk,mk->mb', values, weights[start:start + step])
+            simulated = scale * z[chunk, None] * lag
+            larger[chunk] = (simulated >= observed[chunk, None]).sum(axis=1)
+    return larger
+
+
+class MoranLocal:
+    """
+    Local Moran's I of y, with esda.moran.Moran_Local's attribute names.
+
+    Parameters:
+        - y (array-like): The values, e.g. listing prices.
+        - weights (SpatialWeights, W or sparse matrix): The spatial weights, row standardised here.
+        - permutations (int): Conditional permutations for p_sim, 0 for none.
+        - seed (int, optional): Seed of the permutations.
+        - workers (int, optional): Processes, defaults to the number of CPUs.
+        - batch_size (int): Permutations per batch; it changes the draws, so keep it fixed to
+          reproduce a run.
+
+    Attributes: Is, q (1 high-high, 2 low-high, 3 low-low, 4 high-low, as esda), p_sim, and
+    through spots and labels the notebook's hot and cold spots.
+    """
+
+    def __init__(self, y, weights, permutations=999, seed=None, workers=None, batch_size=50):
+        y = np.asarray(y, dtype='float64').ravel()
+        matrix = row_standardized(weights)
+        n = len(y)
+        z = y - y.mean()
+        z = z / y.std()
+        lag = matrix @ z
+
+        self.n = n
+        self.permutations = permutations
+        self.z = z
+        scale = (n - 1) / (z @ z)
+        self.Is = scale * z * lag
+        self.q = np.select([(z > 0) & (lag > 0), (z <= 0) & (lag > 0), (z <= 0) & (lag <= 0)], [1, 2, 3], 4)
+        self.p_sim = None
+        if not permutations:
+            return
+
+        cardinalities = np.diff(matrix.indptr)
+        state = {'z': z, 'blocks': _neighbour_blocks(matrix), 'Is': self.Is, 'scale': scale,
+                 'kmax': int(min(cardinalities.max(), n - 1))}
+        larger = _run(_local_batch, _batches(permutations, batch_size, seed), workers, state)
+        self.p_sim = fold(larger, permutations)
+        # an observation without neighbours has no local statistic to test
+        self.p_sim[cardinalities == 0] = 1.0
+
+    def spots(self, significance=0.05):
+        """
+        The quadrant of each observation whose p_sim is below significance, 0 for the others;
+        the notebook's hotspot + coldspot + doughnut + diamond.
+        """
+        return np.where(self.p_sim < significance, self.q, 0)
+
+    def labels(self, significance=0.05):
+        """
+        SPOT_LABELS of spots(significance), as a categorical.
+        """
+        return pd.Categorical.from_codes(self.spots(significance), categories=list(SPOT_LABELS.values()))
@@ -0,0 +1,86 @@
+"""
+************************************************
+POINT IN POLYGON AGGREGATION AGAINST SJOIN
+************************************************
+Aggregates random listings over random Voronoi "districts" of London with
+geopandas' sjoin(predicate="within") and a groupby, as the notebook does, and
+with aggregate.aggregate_within, checks that both give the same statistics and
+reports their times. Polygon vertices are added as listings, so points on
+boundaries are covered.
+
+Usage: python spatial_analysis/benchmarks/aggregate.py [listings] [polygons] [workers]
+"""
+import os.path
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from spatial_analysis.aggregate import aggregate_within
+
+# London in British National Grid metres
+BOUNDS = (503000, 155000, 562000, 201000)
+
+
+def random_districts(size:int, rng):
+    seeds = shapely.multipoints(np.column_stack([rng.uniform(BOUNDS[0], BOUNDS[2], size),
+                                                 rng.uniform(BOUNDS[1], BOUNDS[3], size)]))
+    cells = shapely.get_parts(shapely.voronoi_polygons(seeds, extend_to=shapely.box(*BOUNDS)))
+    cells = shapely.intersection(cells, shapely.box(*BOUNDS))
+    return gpd.GeoDataFrame({'district': [f'D{number}' for number in range(len(cells))]}, geometry=cells,
+                            crs='EPSG:27700')
+
+
+def random_listings(size:int, districts:gpd.GeoDataFrame, rng):
+    vertices = shapely.get_coordinates(districts.geometry.to_numpy())[:2000]
+    x = np.concatenate([rng.uniform(BOUNDS[0], BOUNDS[2], size), vertices[:, 0]])
+    y = np.concatenate([rng.uniform(BOUNDS[1], BOUNDS[3], size), vertices[:, 1]])
+    rent = rng.random(len(x)) < 0.5
+    prices = rng.lognormal(13, 0.6, len(x)).round()
+    return gpd.GeoDataFrame({
+        'sales_price': pd.array(np.where(rent, np.nan, prices), dtype='Int32'),
+        'rent_perMonth': pd.array(np.where(rent, (prices / 200).round(), np.nan), dtype='Int32'),
+        'bedroom': pd.array(rng.integers(0, 6, len(x)), dtype='Int8'),
+    }, geometry=gpd.points_from_xy(x, y), crs='EPSG:27700')
+
+
+def with_sjoin(listings:gpd.GeoDataFrame, districts:gpd.GeoDataFrame):
+    """
+    The notebook's way: a spatial join, then a groupby per statistic.
+    """
+    joined = gpd.sjoin(listings, districts, how='inner', predicate='within')
+    joined['per_bedroom'] = joined['rent_perMonth'].astype('float64') / joined['bedroom'].astype('float64').clip(lower=1)
+    grouped = joined.groupby('index_right')
+    stats = pd.DataFrame({
+        'count': grouped.size(),
+        'median_price': grouped['sales_price'].median(),
+        'median_rent': grouped['rent_perMonth'].median(),
+        'rent_per_bedroom': grouped['per_bedroom'].median(),
+    })
+    return districts.join(stats).fillna({'count': 0})
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    polygons = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    rng = np.random.default_rng(0)
+    districts = random_districts(polygons, rng)
+    listings = random_listings(size, districts, rng)
+
+    start = time.perf_counter()
+    expected = with_sjoin(listings, districts)
+    print(f'sjoin + groupby: {len(listings)} listings in {len(districts)} polygons, {time.perf_counter() - start:.2f}s')
+
+    start = time.perf_counter()
+    result = aggregate_within(listings, districts, workers=workers)
+    print(f'aggregate_within: {time.perf_counter() - start:.2f}s')
+
+    for column in ('count', 'median_price', 'median_rent', 'rent_per_bedroom'):
+        assert np.allclose(expected[column].astype('float64'), result[column], equal_nan=True, rtol=0, atol=1e-9), column
+    print('same statistics as sjoin')
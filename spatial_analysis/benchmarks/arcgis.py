@@ -0,0 +1,94 @@
+"""
+************************************************
+ARCGIS DOWNLOAD: THE NOTEBOOK'S LOOP AGAINST THE CONCURRENT DOWNLOADER
+************************************************
+Serves random robbery features from arcgis.MockFeatureServer with a delay per
+response, downloads them with the notebook's sequential loop and
+json_normalize and with arcgis.download_features, and checks that both give
+the same records. Then downloads again from a server failing a share of its
+requests, stops half way and resumes, counting the requests made.
+
+Usage: python spatial_analysis/benchmarks/arcgis.py [features] [latency in seconds] [failure rate]
+"""
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import numpy as np
+import pandas as pd
+import requests
+
+from spatial_analysis.arcgis import FeatureDownloader, MockFeatureServer, download_features
+
+
+def random_features(size:int, rng):
+    longitude = rng.uniform(-79.6, -79.1, size)
+    latitude = rng.uniform(43.58, 43.85, size)
+    offences = rng.choice(['Robbery - Mugging', 'Robbery With Weapon', 'Robbery - Business'], size)
+    premises = rng.choice(['Outside', 'Commercial', 'Apartment', 'House', 'Transit'], size)
+    years = rng.integers(2014, 2024, size)
+    return [{'type': 'Feature', 'id': number + 1,
+             'geometry': {'type': 'Point', 'coordinates': [float(longitude[number]), float(latitude[number])]},
+             'properties': {'OBJECTID': number + 1, 'offence': str(offences[number]),
+                            'premises_type': str(premises[number]), 'reportedyear': int(years[number]),
+                            'Latitude': float(latitude[number]), 'Longitude': float(longitude[number])}}
+            for number in range(size)]
+
+
+def notebook_download(url:str, total_records:int, batch_size=1000):
+    """
+    The notebook's way: one request per batch after the other, then json_normalize.
+    """
+    offset = 0
+    features = []
+    while offset < total_records:
+        query_url = url + f"/query?where=1%3D1&outFields=*&f=geojson&resultOffset={offset}&resultRecordCount={batch_size}"
+        response = requests.get(query_url)
+        data = response.json()
+        features.extend(data['features'])
+        offset += batch_size
+    return pd.json_normalize(features)
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    features = random_features(size, np.random.default_rng(0))
+    cache = tempfile.mkdtemp()
+
+    try:
+        with MockFeatureServer(features, latency=latency) as server:
+            start = time.perf_counter()
+            expected = notebook_download(server.url, size)
+            print(f'notebook loop: {len(expected)} features in {time.perf_counter() - start:.2f}s')
+
+            start = time.perf_counter()
+            result = download_features(server.url, workers=8, cache=None)
+            print(f'download_features: {time.perf_counter() - start:.2f}s')
+            assert (result['OBJECTID'].to_numpy() == expected['properties.OBJECTID'].to_numpy()).all()
+            assert np.allclose(np.column_stack([result.geometry.x, result.geometry.y]),
+                               np.stack(expected['geometry.coordinates'].to_numpy()))
+
+        with MockFeatureServer(features, latency=latency, failure_rate=failure_rate) as server:
+            # a first run stopped half way, as if the connection dropped
+            with FeatureDownloader(server.url, batch_size=1000, workers=8, backoff=0.05, cache=cache) as downloader:
+                directory = downloader._directory(downloader.count())
+                os.makedirs(directory, exist_ok=True)
+                for offset in range(0, size // 2, 1000):
+                    downloader._download_page(directory, offset, 1000)
+            first = server.requests
+
+            start = time.perf_counter()
+            resumed = download_features(server.url, workers=8, backoff=0.05, cache=cache)
+            print(f'resumed with {failure_rate:.0%} of requests failing: {time.perf_counter() - start:.2f}s, '
+                  f'{first} requests before the interruption and {server.requests - first} after, '
+                  f'for {-(-size // 1000)} pages')
+            assert (resumed['OBJECTID'].to_numpy() == np.arange(1, size + 1)).all()
+    finally:
+        shutil.rmtree(cache)
+    print('same features as the notebook loop')
@@ -0,0 +1,57 @@
+"""
+************************************************
+MORAN'S I PERMUTATION INFERENCE: ESDA AGAINST THE BATCHED VERSION
+************************************************
+Computes global and local Moran's I of a spatially trended random field on
+random points with k=10 nearest neighbour weights, with esda (when installed)
+and with autocorrelation.Moran and MoranLocal, and compares the statistics,
+the quadrants and the share of significant observations.
+
+Usage: python spatial_analysis/benchmarks/autocorrelation.py [points] [permutations] [workers]
+"""
+import os.path
+import sys
+import time
+import warnings
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import numpy as np
+
+from spatial_analysis.autocorrelation import Moran, MoranLocal
+from spatial_analysis.weights import knn_weights
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    permutations = int(sys.argv[2]) if len(sys.argv) > 2 else 999
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 10000, (size, 2))
+    values = np.sin(points[:, 0] / 1500) + np.cos(points[:, 1] / 2000) + rng.normal(0, 0.7, size)
+    weights = knn_weights(points, k=10, cache=None)
+
+    start = time.perf_counter()
+    moran = Moran(values, weights, permutations, seed=0, workers=workers)
+    local = MoranLocal(values, weights, permutations, seed=0, workers=workers)
+    print(f'batched: {size} points, {permutations} permutations in {time.perf_counter() - start:.2f}s')
+    print(f'    I {moran.I:.4f}, p_sim {moran.p_sim:.4f}, {np.mean(local.p_sim < 0.05):.1%} of local I significant')
+
+    try:
+        import esda
+    except ImportError:
+        sys.exit('esda is not installed, nothing to compare with')
+
+    warnings.filterwarnings('ignore')
+    w = weights.to_libpysal()
+    start = time.perf_counter()
+    expected = esda.Moran(values, w, permutations=permutations)
+    expected_local = esda.moran.Moran_Local(values, w, permutations=permutations, seed=0)
+    print(f'esda: {time.perf_counter() - start:.2f}s')
+    print(f'    I {expected.I:.4f}, p_sim {expected.p_sim:.4f}, '
+          f'{np.mean(expected_local.p_sim < 0.05):.1%} of local I significant')
+
+    assert np.isclose(expected.I, moran.I) and np.allclose(expected_local.Is, local.Is), 'the statistics differ'
+    assert (expected_local.q == local.q).all(), 'the quadrants differ'
+    print('same I, local I and quadrants as esda')
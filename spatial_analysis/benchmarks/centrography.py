@@ -0,0 +1,85 @@
+"""
+************************************************
+GROUPED CENTROGRAPHY AGAINST POINTPATS PER GROUP
+************************************************
+Computes the mean centre, standard distance and euclidean median of random
+listings per (borough, propertyType, transaction) with pointpats'
+centrography on every group in turn (when installed) and with
+centrography.GroupedCentrography from chunks, compares them, then appends a
+snapshot and times the incremental update against starting over.
+
+Usage: python spatial_analysis/benchmarks/centrography.py [listings] [chunk size]
+"""
+import os.path
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import numpy as np
+import pandas as pd
+
+from spatial_analysis.centrography import GroupedCentrography
+from spatial_analysis.spatial_index import to_grid
+
+GROUPS = ['borough', 'propertyType', 'transaction']
+
+
+def random_listings(size:int, rng):
+    return pd.DataFrame({
+        'lat': rng.normal(51.51, 0.08, size),
+        'lon': rng.normal(-0.12, 0.12, size),
+        'borough': rng.choice([f'Borough {number}' for number in range(33)], size),
+        'propertyType': rng.choice(['Flat', 'Apartment', 'Terraced', 'Semi-Detached', 'Detached', 'Studio'], size),
+        'transaction': rng.choice(['rent', 'sales'], size),
+    })
+
+
+def sum_of_distances(points, center):
+    return np.hypot(points[:, 0] - center[0], points[:, 1] - center[1]).sum()
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    rng = np.random.default_rng(0)
+    listings = random_listings(size, rng)
+
+    start = time.perf_counter()
+    centrography = GroupedCentrography(GROUPS)
+    for first in range(0, size, chunk_size):
+        centrography.update(listings.iloc[first:first + chunk_size])
+    result = centrography.summary()
+    print(f'GroupedCentrography: {size} listings in {len(result)} groups, {time.perf_counter() - start:.2f}s')
+
+    snapshot = random_listings(size // 100, rng)
+    snapshot['borough'] = 'Borough 0'
+    start = time.perf_counter()
+    centrography.update(snapshot)
+    updated = centrography.summary()
+    print(f'    + a snapshot of {len(snapshot)} listings in one borough: {time.perf_counter() - start:.2f}s')
+
+    start = time.perf_counter()
+    again = GroupedCentrography(GROUPS).update(listings).update(snapshot).summary()
+    print(f'    recomputing everything instead: {time.perf_counter() - start:.2f}s')
+    assert np.allclose(updated[['mean_x', 'mean_y', 'std_distance']], again[['mean_x', 'mean_y', 'std_distance']])
+    assert np.allclose(updated[['median_x', 'median_y']], again[['median_x', 'median_y']], rtol=0, atol=0.1)
+
+    try:
+        from pointpats import centrography as pointpats
+    except ImportError:
+        sys.exit('pointpats is not installed, nothing to compare with')
+
+    x, y = to_grid(listings['lat'], listings['lon']).T
+    start = time.perf_counter()
+    worse = 0
+    for key, rows in listings.assign(x=x, y=y).groupby(GROUPS):
+        points = rows[['x', 'y']].to_numpy()
+        mean, distance = pointpats.mean_center(points), pointpats.std_distance(points)
+        median = pointpats.euclidean_median(points)
+        row = result.loc[key]
+        assert np.allclose(mean, (row['mean_x'], row['mean_y'])) and np.isclose(distance, row['std_distance'])
+        # both are minimisers; ours should not leave a larger sum of distances
+        worse += sum_of_distances(points, (row['median_x'], row['median_y'])) > sum_of_distances(points, median) + 1e-3
+    print(f'pointpats per group: {time.perf_counter() - start:.2f}s')
+    print(f'same mean centres and standard distances; {worse} medians with a larger sum of distances than pointpats')
@@ -0,0 +1,66 @@
+"""
+************************************************
+KERNEL DENSITY: GAUSSIAN_KDE AGAINST THE BINNED FFT RASTER
+************************************************
+Evaluates the kernel density of random London listings on a grid by summing
+the kernel of every point at every cell, as scipy's gaussian_kde (what
+seaborn's kdeplot runs) does, and with density.kde_raster, first computing
+its tiles and then loading them from the cache, checks that the rasters agree
+and reports their times.
+
+Usage: python spatial_analysis/benchmarks/density.py [points] [cell size in metres]
+"""
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import numpy as np
+from scipy.stats import gaussian_kde
+
+from spatial_analysis.density import LONDON_BOUNDS, kde_raster
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    cell_size = float(sys.argv[2]) if len(sys.argv) > 2 else 250.0
+    bandwidth = 1000.0
+
+    rng = np.random.default_rng(0)
+    centre = rng.normal((530000, 180000), (7000, 5000), (size // 2, 2))
+    spread = rng.uniform(LONDON_BOUNDS[:2], LONDON_BOUNDS[2:], (size - size // 2, 2))
+    points = np.concatenate([centre, spread])
+    cache = tempfile.mkdtemp()
+
+    try:
+        start = time.perf_counter()
+        raster = kde_raster(points, LONDON_BOUNDS, cell_size, bandwidth, density=True, cache=cache)
+        print(f'kde_raster: {size} points on {raster.values.size} cells in {time.perf_counter() - start:.2f}s')
+        start = time.perf_counter()
+        cached = kde_raster(points, LONDON_BOUNDS, cell_size, bandwidth, density=True, cache=cache)
+        print(f'kde_raster from the tile cache: {time.perf_counter() - start:.2f}s')
+        assert np.array_equal(raster.values, cached.values)
+    finally:
+        shutil.rmtree(cache)
+
+    # gaussian_kde's kernel follows the data's covariance, so the same isotropic kernel is summed
+    # here the way it does, every point at every cell
+    start = time.perf_counter()
+    x, y = raster.centers()
+    cells = np.column_stack([x.ravel(), y.ravel()])
+    expected = np.zeros(len(cells))
+    for chunk in np.array_split(points, max(1, size // 500)):
+        squared = ((cells[:, None, :] - chunk[None, :, :]) ** 2).sum(axis=2)
+        expected += np.exp(-0.5 * squared / bandwidth ** 2).sum(axis=1)
+    expected = (expected / (2 * np.pi * bandwidth ** 2 * size)).reshape(x.shape)
+    print(f'exact kernel sum: {time.perf_counter() - start:.2f}s')
+    start = time.perf_counter()
+    gaussian_kde(points.T)(cells.T)
+    print(f"gaussian_kde with its own bandwidth, as kdeplot: {time.perf_counter() - start:.2f}s")
+
+    error = np.abs(raster.values - expected).max() / expected.max()
+    print(f'largest difference: {error:.2%} of the peak density')
+    assert error < 0.01
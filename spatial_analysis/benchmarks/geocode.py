@@ -0,0 +1,78 @@
+"""
+************************************************
+TIMING OF THE OFFLINE BATCH GEOCODER
+************************************************
+Builds a synthetic gazetteer (random postcodes in every district of the saved
+snapshots, and the street names of their addresses), then geocodes a sample of
+the listings, made distinct by a random house number, three times: without a
+cache, filling an empty cache, and answered from the cache.
+
+Usage: python spatial_analysis/benchmarks/geocode.py [listings]
+"""
+import glob
+import os.path
+import string
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import numpy as np
+import pandas as pd
+
+from data_scrapping.utils.dedup import postcode_district
+from spatial_analysis.geocode import Gazetteer, GeocodeCache, build_gazetteer, candidate_keys, geocode_listings
+
+SNAPSHOTS = os.path.join(os.path.dirname(__file__), '..', '..', 'data_output', '*.csv')
+# postcodes made up per district, about the number a London district has
+POSTCODES_PER_DISTRICT = 2000
+
+
+def synthetic_gazetteer(listings:pd.DataFrame, path:str, seed=0):
+    """
+    Writes a gazetteer covering the districts and streets of listings at random coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    districts = sorted({postcode_district(location, address) or '' for address, location in
+                        zip(listings['address'], listings['location'])} - {''})
+    districts = [district for district in districts if district[0].isupper()]
+
+    letters = np.array(list(string.ascii_uppercase))
+    codes = [f'{district}{rng.integers(1, 10)}{a}{b}' for district in districts
+             for a, b in zip(rng.choice(letters, POSTCODES_PER_DISTRICT), rng.choice(letters, POSTCODES_PER_DISTRICT))]
+    postcodes = pd.DataFrame({'postcode': codes, 'lat': rng.uniform(51.3, 51.7, len(codes)),
+                              'lon': rng.uniform(-0.5, 0.3, len(codes))})
+
+    streets = {}
+    for address, location in zip(listings['address'], listings['location']):
+        for key, level in candidate_keys(address, location):
+            if level == 1:
+                _, district, street = key.split(':', 2)
+                streets[(street, district)] = None
+    streets = pd.DataFrame(list(streets), columns=['street', 'district'])
+    streets['lat'] = rng.uniform(51.3, 51.7, len(streets))
+    streets['lon'] = rng.uniform(-0.5, 0.3, len(streets))
+    return build_gazetteer(postcodes, path, streets=streets)
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    snapshots = pd.concat([pd.read_csv(path, dtype=str) for path in glob.glob(SNAPSHOTS)], ignore_index=True)
+    sample = snapshots.sample(size, replace=True, random_state=0).reset_index(drop=True)
+    numbers = np.random.default_rng(1).integers(1, 200, size).astype(str)
+    sample['address'] = numbers + ' ' + sample['address'].fillna('')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'gazetteer.npy')
+        synthetic_gazetteer(snapshots, path)
+        gazetteer = Gazetteer(path)
+        cache = GeocodeCache(os.path.join(directory, 'cache.sqlite'))
+
+        for name, run_cache in (('no cache', None), ('cold cache', cache), ('warm cache', cache)):
+            start = time.perf_counter()
+            result = geocode_listings(sample, gazetteer, run_cache)
+            seconds = time.perf_counter() - start
+            levels = result['geocode_level'].value_counts().to_dict()
+            print(f'{name:>10}: {len(result)} listings in {seconds:.2f}s, {levels}')
@@ -0,0 +1,101 @@
+"""
+************************************************
+SPATIAL STATISTICS PIPELINE: COLD, WARM AND PARTIAL RUNS
+************************************************
+Runs pipeline.spatial_statistics_pipeline on local stand-ins for the
+notebook's sources: random robberies served by arcgis.MockFeatureServer with
+a delay per response, a neighbourhood profiles csv laid out as Toronto's, and
+a grid of square neighbourhoods. Times a first run, a second run with every
+stage cached, and a run for another year, which only recomputes the stages
+after the year filter, and checks the robbery counts against sjoin.
+
+Usage: python spatial_analysis/benchmarks/pipeline.py [features] [latency in seconds]
+"""
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from spatial_analysis.arcgis import MockFeatureServer
+from spatial_analysis.benchmarks.arcgis import random_features
+from spatial_analysis.pipeline import PROFILE_COLUMNS, spatial_statistics_pipeline
+
+# Toronto's extent in longitude and latitude
+BOUNDS = (-79.6, 43.58, -79.1, 43.85)
+
+
+def write_boundaries(path:str, columns=14, rows=10):
+    width, height = (BOUNDS[2] - BOUNDS[0]) / columns, (BOUNDS[3] - BOUNDS[1]) / rows
+    cells = [shapely.box(BOUNDS[0] + column * width, BOUNDS[1] + row * height,
+                         BOUNDS[0] + (column + 1) * width, BOUNDS[1] + (row + 1) * height)
+             for row in range(rows) for column in range(columns)]
+    names = [f'Neighbourhood {number:03d}' for number in range(len(cells))]
+    gpd.GeoDataFrame({'Neighbourhood': names}, geometry=cells, crs='EPSG:4326').to_file(path, driver='GeoJSON')
+    return names
+
+
+def write_profiles(path:str, names:list, rng):
+    """
+    A csv laid out as Toronto's neighbourhood profiles: four description columns, one
+    column per characteristic name, the city, then one column per neighbourhood.
+    """
+    characteristics = ['Neighbourhood Number', *PROFILE_COLUMNS]
+    table = pd.DataFrame({'_id': range(1, len(characteristics) + 1), 'Category': 'Population',
+                          'Topic': 'Profile', 'Data Source': 'Census Profile 98-316-X2016001',
+                          'Characteristic': characteristics})
+    for name in ['City of Toronto', *names]:
+        values = [f'{value:,.0f}' for value in rng.integers(1000, 60000, len(characteristics))]
+        table[name] = values
+    table.to_csv(path, index=False)
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    rng = np.random.default_rng(0)
+    directory = tempfile.mkdtemp()
+    boundary_path = os.path.join(directory, 'neighbourhoods.geojson')
+    profile_path = os.path.join(directory, 'profiles.csv')
+    write_profiles(profile_path, write_boundaries(boundary_path), rng)
+    features = random_features(size, rng)
+
+    try:
+        with MockFeatureServer(features, latency=latency) as server:
+            pipeline = spatial_statistics_pipeline(server.url, profile_path, boundary_path,
+                                                   cache=os.path.join(directory, 'stages'))
+            pipeline.set_params('crimes', cache=os.path.join(directory, 'pages'))
+            targets = ['global_moran', 'local_moran', 'crime_counts']
+
+            start = time.perf_counter()
+            first = pipeline.run(targets)
+            print(f'first run: {time.perf_counter() - start:.2f}s, {server.requests} requests')
+
+            start = time.perf_counter()
+            requests = server.requests
+            second = pipeline.run(targets)
+            print(f'second run, all cached: {time.perf_counter() - start:.2f}s, {server.requests - requests} requests')
+            assert second['global_moran'].equals(first['global_moran'])
+
+            start = time.perf_counter()
+            pipeline.set_params('crimes_of_year', year=2019)
+            stale = pipeline.stale(targets)
+            other_year = pipeline.run(targets)
+            print(f'another year, recomputing {stale}: {time.perf_counter() - start:.2f}s, '
+                  f'{server.requests - requests} requests')
+            print(other_year['global_moran'].to_string(index=False))
+    finally:
+        shutil.rmtree(directory)
+
+    crimes, counts = other_year['local_moran'], other_year['crime_counts']
+    joined = gpd.sjoin(crimes[['geometry']], counts[['Neighbourhood', 'geometry']], predicate='within')
+    expected = joined.groupby('Neighbourhood').size().reindex(counts['Neighbourhood'], fill_value=0)
+    assert (expected.to_numpy() == counts['robbery count'].to_numpy()).all()
+    print('same robbery counts per neighbourhood as sjoin')
@@ -0,0 +1,76 @@
+"""
+************************************************
+COMPARABLES QUERY: FULL SCAN AGAINST THE SPATIAL INDEX
+************************************************
+Finds the listings within 500 m with the same transaction and bedrooms for a
+sample of random London listings, once by scanning the whole table per
+listing and once through spatial_index.ListingIndex, and checks that both
+agree. Also times building the index and adding a daily snapshot to it.
+
+Usage: python spatial_analysis/benchmarks/spatial_index.py [listings] [queries]
+"""
+import os.path
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import numpy as np
+import pandas as pd
+
+from spatial_analysis.spatial_index import ListingIndex, to_grid
+
+
+def random_listings(size:int, rng, first=0):
+    return pd.DataFrame({
+        'lat': rng.uniform(51.3, 51.7, size),
+        'lon': rng.uniform(-0.5, 0.3, size),
+        'transaction': rng.choice(['rent', 'sales'], size),
+        'bedroom': pd.array(rng.integers(0, 6, size), dtype='Int8'),
+        'listing_url': [f'https://example.com/properties/{number}' for number in range(first, first + size)],
+    })
+
+
+def full_scan(listings:pd.DataFrame, queries:pd.DataFrame, radius:float):
+    """
+    The comparables of each query by masking the whole table, the baseline.
+    """
+    points = to_grid(listings['lat'], listings['lon'])
+    transactions, bedrooms = listings['transaction'].to_numpy(), listings['bedroom'].to_numpy()
+    urls = listings['listing_url'].to_numpy()
+    found = {}
+    for row, (point, transaction, bedroom, url) in enumerate(zip(
+            to_grid(queries['lat'], queries['lon']), queries['transaction'], queries['bedroom'], queries['listing_url'])):
+        distance = np.hypot(*(points - point).T)
+        mask = (distance <= radius) & (transactions == transaction) & (bedrooms == bedroom) & (urls != url)
+        found[row] = set(urls[mask])
+    return found
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rng = np.random.default_rng(0)
+    listings = random_listings(size, rng)
+    sample = listings.sample(queries, random_state=0).reset_index(drop=True)
+
+    start = time.perf_counter()
+    expected = full_scan(listings, sample, 500)
+    print(f'full scan: {queries} queries over {size} listings in {time.perf_counter() - start:.2f}s')
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = ListingIndex(directory)
+        start = time.perf_counter()
+        index.add(listings)
+        print(f'build: {time.perf_counter() - start:.2f}s')
+
+        start = time.perf_counter()
+        found = index.comparables(sample, 500)
+        print(f'index: {queries} queries in {time.perf_counter() - start:.3f}s, {len(found)} comparables')
+        got = found.groupby('query')['listing_url'].agg(set).to_dict()
+        assert all(got.get(row, set()) == urls for row, urls in expected.items()), 'the index disagrees with the scan'
+
+        start = time.perf_counter()
+        index.add(random_listings(size // 30, rng, first=size))
+        print(f'daily snapshot of {size // 30}: added in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,46 @@
+"""
+************************************************
+KNN WEIGHTS: LIBPYSAL AGAINST THE SPARSE BUILDER
+************************************************
+Builds k=10 nearest neighbour weights of random points with libpysal's KNN,
+as the notebook does, and with weights.knn_weights, cold and from its cache,
+and checks that both give the same neighbours.
+
+Usage: python spatial_analysis/benchmarks/weights.py [points] [k]
+"""
+import os.path
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+import numpy as np
+
+from spatial_analysis.weights import knn_weights
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    points = np.random.default_rng(0).uniform(0, 50000, (size, 2))
+
+    try:
+        import libpysal
+    except ImportError:
+        libpysal = None
+        print('libpysal is not installed, only the sparse builder is timed')
+    if libpysal is not None:
+        start = time.perf_counter()
+        expected = libpysal.weights.KNN(points, k=k)
+        print(f'libpysal KNN: {size} points in {time.perf_counter() - start:.2f}s')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for run in ('cold', 'cached'):
+            start = time.perf_counter()
+            weights = knn_weights(points, k=k, cache=directory)
+            print(f'knn_weights, {run}: {time.perf_counter() - start:.2f}s')
+
+    if libpysal is not None:
+        assert (expected.sparse.tocsr() != weights.sparse).nnz == 0, 'the neighbours differ'
+        print('same neighbours as libpysal')
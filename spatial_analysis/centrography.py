@@ -0,0 +1,285 @@
+"""
+************************************************
+GROUPED CENTROGRAPHY
+************************************************
+Mean centre, standard distance and euclidean median of points per group
+(e.g. per borough, property type and transaction), as pointpats'
+centrography.mean_center, std_distance and euclidean_median on each group,
+but for all groups at once and from data read in chunks.
+
+The mean centre and standard distance come from per group counts, means and
+sums of squared deviations, merged chunk by chunk with Chan's parallel
+update, so they take one pass and never need a chunk again. The euclidean
+median has no such summary: the points are kept (two floats and a group code
+each) and Weiszfeld's iterations run on every group together, one weighted
+bincount per iteration, each group stopping once its centre has settled.
+Appending a snapshot only marks the groups it touches; their medians restart
+from the previous ones, so they settle in a few iterations, and the others
+are not recomputed.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from spatial_analysis.aggregate import listing_points
+
+
+CENTROGRAPHY_PATH = 'data_output/centrography.npz'
+DEFAULT_GROUPS = ('propertyType', 'transaction')
+
+
+def weiszfeld(x, y, groups, size:int, start_x=None, start_y=None, tolerance=0.01, max_iterations=500):
+    """
+    Euclidean median of the points of every group: the point minimising the sum of distances
+    to them, by Weiszfeld's iterations run on all groups at once.
+
+    Parameters:
+        - x (array): Point x coordinates.
+        - y (array): Point y coordinates.
+        - groups (array): Group number of every point, 0 to size - 1.
+        - size (int): Number of groups.
+        - start_x (array, optional): Starting x of every group, the mean centre by default.
+        - start_y (array, optional): Starting y of every group.
+        - tolerance (float): A group stops when its centre moves less than this, in the
+          coordinates' units.
+        - max_iterations (int): Iterations at most.
+
+    Returns:
+        (median_x, median_y) arrays of size, NaN for groups without points.
+    """
+    counts = np.bincount(groups, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        center_x = np.bincount(groups, x, size) / counts if start_x is None else np.array(start_x, dtype='float64')
+        center_y = np.bincount(groups, y, size) / counts if start_y is None else np.array(start_y, dtype='float64')
+    active = counts > 0
+
+    for _ in range(max_iterations):
+        # only the points of groups still moving take part in the next iteration
+        kept = active[groups]
+        x, y, groups = x[kept], y[kept], groups[kept]
+        if not len(groups):
+            break
+        distance = np.hypot(x - center_x[groups], y - center_y[groups])
+        # a point on the current centre would divide by zero; it gets a large finite weight instead
+        weight = 1.0 / np.maximum(distance, tolerance * 1e-6)
+        total = np.bincount(groups, weight, size)
+        moving = np.flatnonzero(active)
+        new_x = np.bincount(groups, weight * x, size)[moving] / total[moving]
+        new_y = np.bincount(groups, weight * y, size)[moving] / total[moving]
+        shift = np.hypot(new_x - center_x[moving], new_y - center_y[moving])
+        center_x[moving], center_y[moving] = new_x, new_y
+        active[moving[shift < tolerance]] = False
+
+    center_x[counts == 0] = center_y[counts == 0] = np.nan
+    return center_x, center_y
+
+
+class GroupedCentrography:
+    """
+    Centrography of listings per group, updated chunk by chunk.
+
+    Parameters:
+        - by (tuple): Columns the listings are grouped by, e.g. ('borough', 'propertyType', 'transaction').
+        - crs (str, optional): The crs to project lat and lon or GeoDataFrames to, so that distances
+          are in metres; None to use the coordinates as they are.
+        - tolerance (float): Weiszfeld's tolerance, in crs units.
+    """
+
+    def __init__(self, by=DEFAULT_GROUPS, crs='EPSG:27700', tolerance=0.01):
+        self.by = list(by)
+        self.crs = crs
+        self.tolerance = tolerance
+        self.keys = []
+        self._codes = {}
+        self.count = np.zeros(0, dtype=np.int64)
+        self.mean_x = np.zeros(0)
+        self.mean_y = np.zeros(0)
+        # sums of squared deviations from the group's mean, over both axes
+        self.squares = np.zeros(0)
+        self.median_x = np.zeros(0)
+        self.median_y = np.zeros(0)
+        self._stale = np.zeros(0, dtype=bool)
+        self._points = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _group_codes(self, chunk:pd.DataFrame):
+        """
+        Group number of every row, new groups appended to keys.
+        """
+        columns = chunk[self.by]
+        # groups numbered in order of first appearance, as drop_duplicates lists them
+        local = columns.groupby(self.by, dropna=False, sort=False).ngroup().to_numpy()
+        uniques = columns.drop_duplicates()
+        mapping = np.empty(len(uniques), dtype=np.int64)
+        for position, key in enumerate(uniques.itertuples(index=False, name=None)):
+            key = tuple(None if pd.isna(value) else value for value in key)
+            if key not in self._codes:
+                self._codes[key] = len(self.keys)
+                self.keys.append(key)
+            mapping[position] = self._codes[key]
+
+        grown = len(self.keys) - len(self.count)
+        if grown:
+            self.count = np.concatenate([self.count, np.zeros(grown, dtype=np.int64)])
+            self.mean_x, self.mean_y, self.squares, self.median_x, self.median_y = (
+                np.concatenate([values, np.full(grown, fill)]) for values, fill in
+                ((self.mean_x, 0.0), (self.mean_y, 0.0), (self.squares, 0.0), (self.median_x, np.nan),
+                 (self.median_y, np.nan)))
+            self._stale = np.concatenate([self._stale, np.zeros(grown, dtype=bool)])
+        return mapping[local]
+
+    def update(self, chunk:pd.DataFrame):
+        """
+        Adds a chunk of listings, e.g. one piece of pd.read_csv(..., chunksize=...) or a new
+        daily snapshot. Rows without coordinates are skipped.
+
+        Parameters:
+            - chunk (DataFrame or GeoDataFrame): Listings with the by columns, and lat and lon
+              columns or point geometries.
+
+        Returns:
+            self
+        """
+        x, y = listing_points(chunk, self.crs)
+        x, y = np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64')
+        groups = self._group_codes(chunk)
+        located = np.isfinite(x) & np.isfinite(y)
+        x, y, groups = x[located], y[located], groups[located]
+        if not len(x):
+            return self
+
+        # the chunk's count, mean and squared deviations per group, merged with Chan's update
+        size = len(self.keys)
+        count = np.bincount(groups, minlength=size)
+        seen = count > 0
+        mean_x = np.bincount(groups, x, size)[seen] / count[seen]
+        mean_y = np.bincount(groups, y, size)[seen] / count[seen]
+        positions = np.flatnonzero(seen)
+        lookup = np.zeros(size, dtype=np.int64)
+        lookup[positions] = np.arange(len(positions))
+        deviation = (x - mean_x[lookup[groups]]) ** 2 + (y - mean_y[lookup[groups]]) ** 2
+        squares = np.bincount(groups, deviation, size)[seen]
+
+        before = self.count[seen]
+        total = before + count[seen]
+        delta_x, delta_y = mean_x - self.mean_x[seen], mean_y - self.mean_y[seen]
+        self.squares[seen] += squares + (delta_x ** 2 + delta_y ** 2) * before * count[seen] / total
+        self.mean_x[seen] += delta_x * count[seen] / total
+        self.mean_y[seen] += delta_y * count[seen] / total
+        self.count[seen] = total
+
+        self._points.append((x, y, groups))
+        self._stale |= seen
+        return self
+
+    def points(self):
+        """
+        x, y and group number of every point added so far.
+        """
+        if len(self._points) > 1:
+            self._points = [tuple(np.concatenate(parts) for parts in zip(*self._points))]
+        if not self._points:
+            return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+        return self._points[0]
+
+    @property
+    def std_distance(self):
+        """
+        Standard distance of every group: the root mean squared distance of its points to their mean centre.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.sqrt(self.squares / self.count)
+
+    def medians(self, max_iterations=500):
+        """
+        Euclidean median of every group, only recomputing the groups changed since the last call.
+
+        Returns:
+            (median_x, median_y) arrays.
+        """
+        stale = np.flatnonzero(self._stale)
+        if len(stale):
+            x, y, groups = self.points()
+            kept = self._stale[groups]
+            # previous medians are good starting points after a snapshot; new groups start from their mean
+            fresh = np.isnan(self.median_x[stale])
+            start_x = np.where(fresh, self.mean_x[stale], self.median_x[stale])
+            start_y = np.where(fresh, self.mean_y[stale], self.median_y[stale])
+            lookup = np.zeros(len(self.keys), dtype=np.int64)
+            lookup[stale] = np.arange(len(stale))
+            median_x, median_y = weiszfeld(x[kept], y[kept], lookup[groups[kept]], len(stale), start_x, start_y,
+                                           self.tolerance, max_iterations)
+            self.median_x[stale], self.median_y[stale] = median_x, median_y
+            self._stale[:] = False
+        return self.median_x, self.median_y
+
+    def summary(self):
+        """
+        The centrography of every group.
+
+        Returns:
+            dataframe indexed by the by columns, with count, mean_x, mean_y, std_distance, median_x
+            and median_y in crs units, and the mean and median centres' lon and lat when a crs is set.
+        """
+        median_x, median_y = self.medians()
+        index = pd.MultiIndex.from_tuples(self.keys, names=self.by) if self.keys else None
+        result = pd.DataFrame({'count': self.count, 'mean_x': self.mean_x, 'mean_y': self.mean_y,
+                               'std_distance': self.std_distance, 'median_x': median_x, 'median_y': median_y},
+                              index=index)
+        if self.crs is not None and len(result):
+            from pyproj import Transformer
+            to_lonlat = Transformer.from_crs(self.crs, 'EPSG:4326', always_xy=True)
+            result['mean_lon'], result['mean_lat'] = to_lonlat.transform(self.mean_x, self.mean_y)
+            result['median_lon'], result['median_lat'] = to_lonlat.transform(median_x, median_y)
+        return result.sort_index()
+
+    def save(self, path=CENTROGRAPHY_PATH):
+        """
+        Saves the groups' statistics and points, to go on with the next snapshot in another session.
+        """
+        self.medians()
+        x, y, groups = self.points()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # write then rename, so an interrupted save never leaves a truncated file behind
+        temp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(temp_path, x=x, y=y, groups=groups, count=self.count, mean_x=self.mean_x, mean_y=self.mean_y,
+                 squares=self.squares, median_x=self.median_x, median_y=self.median_y,
+                 settings=json.dumps({'by': self.by, 'crs': self.crs, 'tolerance': self.tolerance,
+                                      'keys': self.keys}, default=str))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path=CENTROGRAPHY_PATH):
+        with np.load(path) as saved:
+            settings = json.loads(str(saved['settings']))
+            centrography = cls(settings['by'], settings['crs'], settings['tolerance'])
+            centrography.keys = [tuple(key) for key in settings['keys']]
+            centrography._codes = {key: code for code, key in enumerate(centrography.keys)}
+            for name in ('count', 'mean_x', 'mean_y', 'squares', 'median_x', 'median_y'):
+                setattr(centrography, name, saved[name])
+            centrography._stale = np.zeros(len(centrography.keys), dtype=bool)
+            centrography._points = [(saved['x'], saved['y'], saved['groups'])]
+        return centrography
+
+
+def grouped_centrography(chunks, by=DEFAULT_GROUPS, crs='EPSG:27700'):
+    """
+    Centrography per group of listings read in chunks.
+
+    Parameters:
+        - chunks (DataFrame or iterable of DataFrames): Listings, e.g.
+          pd.read_csv('data_output/rightmove_2024-08-24.csv', chunksize=100000) once geocoded.
+        - by (tuple): Columns to group by.
+        - crs (str, optional): See GroupedCentrography.
+
+    Returns:
+        dataframe, see GroupedCentrography.summary.
+    """
+    centrography = GroupedCentrography(by, crs)
+    for chunk in [chunks] if isinstance(chunks, pd.DataFrame) else chunks:
+        centrography.update(chunk)
+    return centrography.summary()
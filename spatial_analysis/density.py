@@ -0,0 +1,400 @@
+"""
+************************************************
+KERNEL DENSITY RASTERS
+************************************************
+Gaussian kernel density of listings (or crimes, or any points) as a numeric
+raster, instead of the notebook's sns.kdeplot evaluating the kernel of every
+point at every grid cell. Points are linearly binned onto the grid and the
+binned counts are convolved with the sampled kernel by FFT, so the cost
+grows with the number of points plus the number of cells, not their product.
+Points can be weighted, e.g. by price or rent.
+
+Rasters are computed in square tiles of TILE_CELLS cells on a grid anchored
+at the crs origin, each from the points within the tile and a halo of the
+kernel's radius around it, so tiles put side by side are the same raster as
+one computed at once. Every tile is cached on disk under a hash of its
+position, cell size, bandwidth, filter, weights and of the points it was
+computed from: drawing the same map again only loads tiles, and after a new
+snapshot only the tiles whose points changed are recomputed.
+
+Computing and plotting are separate: plot_raster only renders a raster
+already computed.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.signal import fftconvolve
+
+from spatial_analysis.aggregate import listing_points
+from spatial_analysis.weights import coordinates_of
+
+
+DENSITY_CACHE = 'data_output/density_cache'
+# Greater London in British National Grid metres
+LONDON_BOUNDS = (503000, 155000, 562000, 201000)
+# cells per side of a cached tile
+TILE_CELLS = 256
+# the kernel is cut off at this many bandwidths
+TRUNCATE = 4.0
+# cells below this share of the maximum are left transparent by plot_raster
+TRANSPARENT_BELOW = 0.02
+
+
+class Raster:
+    """
+    Values on a grid of square cells.
+
+    Parameters:
+        - values (array): (rows, columns) values, row 0 being the southernmost.
+        - x0 (float): x of the grid's west edge.
+        - y0 (float): y of the grid's south edge.
+        - cell_size (float): Side of a cell, in the crs units.
+        - crs (str, optional): The crs of the grid.
+    """
+
+    def __init__(self, values:np.ndarray, x0:float, y0:float, cell_size:float, crs=None):
+        self.values = values
+        self.x0 = x0
+        self.y0 = y0
+        self.cell_size = cell_size
+        self.crs = crs
+
+    def __repr__(self):
+        return f'Raster({self.values.shape[0]}x{self.values.shape[1]}, bounds={self.bounds}, crs={self.crs})'
+
+    @property
+    def bounds(self):
+        rows, columns = self.values.shape
+        return self.x0, self.y0, self.x0 + columns * self.cell_size, self.y0 + rows * self.cell_size
+
+    @property
+    def extent(self):
+        """
+        (west, east, south, north), as matplotlib's imshow wants it.
+        """
+        x0, y0, x1, y1 = self.bounds
+        return x0, x1, y0, y1
+
+    def centers(self):
+        """
+        x and y of the cell centres, as two (rows, columns) arrays.
+        """
+        rows, columns = self.values.shape
+        return np.meshgrid(self.x0 + (np.arange(columns) + 0.5) * self.cell_size,
+                           self.y0 + (np.arange(rows) + 0.5) * self.cell_size)
+
+
+def scott_bandwidth(x, y):
+    """
+    Scott's rule bandwidth of the points, as scipy's gaussian_kde and seaborn's kdeplot
+    use by default, taken isotropic; 0 for fewer than two points.
+    """
+    if len(x) < 2:
+        return 0.0
+    return float(len(x) ** (-1 / 6) * np.sqrt((np.var(x) + np.var(y)) / 2))
+
+
+def _kernel(bandwidth:float, cell_size:float):
+    """
+    The gaussian kernel sampled at the cells within TRUNCATE bandwidths, scaled so that it
+    integrates to one over the cells' area.
+    """
+    radius = int(np.ceil(TRUNCATE * bandwidth / cell_size))
+    profile = np.exp(-0.5 * (np.arange(-radius, radius + 1) * cell_size / bandwidth) ** 2)
+    kernel = np.outer(profile, profile)
+    return kernel / (kernel.sum() * cell_size ** 2)
+
+
+def _bin(x, y, weights, x0:float, y0:float, cell_size:float, shape):
+    """
+    Linear binning: each point's weight is shared between the four cell centres around it,
+    in proportion to how close it is to each.
+    """
+    rows, columns = shape
+    gx = (x - x0) / cell_size - 0.5
+    gy = (y - y0) / cell_size - 0.5
+    column, row = np.floor(gx).astype(np.int64), np.floor(gy).astype(np.int64)
+    fx, fy = gx - column, gy - row
+
+    grid = np.zeros(rows * columns)
+    for dy, wy in ((0, 1 - fy), (1, fy)):
+        for dx, wx in ((0, 1 - fx), (1, fx)):
+            r, c = row + dy, column + dx
+            kept = (r >= 0) & (r < rows) & (c >= 0) & (c < columns)
+            grid += np.bincount(r[kept] * columns + c[kept], (weights * wy * wx)[kept], minlength=rows * columns)
+    return grid.reshape(rows, columns)
+
+
+def intensity(x, y, bounds, cell_size:float, bandwidth:float, weights=None):
+    """
+    Kernel intensity of the points over bounds, in one piece.
+
+    Parameters:
+        - x (array): Point x coordinates.
+        - y (array): Point y coordinates.
+        - bounds (tuple): (west, south, east, north) of the grid, multiples of cell_size.
+        - cell_size (float): Side of a cell.
+        - bandwidth (float): Standard deviation of the gaussian kernel, in the same units.
+        - weights (array, optional): Weight of every point, 1 by default.
+
+    Returns:
+        (rows, columns) array of the weight per unit area around each cell centre; summed
+        over the cells and multiplied by their area, the total weight of the points.
+    """
+    x0, y0, x1, y1 = bounds
+    rows, columns = int(round((y1 - y0) / cell_size)), int(round((x1 - x0) / cell_size))
+    kernel = _kernel(bandwidth, cell_size)
+    halo = kernel.shape[0] // 2
+    weights = np.ones(len(x)) if weights is None else weights
+
+    # points up to a kernel radius outside the bounds still spill into them
+    binned = _bin(x, y, weights, x0 - halo * cell_size, y0 - halo * cell_size, cell_size,
+                  (rows + 2 * halo, columns + 2 * halo))
+    smoothed = fftconvolve(binned, kernel, mode='same')[halo:halo + rows, halo:halo + columns]
+    # FFT round off leaves tiny negative values where there are no points
+    return np.maximum(smoothed, 0.0)
+
+
+def _select(listings, filter):
+    """
+    The listings matching filter, a dict of column: value or list of values.
+    """
+    if not filter:
+        return listings
+    keep = np.ones(len(listings), dtype=bool)
+    for column, wanted in filter.items():
+        values = listings[column]
+        keep &= values.isin(wanted).to_numpy() if isinstance(wanted, (list, tuple, set)) else (values == wanted).to_numpy()
+    return listings[keep]
+
+
+def _points(data, weights, filter, crs):
+    """
+    x, y and weights of the located points of data, weighted points without a weight dropped.
+    """
+    if isinstance(data, pd.DataFrame):
+        data = _select(data, filter)
+        x, y = listing_points(data, crs)
+        if isinstance(weights, str):
+            weights = pd.to_numeric(data[weights], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    else:
+        x, y = coordinates_of(data).T
+    weights = np.ones(len(x)) if weights is None else np.asarray(weights, dtype='float64')
+
+    kept = np.isfinite(x) & np.isfinite(y) & np.isfinite(weights)
+    return np.asarray(x)[kept], np.asarray(y)[kept], weights[kept]
+
+
+def _fingerprint(x, y, weights):
+    """
+    Order independent 128 bit hash of points: each point's coordinate and weight bits are
+    mixed into one 64 bit value and the values are summed two ways, so reordering the
+    listings does not invalidate the cache and no sort is needed.
+    """
+    with np.errstate(over='ignore'):
+        mixed = (x.view(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+                 ^ y.view(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+                 ^ weights.view(np.uint64) * np.uint64(0x165667B19E3779F9))
+        mixed ^= mixed >> np.uint64(31)
+        mixed *= np.uint64(0xBF58476D1CE4E5B9)
+        mixed ^= mixed >> np.uint64(29)
+        other = (mixed ^ (mixed >> np.uint64(32))) * np.uint64(0x94D049BB133111EB)
+        return [len(x), int(mixed.sum()), int(other.sum())]
+
+
+def _tile_key(x, y, weights, settings:dict):
+    """
+    Hash of a tile's settings and of the points it is computed from, whatever their order.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([settings, _fingerprint(x, y, weights)], sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _tile(x, y, weights, column:int, row:int, cell_size:float, bandwidth:float, settings:dict, cache):
+    """
+    The intensity of one tile, loaded from the cache or computed and saved.
+    """
+    side = TILE_CELLS * cell_size
+    bounds = (column * side, row * side, (column + 1) * side, (row + 1) * side)
+    reach = (_kernel(bandwidth, cell_size).shape[0] // 2 + 1) * cell_size
+    near = (x >= bounds[0] - reach) & (x < bounds[2] + reach) & (y >= bounds[1] - reach) & (y < bounds[3] + reach)
+    x, y, weights = x[near], y[near], weights[near]
+    if not len(x):
+        return np.zeros((TILE_CELLS, TILE_CELLS))
+    if cache is None:
+        return intensity(x, y, bounds, cell_size, bandwidth, weights)
+
+    key = _tile_key(x, y, weights, dict(settings, tile=[column, row]))
+    path = os.path.join(cache, f'{column}_{row}-{key}.npy')
+    if os.path.exists(path):
+        return np.load(path)
+
+    values = intensity(x, y, bounds, cell_size, bandwidth, weights)
+    os.makedirs(cache, exist_ok=True)
+    # write then rename, so an interrupted save never leaves a truncated tile behind
+    temp_path = f'{path}.{os.getpid()}.tmp.npy'
+    np.save(temp_path, values)
+    os.replace(temp_path, path)
+    return values
+
+
+def kde_raster(data, bounds=None, cell_size=100.0, bandwidth=None, weights=None, filter=None, density=False,
+               crs='EPSG:27700', cache=DENSITY_CACHE):
+    """
+    Kernel density raster of points, e.g. of listings over London.
+
+    Parameters:
+        - data (DataFrame, GeoDataFrame or array): Listings with lat and lon columns, a GeoDataFrame
+          of points, or (n, 2) coordinates already in crs.
+        - bounds (tuple, optional): (west, south, east, north) in crs, widened to whole cells;
+          by default the points' bounds.
+        - cell_size (float): Side of a cell, in crs units (metres for the default crs).
+        - bandwidth (float, optional): Standard deviation of the kernel in crs units, by default
+          Scott's rule on the points, as kdeplot. Fix it to compare rasters.
+        - weights (str or array, optional): Column to weight the points by, e.g. 'rent_perMonth'
+          (points without a value are dropped), or the weights themselves.
+        - filter (dict, optional): Listings to keep, as column: value or list of values, e.g.
+          {'transaction': 'rent', 'propertyType': ['Flat', 'Apartment']}.
+        - density (bool): Scale the raster to integrate to one, as kdeplot, rather than to the
+          total weight.
+        - crs (str): The crs to project lat and lon or the GeoDataFrame to.
+        - cache (str, optional): Tile cache directory, None to always compute.
+
+    Returns:
+        Raster of the weight (the number of points, if unweighted) per square crs unit, zeros
+        when no point is selected.
+    """
+    x, y, point_weights = _points(data, weights, filter, crs)
+    # one cell when Scott's rule has nothing to go on: no points, one, or all at the same place
+    bandwidth = float(bandwidth or scott_bandwidth(x, y) or cell_size)
+    if bounds is None:
+        bounds = (x.min(), y.min(), x.max(), y.max()) if len(x) else (0.0, 0.0, cell_size, cell_size)
+    x0, y0 = np.floor(bounds[0] / cell_size) * cell_size, np.floor(bounds[1] / cell_size) * cell_size
+    x1, y1 = np.ceil(bounds[2] / cell_size) * cell_size, np.ceil(bounds[3] / cell_size) * cell_size
+    x1, y1 = max(x1, x0 + cell_size), max(y1, y0 + cell_size)
+
+    side = TILE_CELLS * cell_size
+    first_column, first_row = int(np.floor(x0 / side)), int(np.floor(y0 / side))
+    last_column, last_row = int(np.ceil(x1 / side)), int(np.ceil(y1 / side))
+    settings = {'cell_size': cell_size, 'bandwidth': bandwidth, 'truncate': TRUNCATE, 'crs': crs,
+                'filter': filter, 'weights': weights if isinstance(weights, str) else weights is not None}
+
+    mosaic = np.zeros(((last_row - first_row) * TILE_CELLS, (last_column - first_column) * TILE_CELLS))
+    for row in range(first_row, last_row):
+        for column in range(first_column, last_column):
+            top, left = (row - first_row) * TILE_CELLS, (column - first_column) * TILE_CELLS
+            mosaic[top:top + TILE_CELLS, left:left + TILE_CELLS] = _tile(
+                x, y, point_weights, column, row, cell_size, bandwidth, settings, cache)
+
+    top, left = int(round(y0 / cell_size)) - first_row * TILE_CELLS, int(round(x0 / cell_size)) - first_column * TILE_CELLS
+    rows, columns = int(round((y1 - y0) / cell_size)), int(round((x1 - x0) / cell_size))
+    values = mosaic[top:top + rows, left:left + columns].copy()
+    if density and point_weights.sum():
+        values /= point_weights.sum()
+    return Raster(values, float(x0), float(y0), cell_size, crs)
+
+
+def mean_raster(data, column:str, bounds=None, cell_size=100.0, bandwidth=None, filter=None, min_intensity=None,
+                crs='EPSG:27700', cache=DENSITY_CACHE):
+    """
+    Kernel weighted mean of a column, e.g. the typical rent around each cell: the raster
+    weighted by the column divided by the unweighted raster of the same points.
+
+    Parameters:
+        - column (str): The column to average, e.g. 'rent_perMonth'.
+        - min_intensity (float, optional): Cells with fewer points per square crs unit are NaN;
+          by default those with under 1% of the maximum.
+        - Others: see kde_raster.
+
+    Returns:
+        Raster of the local mean, all NaN when no listing has a value.
+    """
+    data = _select(data, filter)
+    data = data[pd.to_numeric(data[column], errors='coerce').notna()]
+    x, y, _ = _points(data, None, None, crs)
+    bandwidth = float(bandwidth or scott_bandwidth(x, y) or cell_size)
+    if bounds is None:
+        bounds = (x.min(), y.min(), x.max(), y.max()) if len(x) else (0.0, 0.0, cell_size, cell_size)
+
+    counts = kde_raster(data, bounds, cell_size, bandwidth, None, filter, crs=crs, cache=cache)
+    totals = kde_raster(data, bounds, cell_size, bandwidth, column, filter, crs=crs, cache=cache)
+    floor = 0.01 * counts.values.max() if min_intensity is None else min_intensity
+    values = np.where(counts.values > max(floor, 0.0), totals.values / np.where(counts.values > 0, counts.values, 1), np.nan)
+    return Raster(values, counts.x0, counts.y0, cell_size, crs)
+
+
+def plot_raster(raster:Raster, ax=None, cmap='YlOrRd', alpha=0.8, vmax=None, title=None, colorbar=True):
+    """
+    Renders a raster computed by kde_raster or mean_raster; cells under TRANSPARENT_BELOW of
+    the maximum are left transparent, as kdeplot leaves its lowest level out.
+
+    Parameters:
+        - raster (Raster): The raster.
+        - ax (Axes, optional): Axes to draw on, a new figure's by default.
+        - cmap (str): Colour map, the notebook's YlOrRd by default.
+        - alpha (float): Opacity.
+        - vmax (float, optional): Value of the top colour, to share a scale between plots.
+        - title (str, optional): Title of the axes.
+        - colorbar (bool): Add a colour bar.
+
+    Returns:
+        The axes.
+    """
+    import matplotlib.pyplot as plt
+
+    if ax is None:
+        _, ax = plt.subplots(figsize=(8, 7))
+    values = raster.values
+    top = np.nanmax(values) if vmax is None and np.isfinite(values).any() else vmax
+    shown = np.ma.masked_where(~np.isfinite(values) | (values <= TRANSPARENT_BELOW * (top or 0)), values)
+    image = ax.imshow(shown, extent=raster.extent, origin='lower', cmap=cmap, alpha=alpha, vmin=0, vmax=top)
+    if colorbar:
+        ax.figure.colorbar(image, ax=ax, shrink=0.7)
+    if title:
+        ax.set_title(title)
+    ax.set_axis_off()
+    return ax
+
+
+def london_heatmaps(listings:pd.DataFrame, by='propertyType', types=None, weights=None, transaction=None,
+                    cell_size=100.0, bandwidth=500.0, cache=DENSITY_CACHE, path=None):
+    """
+    One kernel density heatmap of London per property type, on the same grid and bandwidth.
+
+    Parameters:
+        - listings (DataFrame): Geocoded listings, with lat and lon columns.
+        - by (str): Column to split the maps by.
+        - types (list, optional): The values of by to map, by default the six most common.
+        - weights (str, optional): Column to weight by, e.g. 'sales_price'.
+        - transaction (str, optional): Only map rent or sales listings.
+        - cell_size (float): Side of a cell, in metres.
+        - bandwidth (float): Kernel standard deviation, in metres.
+        - cache (str, optional): Tile cache directory.
+        - path (str, optional): File to save the figure to.
+
+    Returns:
+        dict of type: Raster, and the figure.
+    """
+    import matplotlib.pyplot as plt
+
+    base = {'transaction': transaction} if transaction else {}
+    types = list(listings[by].value_counts().index[:6]) if types is None else list(types)
+    rasters = {kind: kde_raster(listings, LONDON_BOUNDS, cell_size, bandwidth, weights, dict(base, **{by: kind}),
+                                cache=cache)
+               for kind in types}
+
+    columns = min(3, max(1, len(types)))
+    rows = int(np.ceil(len(types) / columns)) or 1
+    figure, axes = plt.subplots(rows, columns, figsize=(6 * columns, 5 * rows), squeeze=False)
+    for ax, (kind, raster) in zip(axes.ravel(), rasters.items()):
+        plot_raster(raster, ax=ax, title=kind)
+    for ax in axes.ravel()[len(rasters):]:
+        ax.set_axis_off()
+    figure.tight_layout()
+    if path:
+        figure.savefig(path, dpi=150)
+    return rasters, figure
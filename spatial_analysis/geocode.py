@@ -0,0 +1,370 @@
+"""
+************************************************
+OFFLINE BATCH GEOCODER
+************************************************
+Gives listings a latitude and longitude without any network access.
+
+Coordinates come from a local gazetteer of UK postcodes, street names and
+postcode districts, built once from open data (the ONS Postcode Directory and,
+optionally, OS Open Names) into a single sorted numpy file. The file is
+memory-mapped, so opening it costs nothing and only the pages touched by a
+lookup are read, and a whole batch of listings is resolved with one binary
+search (np.searchsorted) over the hashed keys. Each listing is placed at the
+most precise level found: its full postcode, its street within the district,
+or the district centroid. Answers are kept in a sqlite cache, so addresses seen
+before are not resolved again.
+
+Usage: python spatial_analysis/geocode.py postcodes.csv [open_names.csv]
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+from functools import lru_cache
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+import numpy as np
+import pandas as pd
+
+# the scrapers' address normalization, so listings are matched the same way as in dedup
+from data_scrapping.utils.dedup import ABBREVIATIONS, postcode_district
+
+
+GAZETTEER_PATH = 'data_output/gazetteer.npy'
+CACHE_PATH = 'data_output/geocode_cache.sqlite'
+
+# hashed key, then coordinates; float32 degrees are precise to about a metre
+GAZETTEER_DTYPE = np.dtype([('key', '<u8'), ('lat', '<f4'), ('lon', '<f4')])
+# levels in order of precision, the first one found wins
+LEVELS = ('postcode', 'street', 'district')
+
+POSTCODE_PATTERN = re.compile(r'\b([A-Z]{1,2}\d[A-Z\d]?)\s*(\d[A-Z]{2})\b')
+# words of an address part that do not belong to the street name
+STREET_STOPWORDS = {'london', 'flat', 'apartment', 'unit', 'the', 'uk'}
+# words only, so house numbers such as 12a are skipped
+STREET_WORD_PATTERN = re.compile(r"\b[a-z']+\b")
+# address parts tried as street names, from the first one
+MAX_STREET_PARTS = 3
+
+
+def normalize_postcode(postcode):
+    """
+    Uppercases a postcode and removes its spaces, e.g. 'sw18 4aa' -> 'SW184AA'.
+    """
+    return re.sub(r'\s+', '', postcode.upper()) if isinstance(postcode, str) else None
+
+
+@lru_cache(maxsize=None)
+def _street_word(word):
+    word = word.replace("'", '')
+    word = ABBREVIATIONS.get(word, word)
+    return None if not word or word in STREET_STOPWORDS else word
+
+
+# the same street names come up in many addresses
+@lru_cache(maxsize=2 ** 16)
+def normalize_street(street):
+    """
+    Lowercases a street name and expands its abbreviations, dropping house numbers and
+    postcodes, e.g. '12a Wandsworth Bridge Rd' -> 'wandsworth bridge road'.
+
+    Returns:
+        str, or None when nothing of the name is left.
+    """
+    if not isinstance(street, str):
+        return None
+    words = [_street_word(word) for word in STREET_WORD_PATTERN.findall(street.lower())]
+    return ' '.join(word for word in words if word) or None
+
+
+def hash_keys(texts):
+    """
+    Hashes gazetteer keys such as 'postcode:SW184AA' to unsigned 64 bit integers.
+    """
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little') for text in texts),
+        dtype=np.uint64, count=len(texts),
+    )
+
+
+def build_gazetteer(postcodes:pd.DataFrame, path=GAZETTEER_PATH, streets=None, places=None):
+    """
+    Writes the sorted gazetteer file geocoding looks listings up in.
+
+    Parameters:
+        - postcodes (DataFrame): postcode, lat and lon of every postcode, see read_postcodes.
+          District centroids are derived from them.
+        - path (str): The .npy file written.
+        - streets (DataFrame, optional): street, district, lat and lon of street names, see read_open_names.
+        - places (DataFrame, optional): name, lat and lon of places listings name instead of a
+          district, e.g. 'Knightsbridge'; looked up at the district level.
+
+    Returns:
+        int: The number of keys in the gazetteer.
+    """
+    postcodes = postcodes.dropna(subset=['postcode', 'lat', 'lon'])
+    codes = postcodes['postcode'].map(normalize_postcode)
+    districts = codes.str[:-3]
+    centroids = postcodes.groupby(districts.values)[['lat', 'lon']].mean()
+
+    keys = ['postcode:' + code for code in codes]
+    keys += ['district:' + district for district in centroids.index]
+    lat = [postcodes['lat'].to_numpy(), centroids['lat'].to_numpy()]
+    lon = [postcodes['lon'].to_numpy(), centroids['lon'].to_numpy()]
+
+    if streets is not None:
+        streets = streets.dropna(subset=['street', 'district', 'lat', 'lon'])
+        names = streets['street'].map(normalize_street)
+        kept = names.notna().to_numpy()
+        keys += [f'street:{district.upper()}:{name}' for district, name in zip(streets['district'][kept], names[kept])]
+        lat.append(streets['lat'].to_numpy()[kept])
+        lon.append(streets['lon'].to_numpy()[kept])
+    if places is not None:
+        places = places.dropna(subset=['name', 'lat', 'lon'])
+        keys += ['district:' + name.strip().lower() for name in places['name']]
+        lat.append(places['lat'].to_numpy())
+        lon.append(places['lon'].to_numpy())
+
+    table = np.empty(len(keys), dtype=GAZETTEER_DTYPE)
+    table['key'] = hash_keys(keys)
+    table['lat'] = np.concatenate(lat)
+    table['lon'] = np.concatenate(lon)
+
+    # sorted for the binary search; the first entry of a repeated key is kept
+    table = table[np.argsort(table['key'], kind='stable')]
+    table = table[np.concatenate(([True], table['key'][1:] != table['key'][:-1]))]
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp.npy'
+    np.save(temp_path, table)
+    os.replace(temp_path, path)
+    print(f'gazetteer: {len(table)} keys written to {path}')
+    return len(table)
+
+
+def read_postcodes(path:str, postcode='pcds', lat='lat', lon='long'):
+    """
+    Reads postcode coordinates from a csv, by default the ONS Postcode Directory's columns.
+    """
+    data = pd.read_csv(path, usecols=[postcode, lat, lon], dtype={postcode: str})
+    return data.rename(columns={postcode: 'postcode', lat: 'lat', lon: 'lon'})
+
+
+def read_open_names(path:str):
+    """
+    Reads the named roads of an OS Open Names csv, converting their British National Grid
+    coordinates to latitude and longitude.
+    """
+    from pyproj import Transformer
+
+    data = pd.read_csv(path, usecols=['NAME1', 'LOCAL_TYPE', 'POSTCODE_DISTRICT', 'GEOMETRY_X', 'GEOMETRY_Y'])
+    data = data[data['LOCAL_TYPE'] == 'Named Road']
+    transformer = Transformer.from_crs('EPSG:27700', 'EPSG:4326', always_xy=True)
+    lon, lat = transformer.transform(data['GEOMETRY_X'].to_numpy(), data['GEOMETRY_Y'].to_numpy())
+    return pd.DataFrame({'street': data['NAME1'].to_numpy(), 'district': data['POSTCODE_DISTRICT'].to_numpy(),
+                         'lat': lat, 'lon': lon})
+
+
+class Gazetteer:
+    """
+    Read only, memory-mapped view of a gazetteer file.
+
+    Parameters:
+        - path (str): The file written by build_gazetteer.
+    """
+
+    def __init__(self, path=GAZETTEER_PATH):
+        self.path = path
+        self.table = np.load(path, mmap_mode='r')
+        if self.table.dtype != GAZETTEER_DTYPE:
+            raise ValueError(f'{path} is not a gazetteer file')
+        stat = os.stat(path)
+        # cached answers are only valid for the gazetteer they came from
+        self.version = f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def __len__(self):
+        return len(self.table)
+
+    def lookup(self, keys:np.ndarray):
+        """
+        Binary searches hashed keys.
+
+        Returns:
+            array of the keys' positions in the table, -1 for keys not in it.
+        """
+        table_keys = self.table['key']
+        if not len(table_keys):
+            return np.full(len(keys), -1)
+        positions = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+        return np.where(table_keys[positions] == keys, positions, -1)
+
+
+class GeocodeCache:
+    """
+    Answers of earlier geocoding runs, stored in sqlite.
+
+    Parameters:
+        - path (str): The sqlite file.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._connection = None
+
+    # the connection is opened lazily so the cache can be sent to pool workers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=30)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS geocodes ('
+                'query TEXT, version TEXT, lat REAL, lon REAL, level TEXT, PRIMARY KEY (query, version))'
+            )
+        return self._connection
+
+    def get(self, queries, version:str):
+        """
+        Returns a dict of query -> (lat, lon, level) for the queries answered before.
+        """
+        queries = list(queries)
+        answers = {}
+        # stay under sqlite's limit on bound parameters
+        for start in range(0, len(queries), 500):
+            chunk = queries[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.connection.execute(
+                f'SELECT query, lat, lon, level FROM geocodes WHERE version = ? AND query IN ({placeholders})',
+                (version, *chunk),
+            ).fetchall()
+            answers.update((query, (lat, lon, level)) for query, lat, lon, level in rows)
+        return answers
+
+    def put(self, answers:dict, version:str):
+        """
+        Stores a dict of query -> (lat, lon, level).
+        """
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)',
+            [(query, version, lat, lon, level) for query, (lat, lon, level) in answers.items()],
+        )
+        self.connection.commit()
+
+
+def candidate_keys(address, location):
+    """
+    The gazetteer keys a listing could be found under, most precise first.
+
+    Returns:
+        list of (key, level) tuples.
+    """
+    candidates = []
+    upper = address.upper() if isinstance(address, str) else ''
+    postcode = POSTCODE_PATTERN.search(upper)
+    if postcode:
+        candidates.append((f'postcode:{postcode.group(1)}{postcode.group(2)}', 0))
+
+    district = postcode.group(1) if postcode else postcode_district(location, address)
+    if district is None:
+        return candidates
+    if isinstance(address, str):
+        for part in address.split(',')[:MAX_STREET_PARTS]:
+            street = normalize_street(part)
+            if street:
+                candidates.append((f'street:{district.upper()}:{street}', 1))
+    candidates.append((f'district:{district}', 2))
+    return candidates
+
+
+def resolve(gazetteer:Gazetteer, queries:dict):
+    """
+    Looks queries up in the gazetteer, all in one binary search.
+
+    Parameters:
+        - gazetteer (Gazetteer): The gazetteer.
+        - queries (dict): query -> (address, location).
+
+    Returns:
+        dict of query -> (lat, lon, level), with None values for queries not found.
+    """
+    owners, keys, levels = [], [], []
+    for owner, (address, location) in enumerate(queries.values()):
+        for key, level in candidate_keys(address, location):
+            owners.append(owner)
+            keys.append(key)
+            levels.append(level)
+
+    # districts and streets are shared by many queries, each distinct key is hashed once
+    codes, unique_keys = pd.factorize(pd.Series(keys, dtype=object))
+    positions = gazetteer.lookup(hash_keys(unique_keys)[codes])
+    found = np.flatnonzero(positions >= 0)
+    # candidates of a query are contiguous and ordered by precision, so its first hit is the best one
+    owners = np.asarray(owners, dtype=np.int64)
+    hit_owners, first = np.unique(owners[found], return_index=True)
+    best = found[first]
+    rows = gazetteer.table[positions[best]]
+    levels = np.asarray(levels)[best]
+
+    answers = dict.fromkeys(queries, (None, None, None))
+    names = list(queries)
+    for owner, lat, lon, level in zip(hit_owners.tolist(), rows['lat'].tolist(), rows['lon'].tolist(), levels.tolist()):
+        answers[names[owner]] = (lat, lon, LEVELS[level])
+    return answers
+
+
+def geocode_listings(listings:pd.DataFrame, gazetteer=None, cache=None):
+    """
+    Adds coordinates to listings.
+
+    Parameters:
+        - listings (DataFrame): Listings with the address and location columns.
+        - gazetteer (Gazetteer, optional): Opened from GAZETTEER_PATH by default.
+        - cache (GeocodeCache, optional): Answers are reused and stored there; no cache when None.
+
+    Returns:
+        dataframe: listings with lat and lon columns (NaN when not found) and a geocode_level
+        column saying which of LEVELS the coordinates are from.
+    """
+    if gazetteer is None:
+        gazetteer = Gazetteer()
+    addresses = listings['address'].astype(object).where(listings['address'].notna(), None).tolist()
+    locations = listings['location'].astype(object).where(listings['location'].notna(), None).tolist()
+
+    # one query per distinct address and location, so repeated listings are resolved once
+    rows = [f'{address}|{location}' for address, location in zip(addresses, locations)]
+    queries = dict(zip(rows, zip(addresses, locations)))
+
+    answers = cache.get(queries, gazetteer.version) if cache is not None else {}
+    missing = {query: pair for query, pair in queries.items() if query not in answers}
+    if missing:
+        resolved = resolve(gazetteer, missing)
+        if cache is not None:
+            cache.put(resolved, gazetteer.version)
+        answers.update(resolved)
+    print(f'geocoded {len(rows)} listings: {len(queries)} distinct addresses, {len(missing)} not cached')
+
+    result = listings.copy()
+    coordinates = [answers[row] for row in rows]
+    result['lat'] = np.array([np.nan if lat is None else lat for lat, _, _ in coordinates])
+    result['lon'] = np.array([np.nan if lon is None else lon for _, lon, _ in coordinates])
+    result['geocode_level'] = pd.Categorical([level for _, _, level in coordinates], categories=LEVELS)
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    postcodes = read_postcodes(sys.argv[1])
+    streets = read_open_names(sys.argv[2]) if len(sys.argv) > 2 else None
+    build_gazetteer(postcodes, streets=streets)
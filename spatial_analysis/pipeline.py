@@ -0,0 +1,418 @@
+"""
+************************************************
+MEMOIZED PIPELINE OF THE SPATIAL STATISTICS WORKFLOW
+************************************************
+Spatial_Statistics.ipynb as named stages: download the robbery data, rename
+its columns, build the GeoDataFrame, keep one year, build the weights, run
+global and local Moran's I; download and clean the neighbourhood profiles,
+load the neighbourhood boundaries, join them and count the robberies per
+neighbourhood.
+
+Every stage's output is a DataFrame or GeoDataFrame saved as parquet, under a
+key hashing the stage's name, its parameters, its code and the keys of the
+stages it reads. The code covers the stage function and the source of the
+spatial_analysis modules it imports directly, e.g. weights for build_weights;
+modules those import in turn and installed packages (esda, geopandas) are not
+hashed, so clear the cache or force the stages after upgrading them. A run only computes the stages whose key has no file yet;
+changing the year, for example, recomputes the filter and everything after
+it but never downloads again. Keys are known before anything runs, so stages
+that are up to date are not even loaded unless a stale stage or the caller
+needs their output. Stages whose inputs are ready run at the same time on a
+pool of threads: the crime download, the profile download and the boundaries
+do not wait for each other.
+"""
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from scipy import sparse
+
+
+PIPELINE_CACHE = 'data_output/pipeline_cache'
+# the notebook's names of the robbery columns it keeps
+CRIME_COLUMNS = ('location_type', 'premises_type', 'offence', 'reportedyear', 'reportedmonth', 'Latitude', 'Longitude')
+# the neighbourhood profile characteristics the notebook keeps
+PROFILE_COLUMNS = ('Population, 2016', 'Youth (15-24 years)', 'Total income: Average amount ($)', 'Unemployment rate',
+                   'Unemployment rate (Males)', 'Working Age (25-54 years)')
+
+
+class Stage:
+    """
+    A named step of a pipeline.
+
+    Parameters:
+        - name (str): The stage's name, unique in its pipeline.
+        - function (function): Called as function(*outputs of inputs, **params), returns a
+          DataFrame or GeoDataFrame.
+        - inputs (tuple): Names of the stages whose outputs it takes, in order.
+        - params (dict): Keyword parameters, JSON serialisable.
+    """
+
+    def __init__(self, name:str, function, inputs=(), params=None):
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.params = params or {}
+
+    def __repr__(self):
+        return f'Stage({self.name}, inputs={self.inputs}, params={self.params})'
+
+
+def _code_version(function):
+    """
+    Source of a stage function and of the spatial_analysis modules it imports, inside its body
+    or at the top of its module, so editing a helper such as knn_weights changes the key.
+    """
+    try:
+        sources = [inspect.getsource(function).encode('utf-8')]
+    except (OSError, TypeError):
+        return repr(function).encode('utf-8')
+
+    modules = set()
+    for name in function.__code__.co_names:
+        value = function.__globals__.get(name)
+        if value is None:
+            # a module imported in the body, e.g. spatial_analysis.weights
+            module = name
+        else:
+            module = getattr(value, '__module__', None) or getattr(value, '__name__', None)
+        if isinstance(module, str) and module.startswith('spatial_analysis.'):
+            modules.add(module)
+    for module in sorted(modules):
+        spec = importlib.util.find_spec(module)
+        if spec is not None and spec.origin and os.path.exists(spec.origin):
+            with open(spec.origin, 'rb') as file:
+                sources.append(file.read())
+    return b'\0'.join(sources)
+
+
+class Pipeline:
+    """
+    Stages cached on disk, run in dependency order with independent stages in parallel.
+
+    Parameters:
+        - cache (str): Directory of the stages' parquet files.
+        - workers (int): Stages running at once.
+    """
+
+    def __init__(self, cache=PIPELINE_CACHE, workers=4):
+        self.cache = cache
+        self.workers = workers
+        self.stages = {}
+
+    def add(self, name:str, function, inputs=(), **params):
+        """
+        Adds a stage, replacing any stage of the same name; its inputs must be added first.
+        A replaced stage may read stages added after it, as long as none of them reads it.
+        """
+        missing = [input for input in inputs if input not in self.stages]
+        if missing:
+            raise ValueError(f'stage {name} reads unknown stages {missing}')
+        replaced = self.stages.get(name)
+        self.stages[name] = Stage(name, function, inputs, params)
+        try:
+            self._order()
+        except ValueError:
+            self.stages[name] = replaced
+            raise
+        return self
+
+    def _order(self):
+        """
+        Names of the stages with every stage after its inputs, otherwise in the order they were added.
+        """
+        order, done, visiting = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f'stages {sorted(visiting)} read each other')
+            visiting.add(name)
+            for input in self.stages[name].inputs:
+                visit(input)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def set_params(self, name:str, **params):
+        """
+        Changes some parameters of a stage; it and the stages after it become stale.
+        """
+        self.stages[name].params = dict(self.stages[name].params, **params)
+        return self
+
+    def keys(self):
+        """
+        Cache key of every stage: a hash of its name, parameters and code (see _code_version),
+        and of its inputs' keys.
+        """
+        keys = {}
+        for name in self._order():
+            stage = self.stages[name]
+            digest = hashlib.blake2b(digest_size=12)
+            digest.update(json.dumps([name, stage.params], sort_keys=True, default=str).encode('utf-8'))
+            digest.update(_code_version(stage.function))
+            for input in stage.inputs:
+                digest.update(keys[input].encode('utf-8'))
+            keys[name] = digest.hexdigest()
+        return keys
+
+    def path(self, name:str, key:str):
+        return os.path.join(self.cache, f'{name}-{key}.parquet')
+
+    def stale(self, targets=None):
+        """
+        Names of the stages the targets need that have no cached output.
+        """
+        keys = self.keys()
+        return [name for name in self._needed(targets) if not os.path.exists(self.path(name, keys[name]))]
+
+    def _needed(self, targets):
+        """
+        The targets and every stage they depend on, each after its inputs.
+        """
+        needed = set()
+        pending = list(targets or self.stages)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].inputs)
+        return [name for name in self._order() if name in needed]
+
+    def _save(self, frame:pd.DataFrame, path:str):
+        os.makedirs(self.cache, exist_ok=True)
+        # write then rename, so an interrupted run never leaves a truncated output behind
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        frame.to_parquet(temp_path, index=True)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _load(path:str):
+        if b'geo' in (pq.read_schema(path).metadata or {}):
+            return gpd.read_parquet(path)
+        return pd.read_parquet(path)
+
+    def _materialize(self, name:str, path:str, compute:bool, inputs:list):
+        """
+        Computes and saves a stage's output, or loads it.
+        """
+        if not compute:
+            return self._load(path)
+        stage = self.stages[name]
+        start = time.perf_counter()
+        output = stage.function(*inputs, **stage.params)
+        self._save(output, path)
+        print(f'{name}: computed in {time.perf_counter() - start:.2f}s')
+        return output
+
+    def run(self, targets=None, force=()):
+        """
+        Brings the targets up to date.
+
+        Parameters:
+            - targets (list, optional): Names of the stages wanted, every stage by default.
+            - force (tuple): Stages to recompute even if cached, e.g. a download to refresh;
+              the stages after them follow as their keys do not change.
+
+        Returns:
+            dict of target name: output.
+        """
+        targets = list(targets or self.stages)
+        keys = self.keys()
+        needed = self._needed(targets)
+        forced = set(self._downstream(force))
+        compute = {name for name in needed if name in forced or not os.path.exists(self.path(name, keys[name]))}
+        # outputs to have in memory: the targets and the inputs of the stages computed
+        wanted = set(targets) | compute | {input for name in compute for input in self.stages[name].inputs}
+
+        outputs = {}
+        running = {}
+        remaining = [name for name in needed if name in wanted]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while remaining or running:
+                for name in list(remaining):
+                    stage = self.stages[name]
+                    # a stage loaded from the cache does not need its inputs
+                    if name not in compute or all(input in outputs for input in stage.inputs):
+                        inputs = [outputs[input] for input in stage.inputs] if name in compute else []
+                        future = executor.submit(self._materialize, name, self.path(name, keys[name]),
+                                                 name in compute, inputs)
+                        running[future] = name
+                        remaining.remove(name)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    outputs[running.pop(future)] = future.result()
+        return {name: outputs[name] for name in targets}
+
+    def _downstream(self, names):
+        """
+        The stages named and every stage reading them, directly or not.
+        """
+        found = set(names)
+        for name in self._order():
+            if any(input in found for input in self.stages[name].inputs):
+                found.add(name)
+        return found
+
+
+def download_crimes(url:str, where='1=1', cache=None):
+    """
+    The robbery features of the feature layer. The stage's output is already kept as parquet,
+    so no page cache by default and run(force=('crimes',)) downloads every page again; set
+    cache to a directory to resume interrupted downloads, whose pages a forced run then reuses.
+    """
+    from spatial_analysis.arcgis import download_features
+    return download_features(url, where, cache=cache)
+
+
+def rename_crimes(crimes:pd.DataFrame, columns=CRIME_COLUMNS):
+    """
+    The notebook's useful columns under its names, matched whatever the service's case.
+    """
+    by_lower = {column.lower(): column for column in crimes.columns}
+    return pd.DataFrame({column: crimes[by_lower[column.lower()]] for column in columns
+                         if column.lower() in by_lower})
+
+
+def build_geodataframe(crimes:pd.DataFrame):
+    """
+    Point geometries from Longitude and Latitude, in EPSG:4326.
+    """
+    return gpd.GeoDataFrame(crimes, geometry=gpd.points_from_xy(crimes['Longitude'], crimes['Latitude']),
+                            crs='EPSG:4326')
+
+
+def filter_year(crimes:gpd.GeoDataFrame, year=2016):
+    """
+    The crimes of one year that have coordinates.
+    """
+    year_values = pd.to_numeric(crimes['reportedyear'], errors='coerce')
+    return crimes[(crimes['Latitude'] > 0) & (year_values == year)].reset_index(drop=True)
+
+
+def build_weights(crimes:gpd.GeoDataFrame, k=10):
+    """
+    k nearest neighbour weights of the crimes, as an edge list (focal, neighbor, weight).
+    """
+    from spatial_analysis.weights import knn_weights
+    # the pipeline caches the edge list, the weights' own cache would only duplicate it
+    matrix = knn_weights(crimes, k=k, cache=None).sparse.tocoo()
+    return pd.DataFrame({'focal': matrix.row, 'neighbor': matrix.col, 'weight': matrix.data})
+
+
+def _weights_matrix(edges:pd.DataFrame, n:int):
+    return sparse.csr_matrix((edges['weight'], (edges['focal'], edges['neighbor'])), shape=(n, n))
+
+
+def global_moran(crimes:gpd.GeoDataFrame, edges:pd.DataFrame, column='Latitude', permutations=999, seed=0):
+    """
+    Global Moran's I of a column, one row.
+    """
+    from spatial_analysis.autocorrelation import Moran
+    moran = Moran(crimes[column], _weights_matrix(edges, len(crimes)), permutations, seed=seed)
+    return pd.DataFrame([{'column': column, 'I': moran.I, 'EI': moran.EI, 'p_sim': moran.p_sim, 'z_sim': moran.z_sim}])
+
+
+def local_moran(crimes:gpd.GeoDataFrame, edges:pd.DataFrame, column='Latitude', permutations=999, seed=0,
+                significance=0.05):
+    """
+    The crimes with their local Moran's I, quadrant, p_sim and significant spot label.
+    """
+    from spatial_analysis.autocorrelation import MoranLocal
+    moran = MoranLocal(crimes[column], _weights_matrix(edges, len(crimes)), permutations, seed=seed)
+    return crimes.assign(Is=moran.Is, q=moran.q, p_sim=moran.p_sim, spot=moran.spots(significance),
+                         spot_label=np.asarray(moran.labels(significance)))
+
+
+def clean_profiles(url:str, columns=PROFILE_COLUMNS):
+    """
+    The notebook's demographic data: the neighbourhood profiles transposed to one row per
+    neighbourhood, with the kept characteristics as numbers.
+    """
+    profiles = pd.read_csv(url)
+    table = profiles.transpose().reset_index().iloc[4:, :]
+    table.columns = table.iloc[0]
+    table = table[1:].reset_index(drop=True)
+    table = table[['Characteristic', *columns]].rename(columns={'Characteristic': 'Neighbourhood'})
+    # the first row is the city as a whole
+    table = table.iloc[1:].reset_index(drop=True)
+    for column in columns:
+        table[column] = pd.to_numeric(table[column].astype(str).str.replace(',', ''), errors='coerce')
+    return table
+
+
+def load_boundaries(url:str):
+    """
+    The neighbourhood polygons, sorted by name as the notebook numbers them.
+    """
+    boundaries = gpd.read_file(url)
+    return boundaries.sort_values(by='Neighbourhood').reset_index(drop=True)[['Neighbourhood', 'geometry']]
+
+
+def join_neighbourhoods(boundaries:gpd.GeoDataFrame, profiles:pd.DataFrame):
+    """
+    The boundaries with the profiles' characteristics, matched by position as the notebook's id_new.
+    """
+    profiles = profiles.drop(columns='Neighbourhood').reset_index(drop=True)
+    return gpd.GeoDataFrame(pd.concat([boundaries.reset_index(drop=True), profiles], axis=1),
+                            geometry='geometry', crs=boundaries.crs)
+
+
+def count_crimes(neighbourhoods:gpd.GeoDataFrame, crimes:gpd.GeoDataFrame):
+    """
+    The neighbourhoods with the number of crimes within each, the notebook's robbery count.
+    """
+    from spatial_analysis.aggregate import join_points
+    points = crimes.geometry.to_crs(neighbourhoods.crs) if crimes.crs != neighbourhoods.crs else crimes.geometry
+    _, polygon = join_points(points.x.to_numpy(), points.y.to_numpy(), neighbourhoods.geometry.to_numpy(), workers=1)
+    return neighbourhoods.assign(**{'robbery count': np.bincount(polygon, minlength=len(neighbourhoods))})
+
+
+def spatial_statistics_pipeline(crime_url:str, profile_url:str, boundary_url:str, where='1=1', year=2016, k=10,
+                                column='Latitude', permutations=999, seed=0, cache=PIPELINE_CACHE, workers=4):
+    """
+    The notebook's workflow as a Pipeline.
+
+    Parameters:
+        - crime_url (str): The crime feature layer, see arcgis.FeatureDownloader.
+        - profile_url (str): The neighbourhood profiles csv.
+        - boundary_url (str): The neighbourhood boundaries, any file geopandas reads.
+        - where (str): Filter of the crime features, e.g. "offence LIKE 'Robbery%'".
+        - year (int): Year of the crimes analysed.
+        - k (int): Neighbours of the weights.
+        - column (str): Column Moran's I is computed on, Latitude as in the notebook.
+        - permutations (int): Permutations of Moran's p_sim.
+        - seed (int): Seed of the permutations.
+        - cache (str): Directory of the stages' outputs.
+        - workers (int): Stages running at once.
+
+    Returns:
+        Pipeline, e.g. pipeline.run(['global_moran', 'crime_counts']).
+    """
+    moran_params = {'column': column, 'permutations': permutations, 'seed': seed}
+    return (Pipeline(cache, workers)
+            .add('crimes', download_crimes, url=crime_url, where=where)
+            .add('renamed', rename_crimes, ['crimes'])
+            .add('crime_points', build_geodataframe, ['renamed'])
+            .add('crimes_of_year', filter_year, ['crime_points'], year=year)
+            .add('weights', build_weights, ['crimes_of_year'], k=k)
+            .add('global_moran', global_moran, ['crimes_of_year', 'weights'], **moran_params)
+            .add('local_moran', local_moran, ['crimes_of_year', 'weights'], **moran_params)
+            .add('profiles', clean_profiles, url=profile_url)
+            .add('boundaries', load_boundaries, url=boundary_url)
+            .add('neighbourhoods', join_neighbourhoods, ['boundaries', 'profiles'])
+            .add('crime_counts', count_crimes, ['neighbourhoods', 'crimes_of_year']))
@@ -0,0 +1,316 @@
+"""
+************************************************
+SPATIAL INDEX OF LISTINGS
+************************************************
+Answers "which listings lie within 500 m of this one, with the same number of
+bedrooms and transaction" without scanning the whole table.
+
+Listings are projected to the British National Grid (EPSG:27700), so distances
+are in metres, and partitioned by (transaction, bedroom), each partition with
+its own KD-tree; a query filtered on both only searches one small tree. Every
+call to add writes a new segment, so a daily snapshot only costs building the
+trees of its own rows, and a listing already in an older segment is marked
+dead there instead of rewriting it. Once there are more than max_segments
+segments, they are compacted into one. Queries are batched: many points go
+through the trees in one call, on all cores.
+"""
+import glob
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+
+INDEX_PATH = 'data_output/listing_index'
+# bedroom code of listings without a bedroom count
+NO_BEDROOM = -1
+
+
+@lru_cache(maxsize=None)
+def _transformer():
+    from pyproj import Transformer
+    return Transformer.from_crs('EPSG:4326', 'EPSG:27700', always_xy=True)
+
+
+def to_grid(lat, lon):
+    """
+    Projects latitudes and longitudes to British National Grid eastings and northings in metres.
+
+    Returns:
+        (n, 2) array of eastings and northings.
+    """
+    x, y = _transformer().transform(np.asarray(lon, dtype='float64'), np.asarray(lat, dtype='float64'))
+    return np.column_stack([x, y])
+
+
+def _bedroom_codes(bedroom):
+    values = pd.to_numeric(pd.Series(bedroom), errors='coerce')
+    return values.fillna(NO_BEDROOM).astype('int16').to_numpy()
+
+
+class Segment:
+    """
+    Listings added in one call, with a KD-tree per (transaction, bedroom) partition.
+
+    Parameters:
+        - points (array): (n, 2) eastings and northings.
+        - urls (array): listing_url of every point, the identity of a listing across snapshots.
+        - transactions (array): rent or sales.
+        - bedrooms (array): Bedroom counts, NO_BEDROOM when unknown.
+        - alive (array, optional): False for listings superseded by a later segment.
+        - path (str, optional): The file the segment is saved in.
+    """
+
+    def __init__(self, points, urls, transactions, bedrooms, alive=None, path=None):
+        self.points = points
+        self.urls = urls
+        self.transactions = transactions
+        self.bedrooms = bedrooms
+        self.alive = np.ones(len(points), dtype=bool) if alive is None else alive
+        self.path = path
+
+        # rows of each (transaction, bedroom) partition; trees are built when a partition is first queried
+        keys = pd.DataFrame({'transaction': transactions, 'bedroom': bedrooms})
+        self.partitions = keys.groupby(['transaction', 'bedroom']).indices if len(keys) else {}
+        self.trees = {}
+
+    def __len__(self):
+        return len(self.points)
+
+    def tree(self, key):
+        if key not in self.trees:
+            # listings are not sorted spatially, so the unbalanced build is faster and queries as well
+            self.trees[key] = cKDTree(self.points[self.partitions[key]], balanced_tree=False)
+        return self.trees[key]
+
+    def save(self):
+        temp_path = f'{self.path}.{os.getpid()}.tmp.npz'
+        np.savez(temp_path, points=self.points, urls=self.urls, transactions=self.transactions,
+                 bedrooms=self.bedrooms, alive=self.alive)
+        os.replace(temp_path, self.path)
+
+    @classmethod
+    def load(cls, path:str):
+        with np.load(path) as data:
+            return cls(data['points'], data['urls'], data['transactions'], data['bedrooms'], data['alive'], path)
+
+
+class ListingIndex:
+    """
+    Persistent spatial index of geocoded listings.
+
+    Parameters:
+        - directory (str): Folder holding the segments; existing ones are loaded.
+        - max_segments (int): Segments kept before they are compacted into one.
+    """
+
+    def __init__(self, directory=INDEX_PATH, max_segments=8):
+        self.directory = directory
+        self.max_segments = max_segments
+        self.segments = [Segment.load(path) for path in sorted(glob.glob(os.path.join(directory, 'segment-*.npz')))]
+
+    def __len__(self):
+        return int(sum(segment.alive.sum() for segment in self.segments))
+
+    def _next_path(self):
+        number = int(os.path.basename(self.segments[-1].path)[8:-4]) + 1 if self.segments else 1
+        return os.path.join(self.directory, f'segment-{number:06d}.npz')
+
+    def add(self, listings:pd.DataFrame):
+        """
+        Adds listings as a new segment; older copies of the same listing_url stop being returned.
+
+        Parameters:
+            - listings (DataFrame): Geocoded listings, with lat, lon, transaction, bedroom and
+              listing_url columns. Rows without coordinates are skipped; rows without a
+              listing_url are kept as they are, with an empty url.
+
+        Returns:
+            int: The number of listings added.
+        """
+        located = listings[listings['lat'].notna() & listings['lon'].notna()]
+        # only listings with a url can be told apart; those without are all kept
+        has_url = located['listing_url'].notna()
+        located = located[~has_url | ~located['listing_url'].duplicated(keep='last')]
+        if located.empty:
+            return 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        urls = located['listing_url'].astype(object).where(has_url[located.index], '').to_numpy(dtype=str)
+        for segment in self.segments:
+            superseded = segment.alive & np.isin(segment.urls, urls[urls != ''])
+            if superseded.any():
+                segment.alive = segment.alive & ~superseded
+                segment.save()
+
+        segment = Segment(to_grid(located['lat'], located['lon']), urls,
+                          located['transaction'].astype(str).to_numpy(dtype=str),
+                          _bedroom_codes(located['bedroom']), path=self._next_path())
+        segment.save()
+        self.segments.append(segment)
+        print(f'listing index: {len(segment)} listings added, {len(self.segments)} segments')
+
+        if len(self.segments) > self.max_segments:
+            self.compact()
+        return len(segment)
+
+    def compact(self):
+        """
+        Merges every segment into one, dropping the dead listings.
+        """
+        if len(self.segments) < 2 and all(segment.alive.all() for segment in self.segments):
+            return
+        merged = Segment(*(np.concatenate([getattr(segment, name)[segment.alive] for segment in self.segments])
+                           for name in ('points', 'urls', 'transactions', 'bedrooms')), path=self._next_path())
+        merged.save()
+        for segment in self.segments:
+            os.remove(segment.path)
+        self.segments = [merged]
+        print(f'listing index: compacted into one segment of {len(merged)} listings')
+
+    def _groups(self, size, transaction, bedroom):
+        """
+        Splits query rows by the partitions they search.
+
+        Yields:
+            (query rows, predicate on partition keys) tuples.
+        """
+        transactions = np.broadcast_to(np.asarray(transaction, dtype=object), (size,))
+        bedrooms = np.broadcast_to(np.asarray(bedroom, dtype=object), (size,))
+        groups = {}
+        for row, key in enumerate(zip(transactions, bedrooms)):
+            groups.setdefault(key, []).append(row)
+
+        for (wanted_transaction, wanted_bedroom), rows in groups.items():
+            if wanted_bedroom is not None and not pd.isna(wanted_bedroom):
+                wanted_bedroom = int(wanted_bedroom)
+            elif wanted_bedroom is not None:
+                wanted_bedroom = NO_BEDROOM
+
+            def matches(key, transaction=wanted_transaction, bedroom=wanted_bedroom):
+                return (transaction is None or key[0] == transaction) and (bedroom is None or key[1] == bedroom)
+            yield np.asarray(rows), matches
+
+    def _partitions(self, matches):
+        for segment in self.segments:
+            for key, rows in segment.partitions.items():
+                if matches(key) and segment.alive[rows].any():
+                    yield segment, key, rows
+
+    def radius(self, lat, lon, radius:float, transaction=None, bedroom=None):
+        """
+        Finds the listings within radius metres of each query point.
+
+        Parameters:
+            - lat (array-like): Latitudes of the query points.
+            - lon (array-like): Longitudes of the query points.
+            - radius (float): Search radius in metres.
+            - transaction (str or array-like, optional): Only listings of this transaction, per
+              query when an array; any transaction when None.
+            - bedroom (int or array-like, optional): Only listings with this many bedrooms, as transaction.
+
+        Returns:
+            dataframe of (query, listing_url, distance): the position of the query point, one
+            row per listing found, distances in metres.
+        """
+        queries = to_grid(np.atleast_1d(lat), np.atleast_1d(lon))
+        frames = []
+        for query_rows, matches in self._groups(len(queries), transaction, bedroom):
+            points = queries[query_rows]
+            for segment, key, rows in self._partitions(matches):
+                found = segment.tree(key).query_ball_point(points, radius, workers=-1)
+                counts = np.fromiter((len(hits) for hits in found), dtype=np.int64, count=len(found))
+                if not counts.sum():
+                    continue
+                owners = np.repeat(np.arange(len(points)), counts)
+                hits = rows[np.concatenate([hits for hits in found if hits]).astype(np.int64)]
+                keep = segment.alive[hits]
+                owners, hits = owners[keep], hits[keep]
+                distance = np.hypot(*(segment.points[hits] - points[owners]).T)
+                frames.append(pd.DataFrame({'query': query_rows[owners], 'listing_url': segment.urls[hits],
+                                            'distance': distance}))
+
+        if not frames:
+            return pd.DataFrame({'query': pd.Series(dtype='int64'), 'listing_url': pd.Series(dtype=str),
+                                 'distance': pd.Series(dtype='float64')})
+        return pd.concat(frames, ignore_index=True).sort_values(['query', 'distance'], ignore_index=True)
+
+    def nearest(self, lat, lon, k:int, transaction=None, bedroom=None, max_distance=np.inf):
+        """
+        Finds the k nearest listings of each query point.
+
+        Parameters:
+            - lat (array-like): Latitudes of the query points.
+            - lon (array-like): Longitudes of the query points.
+            - k (int): Number of neighbours.
+            - transaction (str or array-like, optional): See radius.
+            - bedroom (int or array-like, optional): See radius.
+            - max_distance (float): Neighbours further than this many metres are left out.
+
+        Returns:
+            dataframe of (query, rank, listing_url, distance), rank 0 being the nearest.
+        """
+        queries = to_grid(np.atleast_1d(lat), np.atleast_1d(lon))
+        frames = []
+        for query_rows, matches in self._groups(len(queries), transaction, bedroom):
+            points = queries[query_rows]
+            distances, urls = [], []
+            for segment, key, rows in self._partitions(matches):
+                # ask for enough neighbours that k are left once the dead ones are dropped
+                dead = int((~segment.alive[rows]).sum())
+                wanted = min(len(rows), k + dead)
+                distance, position = segment.tree(key).query(points, wanted, distance_upper_bound=max_distance,
+                                                             workers=-1)
+                distance, position = distance.reshape(len(points), wanted), position.reshape(len(points), wanted)
+                missing = position == len(rows)
+                hits = rows[np.where(missing, 0, position)]
+                distances.append(np.where(missing | ~segment.alive[hits], np.inf, distance))
+                urls.append(segment.urls[hits])
+            if not distances:
+                continue
+
+            distances, urls = np.hstack(distances), np.hstack(urls)
+            order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+            distances = np.take_along_axis(distances, order, axis=1)
+            urls = np.take_along_axis(urls, order, axis=1)
+            found = np.isfinite(distances)
+            owners, ranks = np.nonzero(found)
+            frames.append(pd.DataFrame({'query': query_rows[owners], 'rank': ranks, 'listing_url': urls[found],
+                                        'distance': distances[found]}))
+
+        if not frames:
+            return pd.DataFrame({'query': pd.Series(dtype='int64'), 'rank': pd.Series(dtype='int64'),
+                                 'listing_url': pd.Series(dtype=str), 'distance': pd.Series(dtype='float64')})
+        return pd.concat(frames, ignore_index=True).sort_values(['query', 'rank'], ignore_index=True)
+
+    def comparables(self, listings:pd.DataFrame, radius=500.0, k=None):
+        """
+        Finds each listing's comparables: same transaction and bedrooms, within radius metres
+        or, when k is given, its k nearest; the listing itself is left out.
+
+        Parameters:
+            - listings (DataFrame): Geocoded listings, as for add.
+            - radius (float): Search radius in metres, also the cut off of the k nearest.
+            - k (int, optional): Number of nearest comparables instead of all within radius.
+
+        Returns:
+            dataframe with the query's position in listings, as radius or nearest.
+        """
+        located = listings.reset_index(drop=True)
+        located = located[located['lat'].notna() & located['lon'].notna()]
+        arguments = dict(transaction=located['transaction'].astype(str).to_numpy(dtype=object),
+                         bedroom=located['bedroom'].astype(object).to_numpy())
+        if k is None:
+            found = self.radius(located['lat'], located['lon'], radius, **arguments)
+        else:
+            found = self.nearest(located['lat'], located['lon'], k + 1, max_distance=radius, **arguments)
+
+        found['query'] = located.index.to_numpy()[found['query'].to_numpy()]
+        own_url = listings['listing_url'].astype(str).to_numpy()[found['query'].to_numpy()]
+        found = found[found['listing_url'].to_numpy() != own_url]
+        if k is not None:
+            found = found.assign(rank=found.groupby('query').cumcount())
+            found = found[found['rank'] < k]
+        return found.reset_index(drop=True)